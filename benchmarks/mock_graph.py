@@ -0,0 +1,322 @@
+"""A local stand-in for the Graph and token endpoints, for benchmarks and offline experiments.
+
+    with MockGraphServer(messages=5000, throttle_every=50) as server:
+        client = server.client()
+        for message in client.iter_messages('inbox', page_size=100):
+            ...
+
+It serves paged message lists with @odata.nextLink, single messages and their MIME content, $batch, sendMail,
+draft messages with upload sessions, calendarView and the token endpoint. Every throttle_every-th Graph request gets a 429 with
+a Retry-After header. Nothing leaves localhost.
+"""
+import base64
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from ts_microsoftgraph.auth import Auth
+from ts_microsoftgraph.client import Client
+
+_MESSAGES = re.compile(r'^/v1\.0/(?P<context>me|users/[^/]+)/mailFolders/(?P<folder>[^/]+)/messages$')
+_MESSAGE = re.compile(r'^/v1\.0/(?P<context>me|users/[^/]+)/messages/(?P<id>[^/]+)(?P<value>/\$value)?$')
+_UPLOAD_SESSION = re.compile(r'^/v1\.0/(me|users/[^/]+)/messages/(?P<id>[^/]+)/attachments/createUploadSession$')
+_SEND_DRAFT = re.compile(r'^/v1\.0/(me|users/[^/]+)/messages/(?P<id>[^/]+)/send$')
+_DRAFTS = re.compile(r'^/v1\.0/(me|users/[^/]+)/messages$')
+_SEND_MAIL = re.compile(r'^/v1\.0/(me|users/[^/]+)/microsoft\.graph\.sendMail$')
+_CALENDAR_VIEW = re.compile(r'^/v1\.0/(me|users/[^/]+)/calendarView$')
+_USER = re.compile(r'^/v1\.0/(me|users/[^/]+)$')
+_FOLDERS = re.compile(r'^/v1\.0/(me|users/[^/]+)/mailFolders/?$')
+_TOKEN = re.compile(r'^/[^/]+/oauth2/v2\.0/token$')
+_UPLOAD = re.compile(r'^/upload/(?P<session>[0-9]+)$')
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+def _json(status, value, headers=None):
+    _headers = {'Content-Type': 'application/json'}
+    if headers:
+        _headers.update(headers)
+    return status, _headers, json.dumps(value).encode('utf-8')
+
+
+def _error(status, code, message, headers=None):
+    return _json(status, {'error': {'code': code, 'message': message}}, headers)
+
+
+class MockGraphServer(object):
+    """A threaded HTTP/1.1 server on 127.0.0.1 answering like Graph for the calls the benchmarks make."""
+
+    def __init__(self, messages=1000, body_size=2048, mime_size=1024 * 1024, throttle_every=None, retry_after=0,
+                 token_delay=0.0, latency=0.0, events_per_day=8):
+        """
+        Args:
+            messages: the number of messages in every folder.
+            body_size: the size of each message's body content, in characters.
+            mime_size: the size of each message's MIME content, in bytes.
+            throttle_every: answer every n-th Graph request with a 429, None to never throttle.
+            retry_after: the Retry-After value sent with the 429s, in seconds.
+            token_delay: seconds the token endpoint takes to answer.
+            latency: seconds added to every Graph response.
+            events_per_day: the number of half-hour meetings every day in the calendar, which also has a three-day
+                event every tenth day (from 2021-01-01).
+        """
+        self.messages = messages
+        self.body_size = body_size
+        self.mime_size = mime_size
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.token_delay = token_delay
+        self.latency = latency
+        self.events_per_day = events_per_day
+        self._lock = threading.Lock()
+        self._counts = {'graph': 0, 'token': 0, 'throttled': 0, 'batch': 0, 'upload': 0, 'sent': 0}
+        self._uploads = {}
+        self._drafts = 0
+        self._mime = self._make_mime(mime_size)
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self._httpd.server_address[1])
+
+    def start(self):
+        server = self
+
+        class Handler(_Handler):
+            mock = server
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='mock-graph', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def counts(self):
+        """The number of Graph, token, throttled, $batch, upload and sent requests served so far."""
+        with self._lock:
+            return dict(self._counts)
+
+    def reset_counts(self):
+        with self._lock:
+            for name in self._counts:
+                self._counts[name] = 0
+
+    def auth(self, auth_class=Auth, **kwargs):
+        """An Auth whose token requests go to this server, holding a token valid for an hour."""
+        auth = auth_class('client-id', 'mock-tenant', 'secret', scope='offline_access', **kwargs)
+        auth._authority = self.url + 'mock-tenant'
+        auth._set_token(self._token())
+        return auth
+
+    def client(self, client_class=Client, auth=None, **kwargs):
+        """A client_class instance (Client or AsyncClient) sending its requests to this server."""
+        resource_client = type('Mock' + client_class.__name__, (client_class,), {'RESOURCE': self.url})
+        return resource_client(auth if auth is not None else self.auth(), **kwargs)
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+            return self._counts[name]
+
+    @staticmethod
+    def _token():
+        return {'token_type': 'Bearer', 'access_token': 'mock-access-' + str(time.time()),
+                'refresh_token': 'mock-refresh', 'expires_in': 3600}
+
+    @staticmethod
+    def _make_mime(size):
+        header = (b'From: Mock Sender <sender@example.com>\r\nTo: someone@example.com\r\nSubject: benchmark\r\n'
+                  b'Content-Type: text/plain; charset=utf-8\r\n\r\n')
+        line = b'The quick brown fox jumps over the lazy dog. 0123456789\r\n'
+        body = line * (max(0, size - len(header)) // len(line) + 1)
+        return (header + body)[:size]
+
+    def _message(self, context, folder, index):
+        return {
+            '@odata.etag': 'W/"{}"'.format(index),
+            'id': 'AAMkAD{:08d}'.format(index),
+            'parentFolderId': folder,
+            'subject': 'Message {}'.format(index),
+            'bodyPreview': 'Preview of message {}'.format(index),
+            'body': {'contentType': 'text', 'content': 'x' * self.body_size},
+            'from': {'emailAddress': {'name': 'Sender {}'.format(index % 50), 'address': 'sender@example.com'}},
+            'toRecipients': [{'emailAddress': {'name': context, 'address': 'someone@example.com'}}],
+            'receivedDateTime': '2020-09-10T{:02d}:{:02d}:00Z'.format(index // 60 % 24, index % 60),
+            'isRead': index % 3 == 0,
+            'hasAttachments': False,
+            'importance': 'normal',
+        }
+
+    def handle(self, method, url, headers, body):
+        """Answer one request: returns (status, headers, body bytes). Used by the HTTP handler and by $batch."""
+        split = urlsplit(url)
+        path = split.path
+        query = {key: values[0] for key, values in parse_qs(split.query).items()}
+        if _TOKEN.match(path):
+            self._count('token')
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            return _json(200, self._token())
+        upload = _UPLOAD.match(path)
+        if upload:
+            return self._upload(method, upload.group('session'), headers, body)
+        count = self._count('graph')
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle_every and count % self.throttle_every == 0 and not path.endswith('$batch'):
+            self._count('throttled')
+            return _error(429, 'TooManyRequests', 'Application is over its MailboxConcurrency limit.',
+                          {'Retry-After': str(self.retry_after)})
+        if path == '/v1.0/$batch' and method == 'POST':
+            return self._batch(json.loads(body))
+        match = _MESSAGES.match(path)
+        if match and method == 'GET':
+            return self._message_page(match.group('context'), match.group('folder'), query, split.path)
+        match = _MESSAGE.match(path)
+        if match and method == 'GET':
+            if match.group('value'):
+                return 200, {'Content-Type': 'text/plain'}, self._mime
+            index = int(re.sub(r'\D', '', match.group('id')) or 0)
+            return _json(200, self._message(match.group('context'), 'inbox', index))
+        match = _UPLOAD_SESSION.match(path)
+        if match and method == 'POST':
+            item = json.loads(body)['AttachmentItem']
+            with self._lock:
+                session = str(len(self._uploads) + 1)
+                self._uploads[session] = {'size': item['size'], 'received': 0}
+            return _json(201, {'uploadUrl': self.url + 'upload/' + session,
+                               'expirationDateTime': '2030-01-01T00:00:00Z', 'nextExpectedRanges': ['0-']})
+        if _SEND_DRAFT.match(path) and method == 'POST':
+            self._count('sent')
+            return 202, {}, b''
+        if _DRAFTS.match(path) and method == 'POST':
+            with self._lock:
+                self._drafts += 1
+                draft = 'draft{}'.format(self._drafts)
+            return _json(201, {'id': draft, 'isDraft': True})
+        if _SEND_MAIL.match(path) and method == 'POST':
+            self._count('sent')
+            return 202, {}, b''
+        if _CALENDAR_VIEW.match(path) and method == 'GET':
+            return self._calendar_view(query, split.path)
+        if _FOLDERS.match(path) and method == 'GET':
+            return _json(200, {'value': [{'id': name, 'displayName': name.title(), 'totalItemCount': self.messages}
+                                         for name in ('inbox', 'drafts', 'sentitems', 'deleteditems')]})
+        if _USER.match(path) and method == 'GET':
+            return _json(200, {'id': 'mock-user', 'displayName': 'Mock User', 'mail': 'someone@example.com',
+                               'userPrincipalName': 'someone@example.com'})
+        return _error(404, 'ResourceNotFound', 'No mock for {} {}'.format(method, path))
+
+    def _message_page(self, context, folder, query, path):
+        top = int(query.get('$top', 10))
+        skip = int(query.get('$skip', 0))
+        end = min(skip + top, self.messages)
+        page = {'value': [self._message(context, folder, index) for index in range(skip, end)]}
+        if end < self.messages:
+            next_query = dict(query, **{'$top': top, '$skip': end})
+            page['@odata.nextLink'] = self.url.rstrip('/') + path + '?' + urlencode(next_query)
+        return _json(200, page)
+
+    def _event(self, event_id, start, duration):
+        end = start + duration
+        return {'id': event_id, 'subject': 'Event ' + event_id, 'type': 'occurrence',
+                'start': {'dateTime': start.strftime('%Y-%m-%dT%H:%M:%S.0000000'), 'timeZone': 'UTC'},
+                'end': {'dateTime': end.strftime('%Y-%m-%dT%H:%M:%S.0000000'), 'timeZone': 'UTC'}}
+
+    def _calendar_view(self, query, path):
+        window_start = datetime.strptime(query['startDateTime'].rstrip('Z'), '%Y-%m-%dT%H:%M:%S')
+        window_end = datetime.strptime(query['endDateTime'].rstrip('Z'), '%Y-%m-%dT%H:%M:%S')
+        origin = datetime(2021, 1, 1)
+        events = []
+        day = max(0, (window_start - origin).days - 3)
+        while origin + timedelta(days=day) < window_end:
+            midnight = origin + timedelta(days=day)
+            candidates = [('EV{:05d}{:02d}'.format(day, slot), midnight + timedelta(hours=8, minutes=30 * slot),
+                           timedelta(minutes=30)) for slot in range(self.events_per_day)]
+            if day % 10 == 0:
+                candidates.append(('LONG{:05d}'.format(day), midnight + timedelta(hours=12), timedelta(days=3)))
+            events.extend(self._event(*candidate) for candidate in candidates
+                          if candidate[1] < window_end and candidate[1] + candidate[2] > window_start)
+            day += 1
+        events.sort(key=lambda event: event['start']['dateTime'])
+        top = int(query.get('$top', 10))
+        skip = int(query.get('$skip', 0))
+        page = {'value': events[skip:skip + top]}
+        if skip + top < len(events):
+            next_query = dict(query, **{'$top': top, '$skip': skip + top})
+            page['@odata.nextLink'] = self.url.rstrip('/') + path + '?' + urlencode(next_query)
+        return _json(200, page)
+
+    def _batch(self, payload):
+        self._count('batch')
+        responses = []
+        for request in payload['requests']:
+            body = request.get('body')
+            status, headers, content = self.handle(request['method'], '/v1.0' + request['url'],
+                                                   request.get('headers', {}),
+                                                   json.dumps(body).encode('utf-8') if body is not None else b'')
+            response = {'id': request['id'], 'status': status, 'headers': headers}
+            if content:
+                if headers.get('Content-Type') == 'application/json':
+                    response['body'] = json.loads(content)
+                else:
+                    response['body'] = base64.b64encode(content).decode('ascii')
+            responses.append(response)
+        return _json(200, {'responses': responses})
+
+    def _upload(self, method, session, headers, body):
+        with self._lock:
+            state = self._uploads.get(session)
+        if state is None:
+            return _error(404, 'ItemNotFound', 'No such upload session')
+        if method == 'GET':
+            return _json(200, {'nextExpectedRanges': ['{}-'.format(state['received'])]})
+        self._count('upload')
+        start, end, size = (int(value) for value in _CONTENT_RANGE.match(headers['Content-Range']).groups())
+        if start != state['received'] or end - start + 1 != len(body):
+            return _error(416, 'InvalidRange', 'Expected a range starting at {}'.format(state['received']))
+        state['received'] = end + 1
+        if state['received'] >= size:
+            return 201, {}, b''
+        return _json(200, {'nextExpectedRanges': ['{}-'.format(state['received'])]})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send the headers and the body in one write, and don't wait for delayed acks between keep-alive requests
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _serve(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, headers, content = self.mock.handle(self.command, self.path, self.headers, body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if content and self.command != 'HEAD':
+            self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _serve
@@ -0,0 +1,294 @@
+"""Offline benchmarks of the client against the local MockGraphServer.
+
+    python -m benchmarks.run --output report.json
+    python -m benchmarks.run --quick --only pagination mime_download
+    python -m benchmarks.run --output new.json --compare old.json
+
+The report is JSON: {'meta': {...versions...}, 'results': {benchmark: {metric: value}}}. Rates are per second,
+times in milliseconds and sizes in bytes, so two reports of different versions can be compared metric by metric.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from ts_microsoftgraph import decoder
+from ts_microsoftgraph.session import SessionPool
+
+from benchmarks.mock_graph import MockGraphServer
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def _rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+@benchmark
+def calls_per_second(quick):
+    calls = 200 if quick else 2000
+    with MockGraphServer() as server:
+        with server.client(session=SessionPool(pool_maxsize=8)) as client:
+            client.me()
+            start = time.perf_counter()
+            for _ in range(calls):
+                client.me()
+            sequential = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(lambda _: client.me(), range(calls)))
+            threaded = time.perf_counter() - start
+    return {'calls': calls, 'sequential_calls_per_second': _rate(calls, sequential),
+            'sequential_mean_ms': _ms(sequential / calls), 'threaded_8_calls_per_second': _rate(calls, threaded)}
+
+
+@benchmark
+def pagination(quick):
+    messages = 1000 if quick else 5000
+    result = {'messages': messages}
+    with MockGraphServer(messages=messages) as server:
+        with server.client() as client:
+            for prefetch in (False, True):
+                start = time.perf_counter()
+                count = sum(1 for _ in client.iter_messages('inbox', page_size=100, prefetch=prefetch))
+                elapsed = time.perf_counter() - start
+                assert count == messages, count
+                key = 'prefetch' if prefetch else 'sequential'
+                result[key + '_items_per_second'] = _rate(count, elapsed)
+                result[key + '_ms_per_page'] = _ms(elapsed / (messages / 100))
+    return result
+
+
+@benchmark
+def memory_per_page(quick):
+    messages = 500 if quick else 2000
+    result = {'messages': messages}
+    with MockGraphServer(messages=messages) as server:
+        with server.client() as client:
+            for page_size in (50, 200):
+                tracemalloc.start()
+                baseline = tracemalloc.get_traced_memory()[0]
+                for _ in client.iter_messages('inbox', page_size=page_size):
+                    pass
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                tracemalloc.stop()
+                result['page_{}_peak_bytes'.format(page_size)] = peak
+                result['page_{}_peak_bytes_per_item'.format(page_size)] = round(peak / page_size)
+    return result
+
+
+@benchmark
+def token_refresh_contention(quick):
+    rounds = 3 if quick else 10
+    threads = 32
+    requests, times = [], []
+    with MockGraphServer(token_delay=0.02) as server:
+        auth = server.auth()
+        for _ in range(rounds):
+            stale = auth.get_token()
+            barrier = threading.Barrier(threads)
+            server.reset_counts()
+
+            def refresh():
+                barrier.wait()
+                auth.refresh_token(stale_token=stale)
+
+            workers = [threading.Thread(target=refresh) for _ in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            times.append(time.perf_counter() - start)
+            requests.append(server.counts()['token'])
+        auth.close()
+    return {'threads': threads, 'rounds': rounds, 'token_requests_per_round': max(requests),
+            'mean_round_ms': _ms(sum(times) / rounds)}
+
+
+@benchmark
+def throttled_calls(quick):
+    calls = 100 if quick else 500
+    with MockGraphServer(throttle_every=5, retry_after=0) as server:
+        with server.client() as client:
+            start = time.perf_counter()
+            for _ in range(calls):
+                client.me()
+            elapsed = time.perf_counter() - start
+            metrics = client.throttle.metrics()
+        return {'calls': calls, 'calls_per_second': _rate(calls, elapsed), 'throttled': server.counts()['throttled'],
+                'retries': metrics['retries']}
+
+
+@benchmark
+def batch_vs_sequential(quick):
+    calls = 40 if quick else 200
+    with MockGraphServer(latency=0.002) as server:
+        with server.client() as client:
+            start = time.perf_counter()
+            for index in range(calls):
+                client.message_get('AAMkAD{:08d}'.format(index))
+            sequential = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with client.batch() as batch:
+                queued = [batch.message_get('AAMkAD{:08d}'.format(index)) for index in range(calls)]
+            batched = time.perf_counter() - start
+            assert all(request.result()['id'] for request in queued)
+    return {'calls': calls, 'sequential_calls_per_second': _rate(calls, sequential),
+            'batch_calls_per_second': _rate(calls, batched)}
+
+
+@benchmark
+def mime_download(quick):
+    size = (2 if quick else 16) * 1024 * 1024
+    result = {'mime_bytes': size}
+    with MockGraphServer(mime_size=size) as server:
+        with server.client() as client:
+            for compress in (False, True):
+                sink = io.BytesIO()
+                start = time.perf_counter()
+                info = client.message_download_mime('AAMkAD00000001', sink, compress=compress)
+                elapsed = time.perf_counter() - start
+                assert info['size'] == size, info
+                key = 'gzip' if compress else 'plain'
+                result[key + '_bytes_per_second'] = _rate(size, elapsed)
+                result[key + '_sink_bytes'] = len(sink.getvalue())
+    return result
+
+
+@benchmark
+def calendar_view_year(quick):
+    days = 91 if quick else 365
+    start = datetime(2021, 1, 1)
+    end = start + timedelta(days=days)
+    result = {'days': days}
+    with MockGraphServer(latency=0.01) as server:
+        with server.client() as client:
+            for key, slice_length, workers in (('serial', timedelta(days=days), 1), ('sliced', timedelta(days=7), 8)):
+                started = time.perf_counter()
+                events = list(client.calendar_view(start, end, slice_length=slice_length, max_workers=workers,
+                                                   page_size=50))
+                result[key + '_ms'] = _ms(time.perf_counter() - started)
+                result[key + '_events'] = len(events)
+    assert result['serial_events'] == result['sliced_events'], result
+    result['speedup'] = round(result['serial_ms'] / result['sliced_ms'], 2)
+    return result
+
+
+@benchmark
+def message_send_attachments(quick):
+    sends = 10 if quick else 50
+    large_size = (4 if quick else 16) * 1024 * 1024
+    result = {'small_sends': sends, 'large_attachment_bytes': large_size}
+    with tempfile.TemporaryDirectory() as directory:
+        small = []
+        for index in range(3):
+            path = os.path.join(directory, 'small{}.bin'.format(index))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(200 * 1024))
+            small.append(path)
+        large = os.path.join(directory, 'large.bin')
+        with open(large, 'wb') as f:
+            f.write(os.urandom(large_size))
+
+        with MockGraphServer() as server:
+            with server.client() as client:
+                start = time.perf_counter()
+                for _ in range(sends):
+                    client.message_send(subject='benchmark', recipients=['someone@example.com'], attachments=small)
+                elapsed = time.perf_counter() - start
+                result['small_sends_per_second'] = _rate(sends, elapsed)
+
+                server.reset_counts()
+                start = time.perf_counter()
+                client.message_send(subject='benchmark', recipients=['someone@example.com'], attachments=[large])
+                elapsed = time.perf_counter() - start
+                result['large_upload_bytes_per_second'] = _rate(large_size, elapsed)
+                result['large_upload_requests'] = server.counts()['upload']
+    return result
+
+
+def _version():
+    try:
+        from importlib.metadata import version
+        return version('ts-microsoftgraph-python')
+    except Exception:
+        return None
+
+
+def run(names=None, quick=False, progress=None):
+    """Run the benchmarks called names (all by default) and return the report dict."""
+    results = {}
+    for name in names or BENCHMARKS:
+        if progress is not None:
+            progress(name)
+        results[name] = BENCHMARKS[name](quick)
+    return {
+        'meta': {
+            'package_version': _version(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'decoder': decoder.decoder_name(),
+            'quick': quick,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """Returns [(benchmark, metric, baseline value, new value, ratio)] for the numeric metrics of both reports."""
+    rows = []
+    for name, metrics in report['results'].items():
+        old_metrics = baseline.get('results', {}).get(name, {})
+        for metric, value in metrics.items():
+            old = old_metrics.get(metric)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                rows.append((name, metric, old, value, round(value / old, 3)))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks against a local Graph stand-in server.')
+    parser.add_argument('--output', '-o', help='write the JSON report to this file (default: stdout)')
+    parser.add_argument('--quick', action='store_true', help='smaller workloads, for a smoke run')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='run only these benchmarks')
+    parser.add_argument('--compare', help='a previous report to compare the results with')
+    args = parser.parse_args(argv)
+
+    report = run(args.only, quick=args.quick, progress=lambda name: print('running', name, file=sys.stderr))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for name, metric, old, new, ratio in compare(report, baseline):
+            print('{:<28} {:<36} {:>14} {:>14} {:>8.3f}x'.format(name, metric, old, new, ratio), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
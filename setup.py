@@ -19,4 +19,8 @@ setup(name='ts-microsoftgraph-python',
       install_requires=[
           'requests'
       ],
+      extras_require={
+          'async': ['aiohttp'],
+          'fast': ['orjson']
+      },
       zip_safe=False)
@@ -0,0 +1,77 @@
+import hashlib
+import threading
+
+from ts_microsoftgraph.attachment_archive import (DOWNLOADED, SKIPPED, AttachmentIndex, _ByteBudget,
+                                                  download_attachments)
+
+
+class _ArchiveClient(object):
+    def __init__(self, attachments, contents):
+        self.attachments = attachments
+        self.contents = contents
+        self.downloaded = []
+
+    def iter_message_attachments(self, message_id, profile=None):
+        return iter(self.attachments[message_id])
+
+    def attachment_download(self, message_id, attachment_id, sink):
+        content = self.contents[attachment_id]
+        sink.write(content)
+        self.downloaded.append(attachment_id)
+        return {'hash': hashlib.sha256(content).hexdigest(), 'size': len(content)}
+
+
+def _attachment(attachment_id, name='image001.png', size=4, odata_type='#microsoft.graph.fileAttachment'):
+    attachment = {'id': attachment_id, 'name': name, 'size': size}
+    if odata_type is not None:
+        attachment['@odata.type'] = odata_type
+    return attachment
+
+
+def test_same_name_and_size_is_downloaded_by_default(tmp_path):
+    client = _ArchiveClient({'m1': [_attachment('a1')], 'm2': [_attachment('a2')]}, {'a1': b'logo', 'a2': b'icon'})
+    results = list(download_attachments(client, ['m1', 'm2'], str(tmp_path), max_workers=1))
+    assert sorted(r.status for r in results) == [DOWNLOADED, DOWNLOADED]
+    assert sorted(client.downloaded) == ['a1', 'a2']
+
+
+def test_attachments_without_a_type_are_downloaded(tmp_path):
+    client = _ArchiveClient({'m1': [_attachment('a1', odata_type=None),
+                                    _attachment('r1', odata_type='#microsoft.graph.referenceAttachment')]},
+                            {'a1': b'data'})
+    results = {r.attachment_id: r for r in download_attachments(client, [{'id': 'm1'}], str(tmp_path))}
+    assert results['a1'].status == DOWNLOADED
+    assert results['r1'].status == SKIPPED and results['r1'].path is None
+
+
+def test_index_finds_by_name_and_size_only_when_asked():
+    index = AttachmentIndex()
+    index.add({'message_id': 'm1', 'attachment_id': 'a1', 'name': 'image001.png', 'size': 4, 'hash': 'h',
+               'path': 'h.png'})
+    assert index.find('m1', {'id': 'a1'}) == 'h.png'
+    assert index.find('m2', _attachment('a2')) is None
+    assert index.find('m2', _attachment('a2'), by_name_size=True) == 'h.png'
+
+
+def test_byte_budget_caps_a_reservation_at_the_budget():
+    budget = _ByteBudget(100)
+    assert budget.acquire(250) == 100
+    budget.release(100)
+    assert budget.acquire(0) == 0
+
+
+def test_byte_budget_waits_for_room():
+    budget = _ByteBudget(100)
+    first = budget.acquire(60)
+    acquired = threading.Event()
+
+    def second():
+        budget.release(budget.acquire(50))
+        acquired.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not acquired.wait(0.1)
+    budget.release(first)
+    assert acquired.wait(5)
+    thread.join()
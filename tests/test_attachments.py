@@ -0,0 +1,85 @@
+import asyncio
+import base64
+import re
+
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer, _error
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.async_client import AsyncClient
+from ts_microsoftgraph.attachments import encode_file_base64
+
+_DRAFT = re.compile(r'^/v1\.0/me/messages/(?P<id>draft[0-9]+)$')
+
+
+class _Server(MockGraphServer):
+    def __init__(self, fail_uploads=False, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_uploads = fail_uploads
+        self.deleted = []
+
+    def handle(self, method, url, headers, body):
+        match = _DRAFT.match(url)
+        if match and method == 'DELETE':
+            self.deleted.append(match.group('id'))
+            return 204, {}, b''
+        if self.fail_uploads and url.startswith('/upload/') and method == 'PUT':
+            return _error(403, 'AccessDenied', 'Upload refused')
+        return super().handle(method, url, headers, body)
+
+
+@pytest.fixture
+def large_file(tmp_path):
+    path = tmp_path / 'large.bin'
+    path.write_bytes(b'x' * (1024 * 1024 + 17))
+    return str(path)
+
+
+def test_failed_upload_deletes_the_draft(large_file):
+    with _Server(fail_uploads=True) as server:
+        client = server.client()
+        with pytest.raises(exceptions.Forbidden):
+            client.message_send('subject', ['someone@example.com'], attachments=[large_file],
+                                upload_threshold=1024)
+        assert server.deleted == ['draft1']
+        assert server.counts()['sent'] == 0
+
+
+def test_async_send_uploads_large_attachments(large_file):
+    async def send(server):
+        async with server.client(client_class=AsyncClient) as client:
+            await client.message_send('subject', ['someone@example.com'], attachments=[large_file],
+                                      upload_threshold=1024)
+
+    with _Server() as server:
+        asyncio.run(send(server))
+        counts = server.counts()
+        assert counts['sent'] == 1
+        # 1 MB in 3200 KiB chunks
+        assert counts['upload'] == 1
+        assert server.deleted == []
+
+
+def test_async_failed_upload_deletes_the_draft(large_file):
+    async def send(server):
+        async with server.client(client_class=AsyncClient) as client:
+            await client.message_send('subject', ['someone@example.com'], attachments=[large_file],
+                                      upload_threshold=1024)
+
+    with _Server(fail_uploads=True) as server:
+        with pytest.raises(exceptions.Forbidden):
+            asyncio.run(send(server))
+        assert server.deleted == ['draft1']
+        assert server.counts()['sent'] == 0
+
+
+def test_encode_file_base64(tmp_path):
+    path = tmp_path / 'small.bin'
+    content = bytes(range(256)) * 4000 + b'tail'
+    path.write_bytes(content)
+    assert encode_file_base64(str(path)) == base64.b64encode(content).decode('ascii')
+
+
+def test_encode_file_base64_refuses_files_for_upload_sessions(large_file):
+    with pytest.raises(ValueError):
+        encode_file_base64(large_file, max_size=1024 * 1024)
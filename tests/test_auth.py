@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer, _error
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.auth import SCOPES, Auth, AuthScope, AuthScopeList
+from ts_microsoftgraph.client import Client
+
+
+def test_setting_client_token_feeds_the_auth():
+    auth = Auth('client-id', 'tenant', 'secret', scope='offline_access')
+    client, other = Client(auth), Client(auth)
+    client.token = {'access_token': 'abc', 'refresh_token': 'r', 'expires_in': 3600}
+    assert client.token['access_token'] == 'abc'
+    assert other.token['access_token'] == 'abc'
+    assert auth.expires_in(auth.get_token()) > 3500
+    client.token = None
+    assert client.token is None
+    with pytest.raises(exceptions.TokenRequired):
+        client.me()
+
+
+def test_setting_an_app_only_token():
+    auth = Auth('client-id', 'tenant', 'secret', app_only=True)
+    client = Client(auth, context='users/someone')
+    client.token = {'access_token': 'app', 'expires_at': time.time() + 3600}
+    assert auth.get_token()['access_token'] == 'app'
+
+
+def test_async_auto_refresh_survives_connection_errors():
+    aiohttp = pytest.importorskip('aiohttp')
+    from ts_microsoftgraph.async_client import AsyncAuth
+
+    class FlakyAuth(AsyncAuth):
+        attempts = 0
+
+        async def _post_token(self, data):
+            self.attempts += 1
+            if self.attempts == 1:
+                raise aiohttp.ClientConnectionError('connection reset')
+            return {'access_token': 'new', 'refresh_token': 'r', 'expires_in': 3600}
+
+    async def main():
+        auth = FlakyAuth('client-id', 'tenant', 'secret', scope='offline_access')
+        auth._set_token({'access_token': 'old', 'refresh_token': 'r', 'expires_in': 1})
+        auth.start_auto_refresh(skew=10, retry_interval=0.05)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if auth.get_token()['access_token'] == 'new':
+                break
+        auth.stop_auto_refresh()
+        return auth
+
+    auth = asyncio.run(main())
+    assert auth.attempts == 2
+    assert auth.get_token()['access_token'] == 'new'
+
+
+def test_scope_lists_share_the_scopes_table():
+    first, second = AuthScopeList(), AuthScopeList()
+    first.add_scope(AuthScope.MAIL_READ)
+    second.add_scope(AuthScope.OFFLINE_ACCESS)
+    assert first._lut is second._lut is SCOPES
+    assert first.as_list() == ['https://graph.microsoft.com/Mail.Read']
+    assert second.as_list() == ['offline_access']
+    assert set(SCOPES) == set(AuthScope)
+    with pytest.raises(TypeError):
+        SCOPES[AuthScope.MAIL_READ] = 'changed'
+
+
+def test_auth_scope_forms():
+    scopes = AuthScopeList()
+    scopes.add_scope(AuthScope.MAIL_READ)
+    scopes.add_scope(AuthScope.OFFLINE_ACCESS)
+    assert Auth('id', 'tenant', 'secret', scope=scopes)._scope == \
+        'https://graph.microsoft.com/Mail.Read offline_access'
+    assert Auth('id', 'tenant', 'secret', scope=AuthScope.MAIL_SEND)._scope == 'https://graph.microsoft.com/Mail.Send'
+    assert Auth('id', 'tenant', 'secret', scope=['openid', 'profile'])._scope == 'openid profile'
+    assert Auth('id', 'tenant', 'secret', scope=' email ')._scope == 'email'
+
+
+class _RevokingServer(MockGraphServer):
+    # rejects the first access token it sees, as if it had been revoked
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.revoked = None
+
+    def handle(self, method, url, headers, body):
+        if self.revoked is None and not url.split('?', 1)[0].endswith('/token'):
+            self.revoked = headers.get('Authorization')
+        if headers.get('Authorization') == self.revoked:
+            return _error(401, 'InvalidAuthenticationToken', 'Access token has expired or is not yet valid.')
+        return super().handle(method, url, headers, body)
+
+
+def test_get_valid_token_refreshes_ahead_of_the_expiry():
+    with MockGraphServer() as server:
+        auth = server.auth()
+        token = auth.get_token()
+        assert auth.get_valid_token() is token
+        token['expires_at'] = time.time() + 60
+        assert auth.get_valid_token()['access_token'] != token['access_token']
+        assert auth.expires_in(auth.get_token()) > 3500
+        assert server.counts()['token'] == 1
+
+
+def test_concurrent_refreshes_collapse_into_one_request():
+    with MockGraphServer(token_delay=0.1) as server:
+        auth = server.auth()
+        stale = auth.get_token()
+        threads = [threading.Thread(target=auth.refresh_token, kwargs={'stale_token': stale}) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert server.counts()['token'] == 1
+        assert auth.get_token()['access_token'] != stale['access_token']
+
+
+def test_clients_sharing_an_auth_see_the_refreshed_token():
+    with MockGraphServer() as server:
+        auth = server.auth()
+        first, second = server.client(auth=auth), server.client(auth=auth)
+        auth.refresh_token()
+        assert first.token is second.token is auth.get_token()
+        first.close()
+        second.close()
+
+
+def test_a_rejected_token_is_refreshed_and_the_call_retried_once():
+    with _RevokingServer() as server:
+        with server.client() as client:
+            assert client._get(client._base_url + 'me')['id']
+        assert server.counts()['token'] == 1
@@ -0,0 +1,47 @@
+import asyncio
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph.async_client import AsyncClient
+from ts_microsoftgraph.batch import Batch, BatchRequest
+
+
+def test_batch_is_built_like_its_client():
+    with MockGraphServer() as server:
+        client = server.client(context='users/someone')
+        batch = client.batch()
+        assert batch._base_url == client._base_url
+        assert batch._context_url == client._context_url
+        assert batch._session is client._session
+        assert batch._throttle is client._throttle
+        assert isinstance(batch, Batch)
+
+
+def test_throttled_items_are_sent_again():
+    with MockGraphServer(messages=50, throttle_every=3) as server:
+        client = server.client()
+        with client.batch() as b:
+            requests = [b.message_get('AAMkAD{:08d}'.format(index)) for index in range(10)]
+        assert [r.result()['subject'] for r in requests] == ['Message {}'.format(index) for index in range(10)]
+        counts = server.counts()
+        assert counts['throttled'] > 0
+        assert counts['batch'] > 1
+        assert client.throttle.metrics()['retries'] == counts['throttled']
+
+
+def test_async_throttled_items_are_sent_again():
+    async def run(server):
+        async with server.client(client_class=AsyncClient) as client:
+            async with client.batch() as b:
+                requests = [b.message_get('AAMkAD{:08d}'.format(index)) for index in range(10)]
+        return [r.result()['subject'] for r in requests]
+
+    with MockGraphServer(messages=50, throttle_every=3) as server:
+        assert asyncio.run(run(server)) == ['Message {}'.format(index) for index in range(10)]
+        assert server.counts()['throttled'] > 0
+
+
+def test_dependencies_outside_a_resent_batch_are_dropped():
+    first = BatchRequest('1', 'GET', '/me')
+    second = BatchRequest('2', 'GET', '/me/messages').depends_on(first)
+    assert Batch._batch_json([first, second])['requests'][1]['dependsOn'] == ['1']
+    assert 'dependsOn' not in Batch._batch_json([second])['requests'][0]
@@ -0,0 +1,32 @@
+from ts_microsoftgraph.attachments import file_attachment
+from ts_microsoftgraph.bulk import FAILED, AttachmentCache, OutgoingMessage, send_bulk
+
+
+def test_invalid_messages_fail_before_their_attachments_are_encoded(tmp_path):
+    flyer = tmp_path / 'flyer.pdf'
+    flyer.write_bytes(b'%PDF' * 1024)
+    cache = AttachmentCache()
+    messages = [OutgoingMessage('no-subject', '', ['someone@contoso.com'], attachments=[str(flyer)]),
+                OutgoingMessage('no-recipients', 'Flyer', [], attachments=[str(flyer)])]
+    results = list(send_bulk(object(), messages, per_minute=None, attachment_cache=cache))
+    assert sorted(r.id for r in results) == ['no-recipients', 'no-subject']
+    assert all(r.status == FAILED and isinstance(r.error, ValueError) for r in results)
+    assert cache.stats()['encoded'] == 0
+
+
+def test_attachment_cache_forgets_the_files_of_evicted_content(tmp_path):
+    cache = AttachmentCache(max_bytes=4096)
+    for index in range(20):
+        path = tmp_path / 'file{}.txt'.format(index)
+        path.write_bytes(str(index).encode('ascii') * 1000)
+        cache.attachment(str(path))
+    assert len(cache._encoded) <= 2
+    assert len(cache._digests) == len(cache._encoded)
+    assert set(cache._signatures) == set(cache._encoded)
+
+
+def test_attachments_are_named_after_the_file(tmp_path):
+    path = tmp_path / 'flyer.pdf'
+    path.write_bytes(b'%PDF')
+    assert AttachmentCache().attachment(str(path))['Name'] == 'flyer.pdf'
+    assert file_attachment(str(path))['Name'] == 'flyer.pdf'
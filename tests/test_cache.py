@@ -0,0 +1,162 @@
+import base64
+import json
+import re
+import time
+
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer, _json
+from ts_microsoftgraph.auth import Auth
+from ts_microsoftgraph.cache import MemoryCache, ResponseCache, SharedCache, SQLiteCache
+
+BASE = 'https://graph.microsoft.com/v1.0/'
+
+
+def _jwt(claims):
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode('utf-8')).decode('ascii').rstrip('=')
+    return 'header.' + payload + '.signature'
+
+
+def _user_auth(oid):
+    auth = Auth('client-id', 'tenant', 'secret', scope='offline_access')
+    auth._set_token({'access_token': _jwt({'oid': oid, 'tid': 'tenant'}), 'refresh_token': 'r', 'expires_in': 3600})
+    return auth
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'shared'])
+def cache(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryCache()
+    if request.param == 'sqlite':
+        cache = SQLiteCache(str(tmp_path / 'cache.db'))
+        request.addfinalizer(cache.close)
+        return cache
+    return SharedCache({})
+
+
+def test_identity_tells_delegated_users_apart():
+    alice, bob = _user_auth('alice-oid'), _user_auth('bob-oid')
+    assert alice.identity != bob.identity
+    assert alice.identity.endswith('|alice-oid')
+    assert ResponseCache.key('GET', BASE + 'me', None, 'me', alice.identity) != \
+        ResponseCache.key('GET', BASE + 'me', None, 'me', bob.identity)
+
+
+def test_identity_of_opaque_tokens_is_never_shared():
+    auth = Auth('client-id', 'tenant', 'secret', scope='offline_access')
+    auth._set_token({'access_token': 'opaque-1', 'refresh_token': 'r'})
+    first = auth.identity
+    auth._set_token({'access_token': 'opaque-2', 'refresh_token': 'r'})
+    assert auth.identity != first
+
+
+def test_identity_uses_the_account_and_app_identity():
+    assert Auth('client-id', 'tenant', 'secret', account='acc').identity == 'tenant|client-id|acc'
+    assert Auth('client-id', 'tenant', 'secret', app_only=True).identity == 'tenant|client-id|'
+    assert Auth('client-id', 'other', 'secret', app_only=True).identity == 'other|client-id|'
+
+
+def test_users_sharing_a_cache_get_their_own_responses():
+    class Server(MockGraphServer):
+        def handle(self, method, url, headers, body):
+            if url.endswith('/v1.0/me') and method == 'GET':
+                self._count('graph')
+                claims = json.loads(base64.urlsafe_b64decode(
+                    headers['Authorization'].split('.')[1] + '=='))
+                return _json(200, {'id': claims['oid']})
+            return super().handle(method, url, headers, body)
+
+    cache = MemoryCache()
+    with Server() as server:
+        alice = server.client(auth=_user_auth('alice-oid'), cache=cache)
+        bob = server.client(auth=_user_auth('bob-oid'), cache=cache)
+        assert alice.me()['id'] == 'alice-oid'
+        assert bob.me()['id'] == 'bob-oid'
+        assert alice.me()['id'] == 'alice-oid'
+        assert server.counts()['graph'] == 2
+
+
+def test_write_drops_the_url_its_children_and_parents(cache):
+    keys = {}
+    for path in ('me/calendars', 'me/calendars/AAA', 'me/calendars/AAA/events', 'me/mailFolders', 'me'):
+        keys[path] = cache.key('GET', BASE + path, None, 'me', 'identity')
+        cache.store(keys[path], {'value': path}, url=BASE + path)
+    time.sleep(0.01)
+    cache.written(BASE + 'me/calendars/AAA')
+    assert cache.lookup(keys['me/calendars/AAA']) is None
+    assert cache.lookup(keys['me/calendars/AAA/events']) is None
+    assert cache.lookup(keys['me/calendars']) is None
+    assert cache.lookup(keys['me']) is None
+    assert cache.lookup(keys['me/mailFolders'])[0] == {'value': 'me/mailFolders'}
+
+
+def test_entries_stored_after_a_write_are_served(cache):
+    cache.written(BASE + 'me/calendars')
+    time.sleep(0.01)
+    key = cache.key('GET', BASE + 'me/calendars', None, 'me', 'identity')
+    cache.store(key, {'value': []}, url=BASE + 'me/calendars')
+    assert cache.lookup(key)[0] == {'value': []}
+
+
+def test_create_invalidates_the_cached_list():
+    calendars = []
+    _calendars = re.compile(r'^/v1\.0/me/calendars$')
+
+    class Server(MockGraphServer):
+        def handle(self, method, url, headers, body):
+            if _calendars.match(url.split('?')[0]):
+                self._count('graph')
+                if method == 'POST':
+                    calendars.append(json.loads(body))
+                    return _json(201, calendars[-1])
+                return _json(200, {'value': list(calendars)})
+            return super().handle(method, url, headers, body)
+
+    with Server() as server:
+        client = server.client(cache=MemoryCache())
+        assert client.calendars_list()['value'] == []
+        client.calendar_create('Team')
+        assert client.calendars_list()['value'] == [{'name': 'Team'}]
+        assert client.calendars_list()['value'] == [{'name': 'Team'}]
+        assert server.counts()['graph'] == 3
+
+
+def test_delta_and_next_pages_are_not_cached():
+    assert ResponseCache.cacheable(BASE + 'me/mailFolders/inbox/messages')
+    assert ResponseCache.cacheable(BASE + 'me/calendars', {'$top': 10})
+    assert not ResponseCache.cacheable(BASE + 'me/mailFolders/inbox/messages/delta')
+    assert not ResponseCache.cacheable(BASE + 'me/mailFolders/inbox/messages/delta?$deltatoken=abc')
+    assert not ResponseCache.cacheable(BASE + 'me/messages?%24skiptoken=abc')
+    assert not ResponseCache.cacheable(BASE + 'me/messages?$top=10&$skip=10')
+    assert not ResponseCache.cacheable(BASE + 'me/messages', {'$skip': 10})
+
+
+def test_next_pages_go_to_graph():
+    with MockGraphServer(messages=30) as server:
+        client = server.client(cache=MemoryCache())
+        assert len(list(client.iter_messages('inbox', page_size=10))) == 30
+        assert len(list(client.iter_messages('inbox', page_size=10))) == 30
+        # the first page comes from the cache the second time, the next ones don't
+        assert server.counts()['graph'] == 5
+
+
+def test_key_ignores_the_order_of_the_params():
+    first = ResponseCache.key('GET', BASE + 'me/messages', {'$top': 10, '$select': 'id'}, 'me', 'identity')
+    second = ResponseCache.key('GET', BASE + 'me/messages', {'$select': 'id', '$top': 10}, 'me', 'identity')
+    assert first == second
+
+
+def test_key_tells_requests_apart():
+    key = ResponseCache.key('GET', BASE + 'me/messages', {'$top': 10}, 'me', 'identity')
+    assert key != ResponseCache.key('GET', BASE + 'me/messages', {'$top': 20}, 'me', 'identity')
+    assert key != ResponseCache.key('GET', BASE + 'me/mailFolders', {'$top': 10}, 'me', 'identity')
+    assert key != ResponseCache.key('GET', BASE + 'me/messages', {'$top': 10}, 'users/someone', 'identity')
+    assert key != ResponseCache.key('GET', BASE + 'me/messages', {'$top': 10}, 'me', 'other identity')
+
+
+def test_cacheable():
+    assert ResponseCache.cacheable(BASE + 'me/mailFolders', {'$top': 10})
+    assert not ResponseCache.cacheable(BASE + 'me/mailFolders/inbox/messages/delta')
+    assert not ResponseCache.cacheable(BASE + 'me/messages?$skip=10')
+    assert not ResponseCache.cacheable(BASE + 'me/messages', {'$skiptoken': 'abc'})
+    assert not ResponseCache.cacheable(BASE + 'me/messages?$deltatoken=abc')
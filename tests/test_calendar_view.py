@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ts_microsoftgraph.calendar_view import merge_slice, merge_slices, slice_params, time_slices
+
+
+def _event(event_id, start):
+    return {'id': event_id, 'start': {'dateTime': start}, 'end': {'dateTime': start}}
+
+
+def test_time_slices_cover_the_window():
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    assert time_slices(start, '2021-01-20T00:00:00Z', timedelta(days=7)) == [
+        ('2021-01-01T00:00:00Z', '2021-01-08T00:00:00Z'),
+        ('2021-01-08T00:00:00Z', '2021-01-15T00:00:00Z'),
+        ('2021-01-15T00:00:00Z', '2021-01-20T00:00:00Z'),
+    ]
+    assert time_slices(start, start) == []
+    with pytest.raises(ValueError):
+        time_slices(start, '2021-01-20T00:00:00Z', timedelta(0))
+
+
+def test_slice_params_add_the_merge_fields():
+    params = slice_params({'$select': 'subject,start'}, 'a', 'b')
+    assert params['$select'] == 'subject,start,id,end'
+    assert (params['startDateTime'], params['endDateTime']) == ('a', 'b')
+    assert slice_params(None, 'a', 'b') == {'startDateTime': 'a', 'endDateTime': 'b'}
+
+
+def test_merge_slice_drops_the_events_of_the_previous_slice():
+    new, ids = merge_slice([_event('b', '2021-01-02'), _event('a', '2021-01-01')], frozenset({'a'}))
+    assert [event['id'] for event in new] == ['b']
+    assert ids == {'a', 'b'}
+
+
+def test_merge_slices_yields_each_occurrence_once_in_order():
+    # 'long' spans the three slices, 'x' the first two
+    slices = [
+        [_event('long', '2021-01-06'), _event('a', '2021-01-01'), _event('x', '2021-01-07')],
+        [_event('c', '2021-01-10'), _event('x', '2021-01-07'), _event('long', '2021-01-06')],
+        [_event('long', '2021-01-06'), _event('d', '2021-01-15')],
+    ]
+    assert [event['id'] for event in merge_slices(slices)] == ['a', 'long', 'x', 'c', 'd']
+
+
+def test_time_slices_take_naive_values_as_utc():
+    start = datetime(2021, 1, 1)
+    end = datetime(2021, 1, 3, 1, tzinfo=timezone(timedelta(hours=1)))
+    assert time_slices(start, end, timedelta(days=1)) == [
+        ('2021-01-01T00:00:00Z', '2021-01-02T00:00:00Z'),
+        ('2021-01-02T00:00:00Z', '2021-01-03T00:00:00Z'),
+    ]
+    assert time_slices('2021-01-01T00:00:00', '2021-01-01T12:00:00Z', timedelta(days=1)) == [
+        ('2021-01-01T00:00:00Z', '2021-01-01T12:00:00Z'),
+    ]
@@ -0,0 +1,41 @@
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.delta import CREATED, DELETED, DeltaSync
+
+
+class _DeltaClient(object):
+    # serves a folder's delta: the first round from message_delta, later rounds from the delta link
+    _context = 'me'
+
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self.expired = False
+
+    def message_delta(self, folder_id, params=None):
+        return {'value': [{'id': item_id} for item_id in self.ids], '@odata.deltaLink': 'delta-link'}
+
+    def _get(self, url):
+        if self.expired:
+            raise exceptions.Gone('the delta token has expired')
+        return {'value': [], '@odata.deltaLink': 'delta-link'}
+
+
+def test_resync_after_gone_reports_the_items_deleted_meanwhile():
+    client = _DeltaClient(['a', 'b', 'c'])
+    sync = DeltaSync(client, track_ids=True)
+    assert [(c.kind, c.id) for c in sync.messages('inbox')] == [(CREATED, 'a'), (CREATED, 'b'), (CREATED, 'c')]
+    client.ids = ['a', 'c', 'd']
+    client.expired = True
+    changes = [(c.kind, c.id) for c in sync.messages('inbox')]
+    assert changes == [(CREATED, 'a'), (CREATED, 'c'), (CREATED, 'd'), (DELETED, 'b')]
+    client.expired = False
+    assert list(sync.messages('inbox')) == []
+
+
+def test_resync_uses_the_callers_known_ids():
+    client = _DeltaClient(['a'])
+    sync = DeltaSync(client)
+    list(sync.messages('inbox'))
+    assert 'ids' not in sync._store.get(sync._key('messages', 'inbox'))
+    client.expired = True
+    changes = [(c.kind, c.id) for c in sync.messages('inbox', known_ids=lambda: ['a', 'x'])]
+    assert changes == [(CREATED, 'a'), (DELETED, 'x')]
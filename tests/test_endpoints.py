@@ -0,0 +1,56 @@
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph import endpoints
+
+
+class _PathServer(MockGraphServer):
+    # remembers the raw paths requested
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.paths = []
+
+    def handle(self, method, url, headers, body):
+        self.paths.append(url.split('?', 1)[0])
+        return super().handle(method, url, headers, body)
+
+
+def test_ids_are_url_encoded():
+    endpoint = endpoints.get('message_attachment_value')
+    assert endpoint.url('https://graph/v1.0/me', message_id='AA/b+c=', attachment_id='x y') == \
+        'https://graph/v1.0/me/messages/AA%2Fb%2Bc%3D/attachments/x%20y/$value'
+
+
+def test_constant_templates_are_appended_as_they_are():
+    assert endpoints.get('messages').url('https://graph/v1.0/me') == 'https://graph/v1.0/me/messages'
+    assert endpoints.get('batch').url('https://graph/v1.0/') == 'https://graph/v1.0/$batch'
+
+
+def test_missing_ids_raise():
+    with pytest.raises(KeyError):
+        endpoints.get('message').url('https://graph/v1.0/me')
+
+
+def test_register_replaces_an_endpoint():
+    original = endpoints.get('message')
+    try:
+        endpoints.register('message', '/messages/{message_id}/extra')
+        assert endpoints.get('message').url('p', message_id='1') == 'p/messages/1/extra'
+    finally:
+        endpoints.register('message', original.template)
+
+
+def test_context_prefix_is_built_once():
+    first = endpoints.context_prefix('https://graph/', 'v1.0', 'users/someone')
+    assert first == 'https://graph/v1.0/users/someone'
+    assert endpoints.context_prefix('https://graph/', 'v1.0', 'users/someone') is first
+
+
+def test_client_sends_encoded_ids_under_its_context():
+    with _PathServer() as server:
+        with server.client() as client:
+            message = client.message_get('AAMk/00000003+=')
+            other = client.for_context('users/someone')
+            other.message_get('AAMk00000004')
+    assert message['id']
+    assert server.paths == ['/v1.0/me/messages/AAMk%2F00000003%2B%3D', '/v1.0/users/someone/messages/AAMk00000004']
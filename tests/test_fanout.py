@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import pytest
+
+from ts_microsoftgraph.auth import Auth
+from ts_microsoftgraph.client import Client
+from ts_microsoftgraph.fanout import fan_out, fan_out_async
+
+
+def _contexts():
+    hot, cold = Auth('client-id', 'hot', 'secret', app_only=True), Auth('client-id', 'cold', 'secret', app_only=True)
+    return [(hot, 'users/hot{}'.format(index)) for index in range(5)] + [(cold, 'users/cold')]
+
+
+def test_async_hot_tenant_does_not_starve_the_others():
+    async def operation(client):
+        await asyncio.sleep(0.05)
+        return client._context
+
+    async def main():
+        client = Client(Auth('client-id', 'hot', 'secret', app_only=True))
+        return [r.result async for r in fan_out_async(client, _contexts(), operation, max_workers=2,
+                                                       per_tenant_limit=1)]
+
+    finished = asyncio.run(main())
+    assert sorted(finished) == sorted(context for _, context in _contexts())
+    assert finished.index('users/cold') <= 1
+
+
+def test_sync_hot_tenant_does_not_starve_the_others():
+    def operation(client):
+        time.sleep(0.05)
+        return client._context
+
+    client = Client(Auth('client-id', 'hot', 'secret', app_only=True))
+    finished = [r.result for r in fan_out(client, _contexts(), operation, max_workers=2, per_tenant_limit=1)]
+    assert finished.index('users/cold') <= 1
+
+
+def test_limits_below_one_are_rejected():
+    client = Client(Auth('client-id', 'tenant', 'secret', app_only=True))
+    with pytest.raises(ValueError):
+        list(fan_out(client, ['users/a'], 'me', per_tenant_limit=0))
+
+    async def main():
+        return [r async for r in fan_out_async(client, ['users/a'], 'me', per_tenant_limit=0)]
+
+    with pytest.raises(ValueError):
+        asyncio.run(main())
+
+
+def test_async_stopping_early_cancels_the_running_operations():
+    started, finished = [], []
+
+    async def operation(client):
+        started.append(client._context)
+        await asyncio.sleep(0.05 if client._context == 'users/0' else 5)
+        finished.append(client._context)
+        return client._context
+
+    async def main():
+        client = Client(Auth('client-id', 'tenant', 'secret', app_only=True))
+        results = fan_out_async(client, ['users/{}'.format(index) for index in range(5)], operation, max_workers=5)
+        async for result in results:
+            assert result.result == 'users/0'
+            break
+        await results.aclose()
+        await asyncio.sleep(0)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(main()) == []
+    assert len(started) == 5
+    assert finished == ['users/0']
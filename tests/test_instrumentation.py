@@ -0,0 +1,137 @@
+import logging
+
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.instrumentation import (Histogram, HistogramRegistry, Hook, LoggingHook, RequestRecord,
+                                               endpoint_of)
+
+
+class _Recorder(Hook):
+    def __init__(self):
+        self.requests = []
+        self.tokens = []
+
+    def on_request(self, record):
+        self.requests.append(record)
+
+    def on_token(self, record):
+        self.tokens.append(record)
+
+
+class _Failing(Hook):
+    def on_request(self, record):
+        raise RuntimeError('broken hook')
+
+
+def test_endpoint_of_replaces_ids():
+    assert endpoint_of('https://graph.microsoft.com/v1.0/users/a@b.c/messages/AAMk=') == '/users/{id}/messages/{id}'
+    assert endpoint_of('https://graph.microsoft.com/v1.0/me/mailFolders/inbox/messages') == \
+        '/me/mailFolders/inbox/messages'
+    assert endpoint_of('https://graph.microsoft.com/beta/me/messages/$count') == '/me/messages/$count'
+
+
+def test_request_record_reports_status_endpoint_and_sizes():
+    recorder = _Recorder()
+    with MockGraphServer() as server:
+        with server.client(hooks=[recorder]) as client:
+            client._get(client._base_url + 'me/mailFolders')
+    [record] = recorder.requests
+    assert record.method == 'GET'
+    assert record.endpoint == '/me/mailFolders'
+    assert record.status == 200
+    assert record.error is None
+    assert record.bytes_in > 0
+    assert record.retries == 0
+    assert record.elapsed >= record.ttfb >= 0
+
+
+def test_retries_and_their_waits_are_counted_once_per_call():
+    recorder = _Recorder()
+    with MockGraphServer(throttle_every=2, retry_after=0) as server:
+        with server.client(hooks=[recorder]) as client:
+            client._get(client._base_url + 'me')
+            client._get(client._base_url + 'me')
+        assert server.counts()['throttled'] == 1
+    assert [record.retries for record in recorder.requests] == [0, 1]
+    assert recorder.requests[1].status == 200
+
+
+def test_failed_calls_are_reported_with_their_error():
+    recorder = _Recorder()
+    with MockGraphServer() as server:
+        with server.client(hooks=[recorder]) as client:
+            with pytest.raises(exceptions.BaseError) as raised:
+                client._get(client._base_url + 'me/nothing/here')
+    [record] = recorder.requests
+    assert record.error is raised.value
+    assert record.status >= 400
+
+
+def test_a_failing_hook_does_not_break_the_call():
+    recorder = _Recorder()
+    with MockGraphServer() as server:
+        with server.client(hooks=[_Failing(), recorder]) as client:
+            assert client._get(client._base_url + 'me')['id']
+    assert len(recorder.requests) == 1
+
+
+def test_auth_reports_token_requests():
+    recorder = _Recorder()
+    with MockGraphServer() as server:
+        auth = server.auth(hooks=[recorder])
+        auth.refresh_token()
+    [record] = recorder.tokens
+    assert record.grant == 'refresh_token'
+    assert record.tenant == 'mock-tenant'
+    assert record.status == 200
+    assert record.error is None
+
+
+def test_histogram_quantiles_stay_within_the_observed_range():
+    histogram = Histogram()
+    for value in [0.001] * 90 + [0.2] * 10:
+        histogram.observe(value)
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) <= 0.005
+    assert 0.1 < histogram.quantile(0.99) <= 0.2
+    assert histogram.max == 0.2
+    assert Histogram().quantile(0.5) is None
+
+
+def test_registry_summary_groups_by_method_and_endpoint():
+    registry = HistogramRegistry()
+    with MockGraphServer(messages=10) as server:
+        with server.client(auth=server.auth(hooks=[registry]), hooks=[registry]) as client:
+            for _ in range(3):
+                client._get(client._base_url + 'me/mailFolders')
+            client._get(client._base_url + 'me')
+            client._auth.refresh_token()
+    summary = registry.summary()
+    assert set(summary) == {'GET /me/mailFolders', 'GET /me', 'token refresh_token'}
+    folders = summary['GET /me/mailFolders']
+    assert folders['count'] == 3
+    assert folders['statuses'] == {200: 3}
+    assert folders['errors'] == 0
+    assert folders['bytes_in'] > 0
+    assert folders['p50'] <= folders['max']
+    assert registry.histogram('GET /me').count == 1
+    assert registry.histogram('DELETE /me') is None
+    registry.reset()
+    assert registry.summary() == {}
+
+
+def test_logging_hook_warns_about_slow_and_failed_calls(caplog):
+    hook = LoggingHook(logger=logging.getLogger('tests.instrumentation'), level=logging.INFO, slow=1.0)
+    fast = RequestRecord('GET', 'https://graph.microsoft.com/v1.0/me', None)
+    fast.status = 200
+    fast.finish()
+    failed = RequestRecord('GET', 'https://graph.microsoft.com/v1.0/me', None)
+    failed.finish(RuntimeError('down'))
+    with caplog.at_level(logging.INFO, logger='tests.instrumentation'):
+        hook.on_request(fast)
+        hook.on_request(failed)
+    assert [entry.levelno for entry in caplog.records] == [logging.INFO, logging.WARNING]
+    assert 'GET /me 200' in caplog.records[0].getMessage()
+    assert "error=RuntimeError('down')" in caplog.records[1].getMessage()
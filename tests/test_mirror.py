@@ -0,0 +1,45 @@
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.mirror import MailboxMirror
+
+
+class _MailboxClient(object):
+    # one folder whose delta rounds return all of self.messages; the delta link can be made to expire
+    _context = 'me'
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.expired = False
+
+    def iter_mail_folders(self, params=None, page_size=None):
+        return iter([{'id': 'inbox', 'displayName': 'Inbox'}])
+
+    def message_delta(self, folder_id, params=None):
+        return {'value': [{'id': message_id, 'subject': subject, 'parentFolderId': 'inbox',
+                           'receivedDateTime': '2021-01-01T00:00:00Z'}
+                          for message_id, subject in sorted(self.messages.items())],
+                '@odata.deltaLink': 'delta-link'}
+
+    def _get(self, url):
+        if self.expired:
+            raise exceptions.Gone('the delta token has expired')
+        return {'value': [], '@odata.deltaLink': 'delta-link'}
+
+
+def test_whitespace_search_matches_everything(tmp_path):
+    client = _MailboxClient({'a': 'invoice overdue', 'b': 'lunch'})
+    with MailboxMirror(client, str(tmp_path / 'mirror.db'), contacts=False) as mirror:
+        mirror.refresh()
+        assert len(mirror.messages(search='   ')) == 2
+        assert [m['id'] for m in mirror.messages(search=' invoice ')] == ['a']
+
+
+def test_resync_after_gone_purges_the_rows_deleted_meanwhile(tmp_path):
+    client = _MailboxClient({'a': 'invoice', 'b': 'lunch', 'c': 'minutes'})
+    with MailboxMirror(client, str(tmp_path / 'mirror.db'), contacts=False) as mirror:
+        mirror.refresh()
+        del client.messages['b']
+        client.expired = True
+        counts = mirror.refresh()
+        assert counts['messages_deleted'] == 1
+        assert sorted(m['id'] for m in mirror.messages()) == ['a', 'c']
+        assert mirror.messages(search='lunch') == []
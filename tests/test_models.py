@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph.async_client import AsyncClient
+from ts_microsoftgraph.models import Event, Message, parse_datetime
+
+
+def test_parse_datetime_keeps_the_offset():
+    parsed = parse_datetime('2017-09-04T11:00:00.1234567+02:00')
+    assert parsed == datetime(2017, 9, 4, 11, 0, 0, 123456, tzinfo=timezone(timedelta(hours=2)))
+    assert parsed.utcoffset() == timedelta(hours=2)
+    assert parse_datetime('2017-09-04T11:00:00-05:30').utcoffset() == -timedelta(hours=5, minutes=30)
+
+
+def test_parse_datetime_utc_forms():
+    expected = datetime(2017, 9, 4, 11, 0, 0, tzinfo=timezone.utc)
+    assert parse_datetime('2017-09-04T11:00:00Z') == expected
+    assert parse_datetime('2017-09-04T11:00:00.0000000') == expected
+    assert parse_datetime('2017-09-04T11:00:00.0000000Z') == expected
+    assert parse_datetime('2017-09-04') == datetime(2017, 9, 4, tzinfo=timezone.utc)
+    assert parse_datetime(None) is None
+
+
+def test_event_time_zone_values_keep_the_wall_clock():
+    event = Event({'start': {'dateTime': '2021-01-01T09:00:00.0000000', 'timeZone': 'Pacific Standard Time'}})
+    assert event.start == datetime(2021, 1, 1, 9, 0)
+
+
+def test_client_methods_return_models():
+    with MockGraphServer(messages=5) as server:
+        client = server.client()
+        messages = list(client.iter_messages('inbox', model=True))
+        assert all(isinstance(message, Message) for message in messages)
+        assert messages[1].subject == 'Message 1'
+        assert messages[1].received_date_time == datetime(2020, 9, 10, 0, 1, tzinfo=timezone.utc)
+        assert messages[1].from_.address == 'sender@example.com'
+        assert isinstance(client.message_get('AAMkAD00000003', model=True), Message)
+        assert isinstance(client.message_get('AAMkAD00000003'), dict)
+
+
+def test_async_client_methods_return_models():
+    async def main(server):
+        async with server.client(client_class=AsyncClient) as client:
+            message = await client.message_get('AAMkAD00000003', model=True)
+            messages = [item async for item in client.iter_messages('inbox', model=True)]
+            return message, messages
+
+    with MockGraphServer(messages=3) as server:
+        message, messages = asyncio.run(main(server))
+        assert message.subject == 'Message 3'
+        assert [item.id for item in messages] == ['AAMkAD00000000', 'AAMkAD00000001', 'AAMkAD00000002']
+
+
+def test_parse_datetime_short_fractions_and_compact_offsets():
+    assert parse_datetime('2017-09-04T11:00:00.5Z') == datetime(2017, 9, 4, 11, 0, 0, 500000, tzinfo=timezone.utc)
+    assert parse_datetime('2017-09-04T11:00:00.12345') == datetime(2017, 9, 4, 11, 0, 0, 123450,
+                                                                   tzinfo=timezone.utc)
+    assert parse_datetime('2017-09-04T11:00:00+0200').utcoffset() == timedelta(hours=2)
+    assert parse_datetime('2017-09-04T11:00:00.1-0530').utcoffset() == -timedelta(hours=5, minutes=30)
@@ -0,0 +1,111 @@
+import os
+import re
+import threading
+
+from benchmarks.mock_graph import MockGraphServer, _error, _json
+from ts_microsoftgraph.onenote_export import EXPORTED, FAILED, MANIFEST_NAME, UNCHANGED, export_notebooks
+
+_ONENOTE = re.compile(r'^/v1\.0/me/onenote/(?P<path>.+)$')
+
+
+class _OneNoteServer(MockGraphServer):
+    # two notebooks, one with a section group, and a page with an image
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.listings = {
+            'notebooks': [{'id': 'nb1', 'displayName': 'Work'}, {'id': 'nb2', 'displayName': 'Private'}],
+            'notebooks/nb1/sections': [{'id': 's1', 'displayName': 'Notes'}],
+            'notebooks/nb1/sectionGroups': [{'id': 'g1', 'displayName': 'Archive'}],
+            'sectionGroups/g1/sections': [{'id': 's2', 'displayName': 'Old/2019'}],
+            'sectionGroups/g1/sectionGroups': [],
+            'notebooks/nb2/sections': [{'id': 's3', 'displayName': 'Diary'}],
+            'notebooks/nb2/sectionGroups': [],
+            'sections/s1/pages': [{'id': 'p1', 'title': 'Plan', 'lastModifiedDateTime': '2024-01-01T00:00:00Z'},
+                                  {'id': 'p2', 'title': 'Plan', 'lastModifiedDateTime': '2024-01-02T00:00:00Z'}],
+            'sections/s2/pages': [{'id': 'p3', 'title': 'Old', 'lastModifiedDateTime': '2019-05-01T00:00:00Z'}],
+            'sections/s3/pages': [{'id': 'p4', 'title': 'Day 1', 'lastModifiedDateTime': '2024-02-01T00:00:00Z'}],
+        }
+        self.missing = set()
+        self.downloads = []
+        self._downloads_lock = threading.Lock()
+
+    def handle(self, method, url, headers, body):
+        match = _ONENOTE.match(url.split('?', 1)[0])
+        if match is None:
+            return super().handle(method, url, headers, body)
+        path = match.group('path')
+        if path in self.listings:
+            return _json(200, {'value': self.listings[path]})
+        content = re.match(r'^pages/(?P<id>[^/]+)/content$', path)
+        if content:
+            page_id = content.group('id')
+            with self._downloads_lock:
+                self.downloads.append(page_id)
+            if page_id in self.missing:
+                return _error(404, 'ItemNotFound', 'The page was deleted.')
+            image = '<img src="{}v1.0/me/onenote/resources/r-{}/$value" data-src-type="image/png" />'.format(
+                self.url, page_id)
+            return 200, {'Content-Type': 'text/html'}, '<html><body>{}{}</body></html>'.format(
+                page_id, image).encode('utf-8')
+        resource = re.match(r'^resources/(?P<id>[^/]+)/\$value$', path)
+        if resource:
+            return 200, {'Content-Type': 'image/png'}, b'PNG ' + resource.group('id').encode('utf-8')
+        return _error(404, 'NotFound', path)
+
+
+def _by_id(results):
+    return {result.id: result for result in results}
+
+
+def test_exports_every_page_with_its_resources(tmp_path):
+    with _OneNoteServer() as server:
+        with server.client() as client:
+            results = _by_id(export_notebooks(client, str(tmp_path), max_workers=3))
+    assert set(results) == {'p1', 'p2', 'p3', 'p4'}
+    assert {result.status for result in results.values()} == {EXPORTED}
+    # pages with the same title don't collide, and names are made safe
+    assert results['p1'].path != results['p2'].path
+    assert results['p3'].path.startswith(os.path.join('Work', 'Archive', 'Old_2019') + os.sep)
+    html = (tmp_path / results['p4'].path).read_text()
+    assert 'src="Day%201%20%5B' in html and '_files/r-p4.png"' in html and '/onenote/resources/' not in html
+    folder = os.path.dirname(tmp_path / results['p4'].path)
+    files = [name for name in os.listdir(folder) if name.endswith('_files')]
+    assert len(files) == 1
+    assert open(os.path.join(folder, files[0], 'r-p4.png'), 'rb').read() == b'PNG r-p4'
+    assert (tmp_path / MANIFEST_NAME).exists()
+
+
+def test_a_second_export_only_fetches_the_changed_pages(tmp_path):
+    with _OneNoteServer() as server:
+        with server.client() as client:
+            list(export_notebooks(client, str(tmp_path)))
+            server.downloads.clear()
+            server.listings['sections/s1/pages'][1]['lastModifiedDateTime'] = '2024-03-01T00:00:00Z'
+            results = _by_id(export_notebooks(client, str(tmp_path)))
+    assert server.downloads == ['p2']
+    assert results['p2'].status == EXPORTED
+    assert {results[page_id].status for page_id in ('p1', 'p3', 'p4')} == {UNCHANGED}
+
+
+def test_a_renamed_page_replaces_its_old_file(tmp_path):
+    with _OneNoteServer() as server:
+        with server.client() as client:
+            old = _by_id(export_notebooks(client, str(tmp_path)))['p4'].path
+            server.listings['sections/s3/pages'][0].update(title='Day one',
+                                                            lastModifiedDateTime='2024-02-02T00:00:00Z')
+            new = _by_id(export_notebooks(client, str(tmp_path)))['p4'].path
+    assert new != old
+    assert (tmp_path / new).exists()
+    assert not (tmp_path / old).exists()
+
+
+def test_selected_notebooks_and_failed_pages(tmp_path):
+    with _OneNoteServer() as server:
+        server.missing.add('p2')
+        with server.client() as client:
+            results = _by_id(export_notebooks(client, str(tmp_path), notebooks=['Work'], resources=False))
+    assert set(results) == {'p1', 'p2', 'p3'}
+    assert results['p2'].status == FAILED and results['p2'].error is not None
+    assert results['p1'].status == EXPORTED
+    assert '/onenote/resources/' in (tmp_path / results['p1'].path).read_text()
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.startswith('.page-')]
@@ -0,0 +1,67 @@
+import asyncio
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph.async_client import AsyncClient
+from ts_microsoftgraph.paging import iter_items, page_params
+
+
+def _pages(count, size):
+    # fetch() for a collection of count items in pages of size, recording the links it was asked for
+    calls = []
+
+    def fetch(url, params):
+        calls.append((url, params))
+        start = 0 if url == 'first' else int(url)
+        page = {'value': list(range(start, min(start + size, count)))}
+        if start + size < count:
+            page['@odata.nextLink'] = str(start + size)
+        return page
+
+    return fetch, calls
+
+
+def test_page_params():
+    assert page_params({'$select': 'id'}, page_size=50) == {'$select': 'id', '$top': 50}
+    assert page_params({'$top': 100}, max_items=10) == {'$top': 10}
+    assert page_params(None, page_size=5, max_items=10) == {'$top': 5}
+    assert page_params() == {}
+
+
+def test_items_follow_the_next_links():
+    fetch, calls = _pages(25, 10)
+    assert list(iter_items(fetch, 'first', {'$top': 10})) == list(range(25))
+    assert calls == [('first', {'$top': 10}), ('10', None), ('20', None)]
+
+
+def test_max_items_stops_fetching():
+    fetch, calls = _pages(100, 10)
+    assert list(iter_items(fetch, 'first', max_items=15)) == list(range(15))
+    assert len(calls) == 2
+    assert list(iter_items(fetch, 'first', max_items=0)) == []
+
+
+def test_prefetch_gives_the_same_items():
+    fetch, _ = _pages(95, 10)
+    assert list(iter_items(fetch, 'first', prefetch=True)) == list(range(95))
+
+
+def test_iter_messages_pages_lazily():
+    with MockGraphServer(messages=120) as server:
+        client = server.client()
+        messages = client.iter_messages('inbox', page_size=50)
+        assert next(messages)['subject'] == 'Message 0'
+        assert server.counts()['graph'] == 1
+        assert sum(1 for _ in messages) == 119
+        assert server.counts()['graph'] == 3
+        assert len(list(client.iter_messages('inbox', page_size=50, max_items=60, prefetch=True))) == 60
+
+
+def test_async_iter_messages():
+    async def collect(server):
+        async with server.client(client_class=AsyncClient) as client:
+            return [message['subject'] async for message in client.iter_messages('inbox', page_size=20,
+                                                                                  max_items=45, prefetch=True)]
+
+    with MockGraphServer(messages=100) as server:
+        subjects = asyncio.run(collect(server))
+    assert subjects == ['Message {}'.format(index) for index in range(45)]
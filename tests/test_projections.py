@@ -0,0 +1,55 @@
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph import projections
+from ts_microsoftgraph.projections import HEADERS_ONLY, Projection, ProjectionWarning
+
+
+class _RecordingServer(MockGraphServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.queries = []
+
+    def handle(self, method, url, headers, body):
+        if '/token' not in url:
+            self.queries.append({key: values[0] for key, values in parse_qs(urlsplit(url).query).items()})
+        return super().handle(method, url, headers, body)
+
+
+def test_apply_merges_the_profile_and_explicit_params():
+    assert projections.apply('messages', 'sync-minimal', {'$top': 10, '$filter': 'isRead eq false'}) == {
+        '$select': 'id,parentFolderId,lastModifiedDateTime,changeKey,isRead', '$top': 10,
+        '$filter': 'isRead eq false'}
+    assert projections.apply('messages', None, {'$top': 10}) == {'$top': 10}
+    assert projections.apply('user', Projection('id, mail')) == {'$select': 'id,mail'}
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        projections.resolve('messages', 'no-such-profile')
+
+
+def test_registered_profile_is_used_by_the_client(monkeypatch):
+    monkeypatch.setitem(projections.PROFILES, 'messages', dict(projections.PROFILES['messages']))
+    projections.register_profile('messages', 'triage', Projection(['id', 'subject'], top=25))
+    with _RecordingServer(messages=30) as server:
+        client = server.client()
+        assert len(list(client.iter_messages('inbox', profile='triage', max_items=5))) == 5
+        client.message_get('AAMkAD00000001', profile=HEADERS_ONLY)
+    assert server.queries[0] == {'$select': 'id,subject', '$top': '5'}
+    assert '$top' not in server.queries[1]
+    assert server.queries[1]['$select'].split(',')[:2] == ['id', 'subject']
+
+
+def test_audit_reports_the_fields_never_read():
+    with MockGraphServer(messages=5) as server:
+        client = server.client(audit_projections=True)
+        for message in client.iter_messages('inbox'):
+            message['subject']
+            message.get('isRead')
+        with pytest.warns(ProjectionWarning):
+            unread = client.projection_audit.report()
+    assert 'subject' not in unread['messages'] and 'isRead' not in unread['messages']
+    assert 'body' in unread['messages']
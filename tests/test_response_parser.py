@@ -0,0 +1,22 @@
+import asyncio
+
+from ts_microsoftgraph.reponse_parser import parse_async
+
+
+class _Response(object):
+    def __init__(self, status, body, content_type='application/json'):
+        self.status = status
+        self.headers = {'Content-Type': content_type}
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+
+def test_parse_async_empty_json_body():
+    assert asyncio.run(parse_async(_Response(202, b''))) == b''
+    assert asyncio.run(parse_async(_Response(204, b''))) is None
+
+
+def test_parse_async_json_body():
+    assert asyncio.run(parse_async(_Response(200, b'{"id": "1"}'))) == {'id': '1'}
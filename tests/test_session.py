@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph.session import SessionPool
+
+
+class _CountingServer(MockGraphServer):
+    # counts the TCP connections accepted
+    def start(self):
+        super().start()
+        self.connections = 0
+        lock = threading.Lock()
+        process_request = self._httpd.process_request
+
+        def counting(request, client_address):
+            with lock:
+                self.connections += 1
+            return process_request(request, client_address)
+
+        self._httpd.process_request = counting
+        return self
+
+
+def test_calls_reuse_one_connection():
+    with _CountingServer() as server:
+        with server.client() as client:
+            for _ in range(10):
+                client._get(client._base_url + 'me/mailFolders')
+        assert server.connections == 1
+
+
+def test_without_keep_alive_every_call_connects():
+    with _CountingServer() as server:
+        with server.client(session=SessionPool(keep_alive=False)) as client:
+            for _ in range(3):
+                client._get(client._base_url + 'me/mailFolders')
+        assert server.connections == 3
+
+
+def test_client_closes_only_its_own_pool():
+    with MockGraphServer() as server:
+        shared = SessionPool()
+        with server.client(session=shared) as client:
+            client._get(client._base_url + 'me')
+        assert not shared.closed
+        with server.client() as client:
+            own = client._session
+        assert own.closed
+        with pytest.raises(RuntimeError):
+            own.get(server.url)
+        shared.close()
+
+
+def test_auth_token_calls_share_the_given_pool():
+    with _CountingServer() as server:
+        pool = SessionPool()
+        auth = server.auth(session=pool)
+        client = server.client(auth=auth, session=pool)
+        client._get(client._base_url + 'me')
+        auth.refresh_token()
+        client._get(client._base_url + 'me')
+        assert server.counts()['token'] == 1
+        assert server.connections == 1
+        pool.close()
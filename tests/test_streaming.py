@@ -0,0 +1,54 @@
+import asyncio
+import gzip
+import hashlib
+import io
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph.async_client import AsyncClient
+
+MESSAGE_ID = 'AAMkAD00000001'
+
+
+def test_iter_mime_streams_in_chunks():
+    with MockGraphServer(mime_size=300 * 1024) as server:
+        client = server.client()
+        chunks = list(client.message_iter_mime(MESSAGE_ID, chunk_size=64 * 1024))
+        assert max(len(chunk) for chunk in chunks) <= 64 * 1024
+        assert len(chunks) >= 5
+        assert b''.join(chunks) == server._mime
+
+
+def test_download_mime_to_a_file_object_with_its_hash():
+    with MockGraphServer(mime_size=200 * 1024) as server:
+        sink = io.BytesIO()
+        info = server.client().message_download_mime(MESSAGE_ID, sink)
+        assert sink.getvalue() == server._mime
+        assert info == {'size': len(server._mime), 'hash_name': 'sha256',
+                        'hash': hashlib.sha256(server._mime).hexdigest()}
+
+
+def test_download_mime_compressed_to_a_path(tmp_path):
+    path = str(tmp_path / 'message.eml.gz')
+    with MockGraphServer(mime_size=200 * 1024) as server:
+        info = server.client().message_download_mime(MESSAGE_ID, path, compress=True, hash_name='md5')
+        with gzip.open(path, 'rb') as f:
+            assert f.read() == server._mime
+        assert info['size'] == len(server._mime)
+        assert info['hash'] == hashlib.md5(server._mime).hexdigest()
+
+
+def test_async_download_mime(tmp_path):
+    path = str(tmp_path / 'message.eml')
+
+    async def download(server):
+        async with server.client(client_class=AsyncClient) as client:
+            chunks = [chunk async for chunk in client.message_iter_mime(MESSAGE_ID, chunk_size=32 * 1024)]
+            info = await client.message_download_mime(MESSAGE_ID, path)
+        return chunks, info
+
+    with MockGraphServer(mime_size=100 * 1024) as server:
+        chunks, info = asyncio.run(download(server))
+        assert b''.join(chunks) == server._mime
+        with open(path, 'rb') as f:
+            assert f.read() == server._mime
+        assert info['size'] == len(server._mime)
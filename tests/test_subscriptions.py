@@ -0,0 +1,165 @@
+import json
+import re
+import time
+
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer, _error, _json
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.subscriptions import MAX_LIFETIME, FileSubscriptionStore, SubscriptionManager
+
+_SUBSCRIPTION = re.compile(r'^/v1\.0/subscriptions(?:/(?P<id>[^/]+))?$')
+
+
+class _FailingBatch(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            raise exceptions.Unauthorized('the token could not be refreshed')
+
+    def subscription_create(self, *args):
+        return None
+
+    def subscription_renew(self, *args):
+        return None
+
+
+class _FailingClient(object):
+    def batch(self, max_workers=4):
+        return _FailingBatch()
+
+
+def test_failed_batch_reschedules_the_taken_records():
+    manager = SubscriptionManager(_FailingClient(), retry_interval=60)
+    for index in range(3):
+        manager.add('user{}'.format(index), 'created', 'https://example.com/notify',
+                    'users/user{}/messages'.format(index))
+    now = 1000000.0
+    assert manager.run_pending(now) == {'created': 0, 'renewed': 0, 'recreated': 0, 'failed': 3}
+    assert manager.next_due() == now + 60
+    record = manager.get('user0')
+    assert record['failures'] == 1
+    assert 'Unauthorized' in record['last_error']
+    # the next failure backs off further
+    manager.run_pending(now + 60)
+    assert manager.next_due() == now + 60 + 120
+
+
+class _SubscriptionServer(MockGraphServer):
+    # creates, renews, lists and deletes subscriptions, directly and within $batch
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.subscriptions = {}
+        self.deleted = []
+        self._next_id = 0
+
+    def handle(self, method, url, headers, body):
+        path = url.split('?', 1)[0]
+        match = _SUBSCRIPTION.match(path)
+        if match is None:
+            return super().handle(method, url, headers, body)
+        subscription_id = match.group('id')
+        with self._lock:
+            if subscription_id is None:
+                if method == 'GET':
+                    return _json(200, {'value': list(self.subscriptions.values())})
+                self._next_id += 1
+                subscription = dict(json.loads(body), id='sub-{}'.format(self._next_id))
+                self.subscriptions[subscription['id']] = subscription
+                return _json(201, subscription)
+            if subscription_id not in self.subscriptions:
+                return _error(404, 'ResourceNotFound', 'The object was not found.')
+            if method == 'DELETE':
+                self.deleted.append(subscription_id)
+                del self.subscriptions[subscription_id]
+                return 204, {}, b''
+            self.subscriptions[subscription_id].update(json.loads(body))
+            return _json(200, self.subscriptions[subscription_id])
+
+
+def _register(manager, count):
+    for index in range(count):
+        manager.add('user{}'.format(index), 'created', 'https://example.com/notify',
+                    'users/user{}/messages'.format(index), client_state='secret')
+
+
+def test_creates_then_renews_within_the_spread_window():
+    with _SubscriptionServer() as server:
+        with server.client() as client:
+            manager = SubscriptionManager(client)
+            _register(manager, 25)
+            now = time.time()
+            assert manager.run_pending(now) == {'created': 25, 'renewed': 0, 'recreated': 0, 'failed': 0}
+            assert server.counts()['batch'] == 2
+            records = [manager.get('user{}'.format(index)) for index in range(25)]
+            assert len(set(record['subscription_id'] for record in records)) == 25
+            for record in records:
+                assert record['expires_at'] == pytest.approx(now + MAX_LIFETIME, abs=1)
+                assert record['expires_at'] - 18 * 3600 <= record['renew_at'] <= record['expires_at'] - 6 * 3600
+            assert server.subscriptions[records[0]['subscription_id']]['clientState'] == 'secret'
+            # nothing is due before the earliest renewal time
+            assert manager.run_pending(now + 60)['renewed'] == 0
+            counts = manager.run_pending(max(record['renew_at'] for record in records))
+            assert counts == {'created': 0, 'renewed': 25, 'recreated': 0, 'failed': 0}
+            assert [manager.get('user{}'.format(index))['subscription_id'] for index in range(25)] == \
+                [record['subscription_id'] for record in records]
+
+
+def test_a_subscription_lost_by_graph_is_recreated():
+    with _SubscriptionServer() as server:
+        with server.client() as client:
+            manager = SubscriptionManager(client)
+            _register(manager, 2)
+            now = time.time()
+            manager.run_pending(now)
+            lost = manager.get('user0')['subscription_id']
+            del server.subscriptions[lost]
+            counts = manager.run_pending(now + MAX_LIFETIME - 6 * 3600)
+            assert counts == {'created': 0, 'renewed': 1, 'recreated': 1, 'failed': 0}
+            assert manager.get('user0')['subscription_id'] not in (None, lost)
+            assert manager.get('user0')['subscription_id'] in server.subscriptions
+
+
+def test_changing_a_subscription_deletes_the_one_it_replaces():
+    with _SubscriptionServer() as server:
+        with server.client() as client:
+            manager = SubscriptionManager(client)
+            manager.add('user0', 'created', 'https://example.com/notify', 'users/user0/messages')
+            manager.run_pending()
+            old = manager.get('user0')['subscription_id']
+            manager.add('user0', 'created,updated', 'https://example.com/notify', 'users/user0/messages')
+            assert manager.run_pending()['created'] == 1
+            assert server.deleted == [old]
+            manager.remove('user0')
+            assert server.subscriptions == {}
+            assert len(manager) == 0
+
+
+def test_reconcile_schedules_the_missing_subscriptions():
+    with _SubscriptionServer() as server:
+        with server.client() as client:
+            manager = SubscriptionManager(client)
+            _register(manager, 3)
+            manager.run_pending()
+            del server.subscriptions[manager.get('user1')['subscription_id']]
+            assert manager.reconcile() == ['user1']
+            assert manager.get('user1')['subscription_id'] is None
+            assert manager.run_pending()['created'] == 1
+            assert len(server.subscriptions) == 3
+
+
+def test_the_registry_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'subscriptions.json')
+    with _SubscriptionServer() as server:
+        with server.client() as client:
+            manager = SubscriptionManager(client, FileSubscriptionStore(path))
+            _register(manager, 2)
+            manager.run_pending()
+            before = manager.get('user1')
+            restarted = SubscriptionManager(client, FileSubscriptionStore(path))
+            assert len(restarted) == 2
+            assert restarted.get('user1') == before
+            assert restarted.run_pending()['created'] == 0
+            assert restarted.next_due() == min(manager.get(key)['renew_at'] for key in ('user0', 'user1'))
@@ -0,0 +1,84 @@
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer, _error
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.throttle import RetryPolicy, Throttle
+
+
+class _FailingServer(MockGraphServer):
+    # answers the first `failures` requests to /v1.0/me/failing with `status`, then 200
+    def __init__(self, status, failures=1, retry_after=None, **kwargs):
+        super().__init__(**kwargs)
+        self.status = status
+        self.failures = failures
+        self.failing_retry_after = retry_after
+        self.attempts = 0
+
+    def handle(self, method, url, headers, body):
+        if '/v1.0/me/failing' not in url:
+            return super().handle(method, url, headers, body)
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            retry_after = None
+            if self.failing_retry_after is not None:
+                retry_after = {'Retry-After': str(self.failing_retry_after)}
+            return _error(self.status, 'Failing', 'failing on purpose', retry_after)
+        return 200, {'Content-Type': 'application/json'}, b'{"ok": true}'
+
+
+def _throttled(retry_after):
+    ex = exceptions.TooManyRequests('throttled')
+    ex.headers = {'Retry-After': str(retry_after)}
+    return ex
+
+
+def test_retry_after_is_honoured_in_full():
+    policy = RetryPolicy(max_backoff=60)
+    assert policy.delay('POST', 0, _throttled(45)) == 45
+    assert policy.delay('POST', 0, _throttled(120)) is None
+    assert policy.delay('POST', 5, _throttled(1)) is None
+
+
+def test_transient_5xx_is_only_retried_for_idempotent_methods():
+    policy = RetryPolicy()
+    assert policy.delay('GET', 0, exceptions.InternalServerError('oops')) is not None
+    assert policy.delay('POST', 0, exceptions.InternalServerError('oops')) is None
+    assert policy.delay('POST', 0, exceptions.ServiceUnavailable('busy')) is not None
+
+
+def test_429_is_retried_after_retry_after():
+    with _FailingServer(429, failures=2, retry_after=0) as server:
+        client = server.client()
+        assert client._post(client._base_url + 'me/failing', json={}) == {'ok': True}
+        assert server.attempts == 3
+        assert client.throttle.metrics()['throttled'] == 2
+        assert client.throttle.metrics()['retries'] == 2
+
+
+def test_429_with_a_long_retry_after_is_raised_at_once():
+    with _FailingServer(429, retry_after=3600) as server:
+        client = server.client(throttle=Throttle(RetryPolicy(max_backoff=60)))
+        with pytest.raises(exceptions.TooManyRequests) as raised:
+            client._get(client._base_url + 'me/failing')
+        assert raised.value.retry_after == 3600
+        assert server.attempts == 1
+
+
+def test_500_on_post_is_not_retried():
+    with _FailingServer(500) as server:
+        client = server.client()
+        with pytest.raises(exceptions.InternalServerError):
+            client._post(client._base_url + 'me/failing', json={})
+        assert server.attempts == 1
+    with _FailingServer(500) as server:
+        client = server.client(throttle=Throttle(RetryPolicy(backoff_factor=0)))
+        assert client._get(client._base_url + 'me/failing') == {'ok': True}
+        assert server.attempts == 2
+
+
+def test_requests_with_files_are_never_retried():
+    with _FailingServer(503, retry_after=0) as server:
+        client = server.client()
+        with pytest.raises(exceptions.ServiceUnavailable):
+            client._post(client._base_url + 'me/failing', files={'file': ('a.txt', b'content')})
+        assert server.attempts == 1
@@ -0,0 +1,117 @@
+import asyncio
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph.async_client import AsyncAuth
+from ts_microsoftgraph import token_store
+from ts_microsoftgraph.token_store import FileTokenStore, SQLiteTokenStore
+
+_STORES = {'file': FileTokenStore, 'sqlite': SQLiteTokenStore}
+
+
+def _auth(url, store, app_only=False):
+    auth = AsyncAuth('client-id', 'mock-tenant', 'secret', scope='offline_access', token_store=store,
+                     app_only=app_only)
+    auth._authority = url + 'mock-tenant'
+    return auth
+
+
+async def _refresh(auth, stale):
+    try:
+        await auth.refresh_token(stale_token=stale)
+        return auth.get_token()['access_token']
+    finally:
+        await auth.close()
+
+
+def _worker(url, kind, path, barrier, results):
+    auth = _auth(url, _STORES[kind](path))
+    stale = auth.get_token()
+    barrier.wait()
+    results.put(asyncio.run(_refresh(auth, stale)))
+
+
+def _seed(server, store):
+    seeded = _auth(server.url, store)
+    seeded._set_token(server._token())
+    return seeded.get_token()
+
+
+@pytest.mark.parametrize('kind', sorted(_STORES))
+def test_async_processes_refresh_once(kind, tmp_path):
+    path = str(tmp_path / 'tokens')
+    with MockGraphServer(token_delay=0.3) as server:
+        _seed(server, _STORES[kind](path))
+        server.reset_counts()
+        context = multiprocessing.get_context('fork')
+        barrier, results = context.Barrier(4), context.Queue()
+        processes = [context.Process(target=_worker, args=(server.url, kind, path, barrier, results))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        tokens = {results.get(timeout=30) for _ in processes}
+        for process in processes:
+            process.join()
+        assert server.counts()['token'] == 1
+        assert len(tokens) == 1
+
+
+@pytest.mark.parametrize('kind', sorted(_STORES))
+def test_async_auths_sharing_a_store_on_one_loop(kind, tmp_path):
+    store = _STORES[kind](str(tmp_path / 'tokens'))
+    with MockGraphServer(token_delay=0.2) as server:
+        stale = _seed(server, store)
+        server.reset_counts()
+
+        async def main():
+            auths = [_auth(server.url, store) for _ in range(3)]
+            return await asyncio.gather(*[_refresh(auth, stale) for auth in auths])
+
+        assert len(set(asyncio.run(main()))) == 1
+        assert server.counts()['token'] == 1
+
+
+def test_async_app_only_token_is_requested_once(tmp_path):
+    store = SQLiteTokenStore(str(tmp_path / 'tokens'))
+    with MockGraphServer(token_delay=0.2) as server:
+        async def main():
+            auths = [_auth(server.url, store, app_only=True) for _ in range(3)]
+            try:
+                return await asyncio.gather(*[auth.acquire_token() for auth in auths])
+            finally:
+                for auth in auths:
+                    await auth.close()
+
+        assert len({token['access_token'] for token in asyncio.run(main())}) == 1
+        assert server.counts()['token'] == 1
+
+
+class _LockedMsvcrt(object):
+    # msvcrt as seen while another process holds the lock file
+    LK_NBLCK, LK_UNLCK = 2, 0
+
+    def __init__(self):
+        self.attempts = 0
+
+    def locking(self, fd, mode, size):
+        self.attempts += 1
+        raise OSError('Permission denied')
+
+
+def test_windows_lock_gives_up_after_its_timeout(tmp_path, monkeypatch):
+    msvcrt = _LockedMsvcrt()
+    monkeypatch.setattr(token_store, 'fcntl', None)
+    monkeypatch.setattr(token_store, 'msvcrt', msvcrt, raising=False)
+    lock = token_store._FileLock(str(tmp_path / 'tokens.lock'), timeout=0.2)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        with lock:
+            pass
+    assert 0.2 <= time.monotonic() - started < 2
+    assert 1 < msvcrt.attempts < 20
+    # the thread lock was released again
+    assert lock._lock.acquire(blocking=False)
@@ -0,0 +1,96 @@
+import io
+import json
+import threading
+
+import pytest
+
+from benchmarks.mock_graph import MockGraphServer
+from ts_microsoftgraph.webhooks import NotificationDispatcher, WebhookReceiver, _notification
+
+
+def _body(*client_states, resource='Users/u1/Messages/m1'):
+    return json.dumps({'value': [{'subscriptionId': 's1', 'changeType': 'updated', 'resource': resource,
+                                  'resourceData': {'id': 'm1'}, 'clientState': state}
+                                 for state in client_states]}).encode('utf-8')
+
+
+class _Collector(object):
+    def __init__(self):
+        self.handled = []
+        self.lock = threading.Lock()
+
+    def __call__(self, notification, item):
+        with self.lock:
+            self.handled.append((notification, item))
+
+
+def test_validation_token_is_echoed():
+    receiver = WebhookReceiver(NotificationDispatcher(_Collector()))
+    status, headers, body = receiver.handle('POST', 'validationToken=Validation%3A+Token+123', None)
+    assert status == '200 OK'
+    assert ('Content-Type', 'text/plain') in headers
+    assert body == b'Validation: Token 123'
+
+
+def test_validation_token_through_wsgi():
+    receiver = WebhookReceiver(NotificationDispatcher(_Collector()))
+    started = []
+    environ = {'REQUEST_METHOD': 'POST', 'QUERY_STRING': 'validationToken=abc', 'CONTENT_LENGTH': '0',
+               'wsgi.input': io.BytesIO(b'')}
+    assert receiver(environ, lambda status, headers: started.append(status)) == [b'abc']
+    assert started == ['200 OK']
+
+
+@pytest.mark.parametrize('client_state', ['wrong', 'sécret', 12345, None, ['secret']])
+def test_bad_client_state_is_dropped(client_state):
+    dispatcher = NotificationDispatcher(_Collector())
+    receiver = WebhookReceiver(dispatcher, client_state='secret')
+    status, _, _ = receiver.handle('POST', '', _body(client_state))
+    assert status == '202 Accepted'
+    assert receiver.invalid == 1
+    assert dispatcher.pending() == 0
+
+
+def test_matching_client_state_is_queued():
+    dispatcher = NotificationDispatcher(_Collector())
+    receiver = WebhookReceiver(dispatcher, client_state={'sécret', 'other'})
+    assert receiver.handle('POST', '', _body('sécret'))[0] == '202 Accepted'
+    assert receiver.invalid == 0
+    assert dispatcher.pending() == 1
+
+
+def test_full_queue_answers_503():
+    receiver = WebhookReceiver(NotificationDispatcher(_Collector(), max_pending=1), retry_after=7)
+    assert receiver.handle('POST', '', _body('a', resource='Users/u1/Messages/m1'))[0] == '202 Accepted'
+    status, headers, _ = receiver.handle('POST', '', _body('a', resource='Users/u1/Messages/m2'))
+    assert status == '503 Service Unavailable'
+    assert ('Retry-After', '7') in headers
+
+
+def test_notifications_for_one_resource_are_coalesced():
+    collector = _Collector()
+    dispatcher = NotificationDispatcher(collector, workers=2, coalesce_delay=0.2)
+    receiver = WebhookReceiver(dispatcher)
+    for change_type in ('created', 'updated', 'updated'):
+        body = json.dumps({'value': [{'subscriptionId': 's1', 'changeType': change_type,
+                                      'resource': 'Users/u1/Messages/m1'}]}).encode('utf-8')
+        receiver.handle('POST', '', body)
+    receiver.handle('POST', '', _body(None, resource='Users/u1/Messages/m2'))
+    with dispatcher:
+        assert dispatcher.join(5)
+    by_resource = {notification.resource: notification for notification, _ in collector.handled}
+    assert len(collector.handled) == 2
+    assert by_resource['Users/u1/Messages/m1'].change_types == ('created', 'updated')
+    assert dispatcher.stats()['coalesced'] == 2
+
+
+def test_dispatcher_fetches_the_changed_resource():
+    collector = _Collector()
+    with MockGraphServer(messages=10) as server:
+        client = server.client()
+        with NotificationDispatcher(collector, client=client, coalesce_delay=0) as dispatcher:
+            raw = json.loads(_body(None, resource='me/messages/AAMkAD00000003'))['value']
+            dispatcher.submit([_notification(item) for item in raw])
+            assert dispatcher.join(5)
+    (notification, item), = collector.handled
+    assert item['subject'] == 'Message 3'
@@ -0,0 +1,546 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - aiohttp is an optional dependency
+    aiohttp = None
+
+from ts_microsoftgraph import exceptions, models
+from ts_microsoftgraph.attachments import upload_files_async
+from ts_microsoftgraph.auth import Auth
+from ts_microsoftgraph.cache import ResponseCache
+from ts_microsoftgraph.calendar_view import DEFAULT_PAGE_SIZE, DEFAULT_SLICE, merge_slice, slice_params
+from ts_microsoftgraph.client import Client
+from ts_microsoftgraph.instrumentation import RequestRecord, TokenRecord, body_size, emit
+from ts_microsoftgraph.paging import iter_items_async, page_params
+from ts_microsoftgraph.reponse_parser import parse_async
+from ts_microsoftgraph.streaming import SinkWriter
+from ts_microsoftgraph.throttle import Throttle
+
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError("The asyncio client needs aiohttp - install it with 'pip install ts-microsoftgraph-python[async]'")
+
+
+def _timing_trace_config():
+    # fills in the dns and connect timings of the RequestRecord passed as trace_request_ctx
+    async def dns_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def dns_end(session, context, params):
+        if isinstance(context.trace_request_ctx, RequestRecord):
+            context.trace_request_ctx.dns = time.perf_counter() - context.dns_start
+
+    async def connect_start(session, context, params):
+        context.connect_start = time.perf_counter()
+
+    async def connect_end(session, context, params):
+        if isinstance(context.trace_request_ctx, RequestRecord):
+            # includes the dns lookup, if there was one
+            context.trace_request_ctx.connect = time.perf_counter() - context.connect_start
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(dns_start)
+    trace_config.on_dns_resolvehost_end.append(dns_end)
+    trace_config.on_connection_create_start.append(connect_start)
+    trace_config.on_connection_create_end.append(connect_end)
+    return trace_config
+
+
+class AsyncSessionPool(object):
+    """The asyncio counterpart of SessionPool: one aiohttp connection pool shared by AsyncClient and AsyncAuth calls.
+
+    The underlying aiohttp.ClientSession is created on first use so that it is bound to the running event loop.
+    """
+
+    def __init__(self, limit=100, limit_per_host=0, keepalive_timeout=15, timeout=None):
+        """
+        :param limit: the total number of simultaneous connections (0 for no limit)
+        :param limit_per_host: the maximum number of simultaneous connections to one host (0 for no limit)
+        :param keepalive_timeout: seconds an idle connection is kept alive for reuse
+        :param timeout: default total timeout in seconds for a request
+        """
+        _require_aiohttp()
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._timeout = timeout
+        self._session = None
+        self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _get_session(self):
+        if self._closed:
+            raise RuntimeError('AsyncSessionPool is closed')
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._limit,
+                                             limit_per_host=self._limit_per_host,
+                                             keepalive_timeout=self._keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self._timeout),
+                                                  trace_configs=[_timing_trace_config()])
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        """Returns an aiohttp request context manager - use it with 'async with'."""
+        return self._get_session().request(method, url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            if self._session is not None:
+                await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+def _release_if_entered(lock, entered):
+    if not entered.cancelled() and entered.exception() is None:
+        lock.__exit__(None, None, None)
+
+
+class AsyncAuth(Auth):
+    """Auth with coroutine versions of the token exchange, refresh and background refresh.
+
+    Takes the same arguments as Auth, except that session has to be an AsyncSessionPool. An app_only AsyncAuth
+    never requests a token implicitly: await acquire_token() before the first call. With a token_store, refreshes
+    hold the store's lock as they do with Auth, taken on a thread of the AsyncAuth object so the event loop keeps
+    running while another process refreshes.
+    """
+    _async_refresh_lock = None
+    _store_thread = None
+
+    @property
+    def session(self) -> AsyncSessionPool:
+        if self._session is None:
+            self._session = AsyncSessionPool(limit=2)
+        return self._session
+
+    async def close(self):
+        self.stop_auto_refresh()
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._store_thread is not None:
+            self._store_thread.shutdown(wait=False)
+            self._store_thread = None
+
+    async def _post_token(self, data):
+        url = self._authority + "/oauth2/v2.0/token"
+        if not self._hooks:
+            async with self.session.post(url, data=data) as response:
+                return await parse_async(response)
+        record = TokenRecord(data['grant_type'], self._tenant_id)
+        try:
+            async with self.session.post(url, data=data) as response:
+                record.status = response.status
+                token = await parse_async(response)
+        except Exception as ex:
+            record.finish(ex)
+            emit(self._hooks, 'on_token', record)
+            raise
+        record.finish()
+        emit(self._hooks, 'on_token', record)
+        return token
+
+    async def exchange_code(self, code):
+        self._set_token(await self._post_token(self._exchange_code_data(code)))
+
+    def get_token(self):
+        if self._app_only:
+            # no implicit (blocking) token request here - await acquire_token() first
+            token = self._token_cache.get(self.cache_key)
+            if token is None and self._token_store is not None:
+                token = self._stored_app_token()
+            return token
+        return super().get_token()
+
+    async def acquire_token(self):
+        if not self._app_only:
+            raise ValueError("acquire_token() needs an app_only Auth - use exchange_code() for the user flow")
+        token = self.get_token()
+        if token is None:
+            await self._refresh(None, force=False)
+            token = self.get_token()
+        return token
+
+    async def refresh_token(self, stale_token=None):
+        await self._refresh(stale_token, force=stale_token is None)
+
+    async def _refresh(self, stale_token, force):
+        if self._async_refresh_lock is None:
+            self._async_refresh_lock = asyncio.Lock()
+        async with self._async_refresh_lock:
+            if self._token_store is None:
+                token = await self._new_token(self.get_token(), stale_token, force)
+                if token is not None:
+                    self._set_token(token)
+                return
+            # other processes using the store wait for the lock, then find the new token
+            async with self._store_lock():
+                token = await self._new_token(await self._in_store_thread(self._stored_token), stale_token, force)
+                if token is not None:
+                    await self._in_store_thread(self._set_token, token)
+
+    async def _new_token(self, token, stale_token, force):
+        # None if token is still good: another task, or another process, replaced the stale one meanwhile
+        if token is not None and not force and (stale_token is None or
+                                                token.get('access_token') != stale_token.get('access_token')):
+            return None
+        if self._app_only:
+            return await self._post_token(self._client_credentials_data())
+        return await self._post_token(self._refresh_token_data(token))
+
+    def _stored_token(self):
+        if self._app_only:
+            return self._stored_app_token()
+        token = self._token_store.load(self.store_key)
+        if token is not None:
+            self._token = token
+        return self._token
+
+    def _store_executor(self):
+        # a store's lock belongs to the thread that took it, so taking it, the reads and writes under it and
+        # releasing it all run on the one thread of this executor
+        if self._store_thread is None:
+            self._store_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ts_microsoftgraph-token-store')
+        return self._store_thread
+
+    async def _in_store_thread(self, function, *args):
+        return await asyncio.wrap_future(self._store_executor().submit(function, *args))
+
+    @asynccontextmanager
+    async def _store_lock(self):
+        executor = self._store_executor()
+        lock = self._token_store.lock(self.store_key)
+        entered = executor.submit(lock.__enter__)
+        try:
+            await asyncio.wrap_future(entered)
+        except asyncio.CancelledError:
+            # the thread may take the lock anyway: release it there once it has
+            executor.submit(_release_if_entered, lock, entered)
+            raise
+        try:
+            yield
+        except BaseException as ex:
+            await asyncio.shield(asyncio.wrap_future(executor.submit(lock.__exit__, type(ex), ex, ex.__traceback__)))
+            raise
+        await asyncio.shield(asyncio.wrap_future(executor.submit(lock.__exit__, None, None, None)))
+
+    async def get_valid_token(self, skew=300):
+        token = self.get_token()
+        if token is None and self._app_only:
+            return await self.acquire_token()
+        if self._needs_refresh(token, skew):
+            await self.refresh_token(stale_token=token)
+            token = self.get_token()
+        return token
+
+    def start_auto_refresh(self, skew=300, retry_interval=30):
+        """Refresh the token ahead of its expiry in a task on the running event loop. See Auth.start_auto_refresh."""
+        if self._auto_refresh is not None and not self._auto_refresh.done():
+            return
+
+        async def run():
+            while True:
+                token = self.get_token()
+                remaining = self.expires_in(token)
+                if remaining is None or not self.can_refresh(token):
+                    await asyncio.sleep(retry_interval)
+                    continue
+                await asyncio.sleep(max(0.0, remaining - skew))
+                try:
+                    await self.get_valid_token(skew)
+                except Exception:
+                    # e.g. a Graph error, a dropped connection or a timeout: try again later
+                    await asyncio.sleep(retry_interval)
+
+        self._auto_refresh = asyncio.ensure_future(run())
+
+    def stop_auto_refresh(self):
+        if self._auto_refresh is not None:
+            self._auto_refresh.cancel()
+            self._auto_refresh = None
+
+
+class AsyncClient(Client):
+    """Client for asyncio code: every API method of Client is available and returns an awaitable.
+
+    All requests go through one AsyncSessionPool, so many calls can be in flight on a single event loop. Responses
+    are parsed with the same rules and raise the same exceptions as Client.
+
+        async with AsyncClient(auth) as client:
+            folders = await client.message_folder_list()
+    """
+
+    def __init__(self, auth: Auth, api_version='v1.0', context='me', session: AsyncSessionPool = None,
+                 throttle: Throttle = None, cache: ResponseCache = None, audit_projections=False, hooks=None):
+        """
+        Args:
+            auth: the Auth (or AsyncAuth) object providing the token.
+            api_version: Graph API version, 'v1.0' by default.
+            context: the user the calls are made for, 'me' by default or 'users/{id}'.
+            session: an optional AsyncSessionPool to share between clients. If omitted, the client creates its own
+                pool and closes it in close().
+            throttle: an optional Throttle, see Client.
+            cache: an optional ResponseCache for GET responses, see Client.
+            audit_projections: record which response fields are actually read, see Client.
+            hooks: instrumentation hooks, see Client. DNS and connect timings are filled in for new connections.
+        """
+        super().__init__(auth, api_version=api_version, context=context,
+                         session=AsyncSessionPool() if session is None else session, throttle=throttle, cache=cache,
+                         audit_projections=audit_projections, hooks=hooks)
+        self._owns_session = session is None
+
+    async def close(self):
+        if self._owns_session:
+            await self._session.close()
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' with AsyncClient")
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def try_for_valid_token(self) -> bool:
+        try:
+            refresh = self._auth.refresh_token()
+            if asyncio.iscoroutine(refresh):
+                await refresh
+            return True
+        except exceptions.Unauthorized:
+            return False
+
+    async def message_list_next(self, last_response_payload):
+        if "@odata.nextLink" in last_response_payload.keys():
+            return await self._get(last_response_payload["@odata.nextLink"])
+        else:
+            return None
+
+    async def _send_with_uploads(self, message, filenames, max_workers):
+        draft = await self._post(self._url('messages'), json=message)
+        try:
+            await upload_files_async(self, draft['id'], filenames, max_workers=max_workers)
+            return await self._post(self._url('message_send', message_id=draft['id']))
+        except BaseException:
+            await self._discard_draft(draft['id'])
+            raise
+
+    async def _discard_draft(self, message_id):
+        try:
+            await self._delete(self._url('message', message_id=message_id))
+        except Exception:
+            pass
+
+    def _iter(self, url, params=None, page_size=None, max_items=None, prefetch=False):
+        # the iter_* methods return async generators on this client - use them with 'async for'
+        return iter_items_async(lambda link, p: self._get(link, params=p), url,
+                                params=page_params(params, page_size, max_items), max_items=max_items,
+                                prefetch=prefetch)
+
+    def calendar_view(self, start, end, calendar=None, slice_length=DEFAULT_SLICE, max_workers=4, params=None,
+                      page_size=DEFAULT_PAGE_SIZE, profile=None, model=False):
+        # an async generator here, the slices being fetched as tasks
+        if not self.token:
+            raise exceptions.TokenRequired('You must set the Token.')
+        url, params, windows = self._calendar_view_request(start, end, calendar, slice_length, params, profile)
+        return self._audit('events', self._calendar_view(url, params, windows, page_size, max_workers), model)
+
+    async def _calendar_view(self, url, params, windows, page_size, max_workers):
+        async def fetch(window):
+            return [event async for event in self._iter(url, slice_params(params, *window), page_size)]
+
+        windows = deque(windows)
+        pending = deque()
+        previous = frozenset()
+        try:
+            while windows or pending:
+                while windows and len(pending) <= max_workers:
+                    pending.append(asyncio.ensure_future(fetch(windows.popleft())))
+                new, previous = merge_slice(await pending.popleft(), previous)
+                for event in new:
+                    yield event
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _audit(self, endpoint, result, model=False):
+        audit = self._projection_audit
+        if audit is None and not model:
+            return result
+
+        def wrap(value):
+            if audit is not None:
+                value = audit.track(endpoint, value)
+            return models.wrap_result(endpoint, value) if model else value
+
+        if asyncio.iscoroutine(result):
+            async def tracked():
+                return wrap(await result)
+            return tracked()
+        if hasattr(result, '__anext__'):
+            async def tracked_items():
+                async for item in result:
+                    yield wrap(item)
+            return tracked_items()
+        return result
+
+    async def _valid_token(self):
+        # works with both Auth (blocking) and AsyncAuth
+        token = self._auth.get_valid_token()
+        return await token if asyncio.iscoroutine(token) else token
+
+    async def _refresh_token(self, stale_token):
+        refresh = self._auth.refresh_token(stale_token=stale_token)
+        if asyncio.iscoroutine(refresh):
+            await refresh
+
+    async def _stream(self, url, chunk_size):
+        # an async generator on this client - use message_iter_mime() with 'async for'
+        response = await self._get(url, stream=True)
+        try:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            response.release()
+
+    async def _download(self, url, sink, chunk_size, compress, hash_name):
+        writer = SinkWriter(sink, compress=compress, hash_name=hash_name)
+        try:
+            async for chunk in self._stream(url, chunk_size):
+                writer.write(chunk)
+        finally:
+            writer.close()
+        return writer.result()
+
+    async def _request(self, method, url, **kwargs):
+        if not self._hooks:
+            return await self._perform(method, url, **kwargs)
+        record = RequestRecord(method, url, self._context)
+        try:
+            result = await self._perform(method, url, record=record, **kwargs)
+        except Exception as ex:
+            record.finish(ex)
+            emit(self._hooks, 'on_request', record)
+            raise
+        record.finish()
+        emit(self._hooks, 'on_request', record)
+        return result
+
+    async def _perform(self, method, url, headers=None, stream=False, record=None, **kwargs):
+        cache_key = cached = None
+        if self._cache is not None and method == 'GET' and not stream and \
+                self._cache.cacheable(url, kwargs.get('params')):
+            cache_key = self._cache.key(method, url, kwargs.get('params'), self._context, self._auth.identity)
+            cached = self._cache.lookup(cache_key)
+            if cached is not None and cached[2]:
+                if record is not None:
+                    record.cache = 'hit'
+                return cached[0]
+        token = await self._valid_token()
+        _headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + token['access_token']}
+        if headers:
+            _headers.update(headers)
+        if cached is not None:
+            _headers['If-None-Match'] = cached[1]
+        if 'files' in kwargs:
+            kwargs['data'] = self._form_data(kwargs.pop('files'))
+        else:
+            _headers['Content-Type'] = 'application/json'
+        if record is not None:
+            record.bytes_out = body_size(kwargs)
+            kwargs['trace_request_ctx'] = record
+        attempt = 0
+        reauthenticated = False
+        while True:
+            wait = self._throttle.acquire(self._context)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                if record is not None:
+                    record.throttle_wait += wait
+            try:
+                sent = time.perf_counter()
+                if stream:
+                    response = await self._session.request(method, url, headers=_headers, **kwargs)
+                    if record is not None:
+                        self._record_response(record, response, sent)
+                    if response.status < 300:
+                        # the caller reads (and releases) the body
+                        return response
+                    try:
+                        return await parse_async(response)
+                    finally:
+                        response.release()
+                async with self._session.request(method, url, headers=_headers, **kwargs) as response:
+                    if record is not None:
+                        self._record_response(record, response, sent)
+                    if response.status == 304 and cached is not None:
+                        self._cache.revalidated(cache_key, cached[0], cached[1], url)
+                        if record is not None:
+                            record.cache = 'revalidated'
+                        return cached[0]
+                    result = await parse_async(response)
+                    if record is not None:
+                        record.bytes_in = len(await response.read())
+                    if cache_key is None:
+                        if self._cache is not None and method != 'GET':
+                            self._cache.written(url)
+                        return result
+                    self._cache.store(cache_key, result, response.headers.get('ETag'), url)
+                    return result
+            except exceptions.Unauthorized:
+                if reauthenticated or not self._auth.can_refresh(token) or 'data' in kwargs:
+                    raise
+                reauthenticated = True
+                await self._refresh_token(token)
+                token = self._auth.get_token()
+                _headers['Authorization'] = 'Bearer ' + token['access_token']
+            except exceptions.BaseError as ex:
+                delay = None if 'data' in kwargs else self._throttle.retry_delay(self._context, method, attempt, ex)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                if record is not None:
+                    record.retries = attempt
+                    record.retry_wait += delay
+
+    @staticmethod
+    def _record_response(record, response, sent):
+        record.status = response.status
+        record.ttfb = time.perf_counter() - sent
+        record.bytes_in = response.content_length
+
+    @staticmethod
+    def _form_data(files):
+        # translate a requests-style 'files' dict into a multipart body
+        form = aiohttp.FormData()
+        for name, value in files.items():
+            if isinstance(value, (tuple, list)):
+                filename, content = value[0], value[1]
+                content_type = value[2] if len(value) > 2 else None
+                form.add_field(name, content, filename=filename, content_type=content_type)
+            else:
+                form.add_field(name, value)
+        return form
@@ -0,0 +1,238 @@
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ts_microsoftgraph.client import Client
+from ts_microsoftgraph.projections import HEADERS_ONLY
+
+DOWNLOADED = 'downloaded'
+DUPLICATE = 'duplicate'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+INDEX_NAME = 'index.jsonl'
+DEFAULT_MAX_BYTES_IN_FLIGHT = 64 * 1024 * 1024
+
+_FILE_ATTACHMENT = '#microsoft.graph.fileAttachment'
+_ITEM_ATTACHMENT = '#microsoft.graph.itemAttachment'
+_UNSAFE = re.compile(r'[^\w .()\[\]!-]+')
+
+AttachmentResult = namedtuple('AttachmentResult', ['message_id', 'attachment_id', 'name', 'path', 'status', 'error'])
+AttachmentResult.__doc__ = """The outcome for one attachment, or for one message when listing its attachments failed (attachment_id is then
+None). status is DOWNLOADED, DUPLICATE (downloaded, but the same content was stored already - path is that file),
+SKIPPED (not downloaded: the index has it, or it's a link to a cloud file and path is None) or FAILED (error holds
+the exception)."""
+
+
+class AttachmentIndex(object):
+    """What was stored: attachments are found by message and attachment id, by name and size, and by the hash of
+    their content. Kept in memory, see FileAttachmentIndex to keep it between runs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_attachment = {}
+        self._by_name_size = {}
+        self._by_hash = {}
+
+    def _index(self, record):
+        self._by_attachment[(record['message_id'], record['attachment_id'])] = record['path']
+        self._by_name_size[(record['name'], record['size'])] = record['path']
+        self._by_hash[record['hash']] = record['path']
+
+    def find(self, message_id, attachment, by_name_size=False):
+        """The stored path of an attachment (metadata as listed by Graph), or None."""
+        with self._lock:
+            path = self._by_attachment.get((message_id, attachment['id']))
+            if path is None and by_name_size:
+                path = self._by_name_size.get((attachment.get('name'), attachment.get('size')))
+            return path
+
+    def find_hash(self, content_hash):
+        with self._lock:
+            return self._by_hash.get(content_hash)
+
+    def add(self, record):
+        """Record a stored attachment: a dict with message_id, attachment_id, name, size, hash and path."""
+        with self._lock:
+            self._index(record)
+
+
+class FileAttachmentIndex(AttachmentIndex):
+    """An append-only journal file with one JSON record per line, flushed (and by default fsynced) after each
+    attachment, so an interrupted archive run resumes where it stopped."""
+
+    def __init__(self, path, fsync=True):
+        super().__init__()
+        self._fsync = fsync
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        self._index(json.loads(line))
+                    except ValueError:
+                        # a line cut short by a crash
+                        pass
+        except FileNotFoundError:
+            pass
+        self._file = open(path, 'a')
+
+    def add(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            if self._fsync:
+                os.fsync(self._file.fileno())
+            self._index(record)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class _ByteBudget(object):
+    # at most max_bytes reserved at a time; a single reservation above max_bytes waits until it is alone
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._reserved = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        size = min(size, self._max_bytes)
+        with self._condition:
+            while self._reserved and self._reserved + size > self._max_bytes:
+                self._condition.wait()
+            self._reserved += size
+        return size
+
+    def release(self, size):
+        with self._condition:
+            self._reserved -= size
+            self._condition.notify_all()
+
+
+def _extension(attachment):
+    if attachment.get('@odata.type') == _ITEM_ATTACHMENT:
+        return '.eml'
+    return os.path.splitext(attachment.get('name') or '')[1][:16].lower()
+
+
+def download_attachments(client: Client, messages, directory, max_workers=8,
+                         max_bytes_in_flight=DEFAULT_MAX_BYTES_IN_FLIGHT, index: AttachmentIndex = None,
+                         by_name_size=False, include_inline=True):
+    """Download the attachments of many messages to directory, yielding an AttachmentResult for each.
+
+    The attachments of each message are listed without their content first, then downloaded from their $value
+    stream straight to disk (no base64, no attachment held in memory), max_workers at a time and with at most
+    max_bytes_in_flight bytes of attachments being downloaded at once. Files are stored once per content, as
+    <directory>/<hash[:2]>/<sha256><extension>: an attachment whose content is stored already is reported as a
+    DUPLICATE of that file. The index remembers what was stored, so attachments found there by id (or, if asked,
+    by name and size) aren't downloaded again.
+
+        messages = client.iter_messages('inbox', params={'$filter': 'hasAttachments eq true'}, profile='sync-minimal')
+        for result in download_attachments(client, messages, 'archive/'):
+            if result.status == FAILED:
+                ...
+
+    Args:
+        client: the Client to download with.
+        messages: an iterable of message ids, or of message dicts with an 'id'. It is consumed lazily.
+        directory: the directory to store the attachments in, created if needed.
+        max_workers: the number of listings and downloads running at the same time.
+        max_bytes_in_flight: the most attachment bytes (by their listed size) being downloaded at the same time.
+        index: an AttachmentIndex, by default the index.jsonl journal in directory.
+        by_name_size: also skip attachments whose name and size match a stored one, without downloading them.
+            Off by default: different files often share a name and size (image001.png in signatures), and those
+            would be lost.
+        include_inline: download the inline attachments (e.g. images in the body) too.
+
+    Returns:
+        A generator of AttachmentResult, in completion order.
+    """
+    os.makedirs(directory, exist_ok=True)
+    owns_index = index is None
+    index = FileAttachmentIndex(os.path.join(directory, INDEX_NAME)) if index is None else index
+    budget = _ByteBudget(max_bytes_in_flight)
+
+    def list_attachments(message_id):
+        tasks, results = [], []
+        for attachment in client.iter_message_attachments(message_id, profile=HEADERS_ONLY):
+            if attachment.get('isInline') and not include_inline:
+                continue
+            kind = attachment.get('@odata.type')
+            if kind is not None and kind not in (_FILE_ATTACHMENT, _ITEM_ATTACHMENT):
+                # a reference attachment: a link to a file in the cloud, there is no content to download. Without a
+                # type the download is tried, and fails for a reference attachment instead of skipping a file
+                results.append(AttachmentResult(message_id, attachment['id'], attachment.get('name'), None, SKIPPED,
+                                                None))
+                continue
+            path = index.find(message_id, attachment, by_name_size)
+            if path is not None:
+                results.append(AttachmentResult(message_id, attachment['id'], attachment.get('name'), path, SKIPPED,
+                                                None))
+            else:
+                tasks.append((download, message_id, attachment))
+        return tasks, results
+
+    def download(message_id, attachment):
+        reserved = budget.acquire(attachment.get('size') or 0)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.attachment-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    info = client.attachment_download(message_id, attachment['id'], f)
+                relative = os.path.join(info['hash'][:2], info['hash'] + _extension(attachment))
+                stored = index.find_hash(info['hash'])
+                if stored is None and not os.path.exists(os.path.join(directory, relative)):
+                    os.makedirs(os.path.join(directory, info['hash'][:2]), exist_ok=True)
+                    os.replace(tmp_path, os.path.join(directory, relative))
+                    status, path = DOWNLOADED, relative
+                else:
+                    os.unlink(tmp_path)
+                    status, path = DUPLICATE, stored or relative
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        finally:
+            budget.release(reserved)
+        index.add({'message_id': message_id, 'attachment_id': attachment['id'], 'name': attachment.get('name'),
+                   'size': attachment.get('size'), 'hash': info['hash'], 'path': path})
+        return [], [AttachmentResult(message_id, attachment['id'], attachment.get('name'), path, status, None)]
+
+    def run(task):
+        function, message_id = task[0], task[1]
+        try:
+            return function(*task[1:])
+        except Exception as ex:
+            attachment = task[2] if function is download else {}
+            return [], [AttachmentResult(message_id, attachment.get('id'), attachment.get('name'), None, FAILED, ex)]
+
+    items = iter(messages)
+    tasks = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = set()
+            while True:
+                while len(in_flight) < max_workers * 2:
+                    if not tasks:
+                        item = next(items, None)
+                        if item is None:
+                            break
+                        tasks.append((list_attachments, item['id'] if isinstance(item, dict) else item))
+                    in_flight.add(executor.submit(run, tasks.popleft()))
+                if not in_flight:
+                    return
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    new_tasks, results = future.result()
+                    # downloads go first, so listings don't run far ahead of them
+                    tasks.extendleft(reversed(new_tasks))
+                    for result in results:
+                        yield result
+    finally:
+        if owns_index:
+            index.close()
@@ -0,0 +1,207 @@
+import asyncio
+import base64
+import mimetypes
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.reponse_parser import parse, parse_async
+
+# Graph rejects requests over 4 MB, and base64 grows the content by a third
+UPLOAD_THRESHOLD = 3 * 1024 * 1024
+# upload session chunks have to be a multiple of 320 KiB
+UPLOAD_CHUNK_SIZE = 10 * 320 * 1024
+# read the file in multiples of 3 bytes so every block encodes without padding
+_ENCODE_BLOCK_SIZE = 3 * 256 * 1024
+
+
+def encode_file_base64(filename, max_size=UPLOAD_THRESHOLD):
+    """Base64 encode a file block by block, without reading the whole file into memory first.
+
+    The encoded blocks are joined into one str at the end, so up to twice the encoded size is held in memory for a
+    moment. That is why files above max_size are refused: they don't fit in a Graph request anyway, and go through
+    an upload session (upload_file()) without being encoded.
+
+    Returns:
+        The base64 content as a str.
+    """
+    size = os.path.getsize(filename)
+    if max_size is not None and size > max_size:
+        raise ValueError('{} is {} bytes, attachments above {} bytes need an upload session'.format(filename, size,
+                                                                                                   max_size))
+    parts = []
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(_ENCODE_BLOCK_SIZE)
+            if not block:
+                break
+            parts.append(base64.b64encode(block).decode('ascii'))
+    return ''.join(parts)
+
+
+def mime_type_of(filename):
+    mime_type = mimetypes.guess_type(filename)[0]
+    return mime_type if mime_type else ''
+
+
+def file_attachment(filename, content_bytes=None):
+    """The inline fileAttachment dict for message_send, with the file content base64 encoded. The attachment is
+    named after the file, without its directory."""
+    return {'@odata.type': '#microsoft.graph.fileAttachment',
+            'ContentBytes': encode_file_base64(filename) if content_bytes is None else content_bytes,
+            'ContentType': mime_type_of(filename), 'Name': os.path.basename(filename)}
+
+
+def _read_chunk(filename, offset, size):
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _next_offset(session, upload_url):
+    # ask the upload session where to resume, e.g. after a dropped connection
+    status = parse(session.request('GET', upload_url))
+    ranges = status.get('nextExpectedRanges') if status else None
+    if not ranges:
+        return None
+    return int(ranges[0].split('-')[0])
+
+
+def _upload_session_item(filename, size):
+    return {'AttachmentItem': {'attachmentType': 'file', 'name': os.path.basename(filename), 'size': size,
+                               'contentType': mime_type_of(filename) or 'application/octet-stream'}}
+
+
+def _content_range(offset, end, size):
+    return {'Content-Type': 'application/octet-stream', 'Content-Range': 'bytes {}-{}/{}'.format(offset, end - 1, size)}
+
+
+def _fatal(ex):
+    # the upload session won't accept this chunk however often it is sent
+    return isinstance(ex, (exceptions.BadRequest, exceptions.Forbidden, exceptions.NotFound))
+
+
+def upload_file(client, message_id, filename, chunk_size=UPLOAD_CHUNK_SIZE, max_retries=5):
+    """Attach a file to a draft message through an upload session.
+
+    The file is sent in chunk_size pieces; the next piece is read from disk while the current one is uploading. A
+    failed chunk is retried (with the throttle policy's backoff) from the offset the upload session reports, so an
+    interrupted upload resumes instead of starting over.
+
+    Args:
+        client: the Client the draft message belongs to.
+        message_id: the id of the draft message.
+        filename: the local file to attach.
+        chunk_size: bytes per request, a multiple of 320 KiB.
+        max_retries: how many times one chunk is retried.
+
+    Returns:
+        The response of the last chunk.
+    """
+    size = os.path.getsize(filename)
+    upload = client._post(client._url('message_upload_session', message_id=message_id),
+                          json=_upload_session_item(filename, size))
+    upload_url = upload['uploadUrl']
+    session = client._session
+    result = None
+    offset = 0
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        pending = reader.submit(_read_chunk, filename, offset, chunk_size)
+        attempt = 0
+        while offset < size:
+            chunk = pending.result()
+            end = offset + len(chunk)
+            if end < size:
+                pending = reader.submit(_read_chunk, filename, end, chunk_size)
+            try:
+                # the upload url is pre-authenticated, it must not get the Authorization header
+                result = parse(session.request('PUT', upload_url, data=chunk,
+                                               headers=_content_range(offset, end, size)))
+                offset = end
+                attempt = 0
+            except Exception as ex:
+                if attempt >= max_retries or _fatal(ex):
+                    raise
+                time.sleep(client._throttle.policy.backoff(attempt))
+                attempt += 1
+                try:
+                    resume = _next_offset(session, upload_url)
+                except Exception:
+                    resume = offset
+                if resume is None:
+                    break
+                offset = resume
+                pending = reader.submit(_read_chunk, filename, offset, chunk_size)
+    return result
+
+
+def upload_files(client, message_id, filenames, max_workers=4, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Upload several files to a draft message, one upload session per file, max_workers at a time."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(upload_file, client, message_id, filename, chunk_size) for filename in filenames]
+        return [future.result() for future in futures]
+
+
+async def _next_offset_async(session, upload_url):
+    async with session.request('GET', upload_url) as response:
+        status = await parse_async(response)
+    ranges = status.get('nextExpectedRanges') if status else None
+    if not ranges:
+        return None
+    return int(ranges[0].split('-')[0])
+
+
+async def upload_file_async(client, message_id, filename, chunk_size=UPLOAD_CHUNK_SIZE, max_retries=5):
+    """The asyncio counterpart of upload_file() for an AsyncClient: chunks are read from disk in the default
+    executor, the next one while the current one is uploading."""
+    loop = asyncio.get_event_loop()
+    size = os.path.getsize(filename)
+    upload = await client._post(client._url('message_upload_session', message_id=message_id),
+                                json=_upload_session_item(filename, size))
+    upload_url = upload['uploadUrl']
+    session = client._session
+    result = None
+    offset = 0
+    pending = loop.run_in_executor(None, _read_chunk, filename, offset, chunk_size)
+    attempt = 0
+    try:
+        while offset < size:
+            chunk = await pending
+            end = offset + len(chunk)
+            if end < size:
+                pending = loop.run_in_executor(None, _read_chunk, filename, end, chunk_size)
+            try:
+                # the upload url is pre-authenticated, it must not get the Authorization header
+                async with session.request('PUT', upload_url, data=chunk,
+                                           headers=_content_range(offset, end, size)) as response:
+                    result = await parse_async(response)
+                offset = end
+                attempt = 0
+            except Exception as ex:
+                if attempt >= max_retries or _fatal(ex):
+                    raise
+                await asyncio.sleep(client._throttle.policy.backoff(attempt))
+                attempt += 1
+                try:
+                    resume = await _next_offset_async(session, upload_url)
+                except Exception:
+                    resume = offset
+                if resume is None:
+                    break
+                offset = resume
+                pending = loop.run_in_executor(None, _read_chunk, filename, offset, chunk_size)
+    finally:
+        pending.cancel()
+    return result
+
+
+async def upload_files_async(client, message_id, filenames, max_workers=4, chunk_size=UPLOAD_CHUNK_SIZE):
+    """The asyncio counterpart of upload_files()."""
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def upload(filename):
+        async with semaphore:
+            return await upload_file_async(client, message_id, filename, chunk_size)
+
+    return await asyncio.gather(*[upload(filename) for filename in filenames])
@@ -1,10 +1,18 @@
+import base64
+import hashlib
+import threading
+import time
 import uuid
 from enum import Enum
+from types import MappingProxyType
 from urllib.parse import urlencode
-import requests
 
 from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.instrumentation import TokenRecord, emit
 from ts_microsoftgraph.reponse_parser import parse
+from ts_microsoftgraph.session import SessionPool
+from ts_microsoftgraph.token_cache import TokenCache
+from ts_microsoftgraph.token_store import TokenStore
 import json
 
 """
@@ -74,38 +82,43 @@ class AuthScope(Enum):
     PROFILE = 27
 
 
+# the scope strings, built once and shared (read-only) by every AuthScopeList
+SCOPES = MappingProxyType({
+    AuthScope.DEFAULT : ".default",
+    AuthScope.CALENDARS_READ : "https://graph.microsoft.com/Calendars.Read",
+    AuthScope.CALENDARS_READ_SHARED :"https://graph.microsoft.com/Calendars.Read.Shared",
+    AuthScope.CALENDARS_READWRITE :"https://graph.microsoft.com/Calendars.ReadWrite",
+    AuthScope.CALENDARS_READWRITE_SHARED :"https://graph.microsoft.com/Calendars.ReadWrite.Shared",
+    AuthScope.CONTACTS_READ : "https://graph.microsoft.com/Contacts.Read",
+    AuthScope.CONTACTS_READ_SHARED : "https://graph.microsoft.com/Contacts.Read.Shared",
+    AuthScope.CONTACTS_READWRITE : "https://graph.microsoft.com/Contacts.ReadWrite",
+    AuthScope.CONTACTS_READWRITE_SHARED : "https://graph.microsoft.com/Contacts.ReadWrite.Shared",
+    AuthScope.MAIL_READ : "https://graph.microsoft.com/Mail.Read",
+    AuthScope.MAIL_READBASIC : "https://graph.microsoft.com/Mail.ReadBasic",
+    AuthScope.MAIL_READWRITE : "https://graph.microsoft.com/Mail.ReadWrite",
+    AuthScope.MAIL_READ_SHARED : "https://graph.microsoft.com/Mail.Read.Shared",
+    AuthScope.MAIL_READWRITE_SHARED : "https://graph.microsoft.com/Mail.ReadWrite.Shared",
+    AuthScope.MAIL_SEND : "https://graph.microsoft.com/Mail.Send",
+    AuthScope.MAIL_SEND_SHARED : "https://graph.microsoft.com/Mail.Send.Shared",
+    AuthScope.MAILBOXSETTINGS_READ : "https://graph.microsoft.com/MailboxSettings.Read",
+    AuthScope.MAILBOXSETTINGS_READWRITE : "https://graph.microsoft.com/MailboxSettings.ReadWrite",
+    AuthScope.NOTES_READ : "https://graph.microsoft.com/Notes.Read",
+    AuthScope.NOTES_CREATE : "https://graph.microsoft.com/Notes.Create",
+    AuthScope.NOTES_READWRITE : "https://graph.microsoft.com/Notes.ReadWrite",
+    AuthScope.NOTES_READ_ALL : "https://graph.microsoft.com/Notes.Read.All",
+    AuthScope.NOTES_READWRITE_ALL : "https://graph.microsoft.com/Notes.ReadWrite.All",
+    AuthScope.NOTES_READWRITE_CREATEDBYAPP : "https://graph.microsoft.com/Notes.ReadWrite.CreatedByApp",
+    AuthScope.EMAIL : "email",
+    AuthScope.OFFLINE_ACCESS : "offline_access",
+    AuthScope.OPENID : "openid",
+    AuthScope.PROFILE : "profile"
+})
+
+
 class AuthScopeList(object):
+    _lut = SCOPES
+
     def __init__(self):
-        self._lut = {
-            AuthScope.DEFAULT : ".default",
-            AuthScope.CALENDARS_READ : "https://graph.microsoft.com/Calendars.Read",
-            AuthScope.CALENDARS_READ_SHARED :"https://graph.microsoft.com/Calendars.Read.Shared",
-            AuthScope.CALENDARS_READWRITE :"https://graph.microsoft.com/Calendars.ReadWrite",
-            AuthScope.CALENDARS_READWRITE_SHARED :"https://graph.microsoft.com/Calendars.ReadWrite.Shared",
-            AuthScope.CONTACTS_READ : "https://graph.microsoft.com/Contacts.Read",
-            AuthScope.CONTACTS_READ_SHARED : "https://graph.microsoft.com/Contacts.Read.Shared",
-            AuthScope.CONTACTS_READWRITE : "https://graph.microsoft.com/Contacts.ReadWrite",
-            AuthScope.CONTACTS_READWRITE_SHARED : "https://graph.microsoft.com/Contacts.ReadWrite.Shared",
-            AuthScope.MAIL_READ : "https://graph.microsoft.com/Mail.Read",
-            AuthScope.MAIL_READBASIC : "https://graph.microsoft.com/Mail.ReadBasic",
-            AuthScope.MAIL_READWRITE : "https://graph.microsoft.com/Mail.ReadWrite",
-            AuthScope.MAIL_READ_SHARED : "https://graph.microsoft.com/Mail.Read.Shared",
-            AuthScope.MAIL_READWRITE_SHARED : "https://graph.microsoft.com/Mail.ReadWrite.Shared",
-            AuthScope.MAIL_SEND : "https://graph.microsoft.com/Mail.Send",
-            AuthScope.MAIL_SEND_SHARED : "https://graph.microsoft.com/Mail.Send.Shared",
-            AuthScope.MAILBOXSETTINGS_READ : "https://graph.microsoft.com/MailboxSettings.Read",
-            AuthScope.MAILBOXSETTINGS_READWRITE : "https://graph.microsoft.com/MailboxSettings.ReadWrite",
-            AuthScope.NOTES_READ : "https://graph.microsoft.com/Notes.Read",
-            AuthScope.NOTES_CREATE : "https://graph.microsoft.com/Notes.Create",
-            AuthScope.NOTES_READWRITE : "https://graph.microsoft.com/Notes.ReadWrite",
-            AuthScope.NOTES_READ_ALL : "https://graph.microsoft.com/Notes.Read.All",
-            AuthScope.NOTES_READWRITE_ALL : "https://graph.microsoft.com/Notes.ReadWrite.All",
-            AuthScope.NOTES_READWRITE_CREATEDBYAPP : "https://graph.microsoft.com/Notes.ReadWrite.CreatedByApp",
-            AuthScope.EMAIL : "email",
-            AuthScope.OFFLINE_ACCESS : "offline_access",
-            AuthScope.OPENID : "openid",
-            AuthScope.PROFILE : "profile"
-        }
         self._flags = list()
 
     def add_scope(self, scope_enum: AuthScope):
@@ -118,6 +131,19 @@ class AuthScopeList(object):
         return self._flags
 
 
+APP_ONLY_SCOPE = "https://graph.microsoft.com/.default"
+
+
+def _jwt_claims(jwt):
+    # the payload of a JWT, unverified - only used to tell users apart, never to trust them
+    try:
+        payload = jwt.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    except (AttributeError, IndexError, ValueError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
 class Auth(object):
     def __init__(self,
                  client_id: str,
@@ -128,7 +154,12 @@ class Auth(object):
                  redirect_uri="https://login.microsoftonline.com/common/oauth2/nativeclient",
                  save_cache_handler=None,
                  load_cache_handler=None,
-                 state_id=None
+                 state_id=None,
+                 session: SessionPool = None,
+                 app_only=False,
+                 token_cache: TokenCache = None,
+                 hooks=None,
+                 token_store: TokenStore = None
                  ):
         """
         Auth object
@@ -138,9 +169,19 @@ class Auth(object):
         :param scope: a single or set of scopes - you can use a single string, a list of strings, or an AuthScope or an AuthScopeList for this
         :param account: this is a long UID value representing your Azure account ID
         :param redirect_uri: the URI that handles your auth code - the default value is "https://login.microsoftonline.com/common/oauth2/nativeclient"
-        :param save_cache_handler: this is a function that handles a single parameter which is the JSON token. This needs to be serialised and saved
+        :param save_cache_handler: this is a function that handles a single parameter which is the token as a JSON string. It needs to be saved
         :param load_cache_handler: this is a function that takes no parameters, but should return a string representing the JSON file (it will be parsed)
         :param state_id: see OAUTH2 details on the state_id - it's for CSRF protection
+        :param session: an optional SessionPool used for the token calls - pass the same pool you give to Client to
+            share connections with it, otherwise the Auth object creates its own pool when it first needs one
+        :param app_only: use the client credentials flow (application permissions, no signed-in user) - tokens are
+            requested on demand and kept in token_cache, and clients use a 'users/{id}' context
+        :param token_cache: the TokenCache app-only tokens are kept in - share one between Auth objects (or use
+            for_tenant()) to serve many tenants from one process
+        :param hooks: instrumentation hooks (see ts_microsoftgraph.instrumentation) told about every token request
+        :param token_store: a TokenStore (see ts_microsoftgraph.token_store) the tokens are kept in, shared with the
+            other processes using the same store - only one of them refreshes (or, app-only, requests) a token, the
+            others pick it up from the store
         """
         if type(scope) is str:
             self._scope = scope
@@ -149,11 +190,11 @@ class Auth(object):
         elif type(scope) is AuthScope:
             asl = AuthScopeList()
             asl.add_scope(scope)
-            self._scope = scope.as_list()
+            self._scope = asl.as_list()
         elif type(scope) is list:
             self._scope = scope #",".join(scope)
         else:
-            self._scope = ".default"
+            self._scope = APP_ONLY_SCOPE if app_only else ".default"
         # fix scope formatting as apparently, scopes need to be
         # separated by _spaces_ which of course is documented
         # only in an example on some random MS web page
@@ -161,6 +202,9 @@ class Auth(object):
             self._scope = " ".join(self._scope)
         else:
             self._scope = str(self._scope).strip()
+        if app_only and self._scope == ".default":
+            self._scope = APP_ONLY_SCOPE
+        self._tenant_id = tenant_id
         self._authority = "https://login.microsoftonline.com/" + tenant_id
         self._client_id = client_id
         self._secret = secret
@@ -170,6 +214,66 @@ class Auth(object):
         self._redirect_uri = redirect_uri
         self._token = None
         self._account = account
+        self._session = session
+        self._owns_session = session is None
+        self._session_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._auto_refresh = None
+        self._auto_refresh_stop = None
+        self._app_only = app_only
+        self._token_cache = token_cache if token_cache is not None else (TokenCache() if app_only else None)
+        self._tenants = {}
+        self._hooks = tuple(hooks) if hooks else ()
+        self._token_store = token_store
+        self._subject = None
+
+    @property
+    def store_key(self):
+        """The key this Auth object's token is kept under in the token store."""
+        return '|'.join((self._tenant_id, self._client_id, self._account or '', self._scope))
+
+    @property
+    def identity(self):
+        """Who this Auth object's tokens act for, as 'tenant_id|client_id|account'. The account is the one given,
+        or else the signed-in user's object id read from the token; it is empty app-only, where the client context
+        names the user. Response caches key their entries with it."""
+        if self._app_only or self._account:
+            return '|'.join((self._tenant_id, self._client_id, self._account or ''))
+        return '|'.join((self._tenant_id, self._client_id, self._token_subject(self.get_token())))
+
+    def _token_subject(self, token):
+        # the oid (or sub) claim of the id token or the access token - or, for tokens that aren't JWTs, a digest of
+        # the access token, so entries are never shared by mistake
+        if not token:
+            return ''
+        access_token = token.get('access_token') or ''
+        subject = self._subject
+        if subject is not None and subject[0] == access_token:
+            return subject[1]
+        for jwt in (token.get('id_token'), access_token):
+            claims = _jwt_claims(jwt)
+            if claims.get('oid') or claims.get('sub'):
+                value = claims.get('oid') or claims.get('sub')
+                break
+        else:
+            value = hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+        self._subject = (access_token, value)
+        return value
+
+    @property
+    def session(self) -> SessionPool:
+        with self._session_lock:
+            if self._session is None:
+                self._session = SessionPool(pool_connections=1, pool_maxsize=2)
+            return self._session
+
+    def close(self):
+        """Stop the background refresh and close the connection pool, if this Auth object created it."""
+        self.stop_auto_refresh()
+        with self._session_lock:
+            if self._owns_session and self._session is not None:
+                self._session.close()
+                self._session = None
 
     def authorization_url(self):
         params = {
@@ -182,8 +286,8 @@ class Auth(object):
         }
         return self._authority + "/oauth2/v2.0/authorize?" + urlencode(params)
 
-    def exchange_code(self, code):
-        data = {
+    def _exchange_code_data(self, code):
+        return {
             'grant_type': 'authorization_code',
             'client_id': self._client_id,
             'redirect_uri': self._redirect_uri,
@@ -191,14 +295,31 @@ class Auth(object):
             'code': code,
             'scope': self._scope
         }
-        response = requests.post(self._authority + "/oauth2/v2.0/token", data=data)
-        self._set_token(parse(response))
 
-    def refresh_token(self):
-        token = self.get_token()
+    def _post_token(self, data):
+        url = self._authority + "/oauth2/v2.0/token"
+        if not self._hooks:
+            return parse(self.session.post(url, data=data))
+        record = TokenRecord(data['grant_type'], self._tenant_id)
+        try:
+            response = self.session.post(url, data=data)
+            record.status = response.status_code
+            token = parse(response)
+        except Exception as ex:
+            record.finish(ex)
+            emit(self._hooks, 'on_token', record)
+            raise
+        record.finish()
+        emit(self._hooks, 'on_token', record)
+        return token
+
+    def exchange_code(self, code):
+        self._set_token(self._post_token(self._exchange_code_data(code)))
+
+    def _refresh_token_data(self, token):
         if token is None:
             raise exceptions.Unauthorized("No valid token exists in the cache to refresh")
-        data = {
+        return {
             'grant_type': 'refresh_token',
             'client_id': self._client_id,
             'redirect_uri': self._redirect_uri,
@@ -206,15 +327,134 @@ class Auth(object):
             'refresh_token': token['refresh_token'],
             'scope': self._scope  #'https://graph.microsoft.com/mail.read'
         }
-        response = requests.post(self._authority + "/oauth2/v2.0/token", data=data)
-        self._set_token(parse(response))
+
+    def refresh_token(self, stale_token=None):
+        """
+        Refresh the access token. Concurrent callers are collapsed into a single request.
+        :param stale_token: the token the caller found to be expired or rejected - if another thread has already
+            replaced it by the time the lock is acquired, no new refresh is done
+        """
+        if self._app_only:
+            self._acquire_app_token(stale_token=stale_token, force=stale_token is None)
+            return
+        with self._refresh_lock:
+            if self._token_store is None:
+                self._refresh_user_token(stale_token)
+                return
+            # other processes using the store wait here, then find the new token
+            with self._token_store.lock(self.store_key):
+                self._refresh_user_token(stale_token)
+
+    def _refresh_user_token(self, stale_token):
+        token = self.get_token()
+        if stale_token is not None and token is not None and \
+                token.get('access_token') != stale_token.get('access_token'):
+            return
+        self._set_token(self._post_token(self._refresh_token_data(token)))
+
+    def _client_credentials_data(self):
+        return {
+            'grant_type': 'client_credentials',
+            'client_id': self._client_id,
+            'client_secret': self._secret,
+            'scope': self._scope
+        }
+
+    @property
+    def cache_key(self):
+        """The (tenant_id, client_id, scope) key this Auth object's app-only token is cached under."""
+        return self._tenant_id, self._client_id, self._scope
+
+    def _acquire_app_token(self, stale_token=None, force=False):
+        # one request per cache key, even across Auth objects sharing the cache
+        with self._token_cache.lock(self.cache_key):
+            token = self._token_cache.get(self.cache_key)
+            if token is not None and not force and (stale_token is None or
+                                                    token.get('access_token') != stale_token.get('access_token')):
+                return token
+            if self._token_store is None:
+                self._set_token(self._post_token(self._client_credentials_data()))
+                return self._token_cache.get(self.cache_key)
+            with self._token_store.lock(self.store_key):
+                token = self._stored_app_token()
+                if token is None or force or (stale_token is not None and
+                                              token.get('access_token') == stale_token.get('access_token')):
+                    self._set_token(self._post_token(self._client_credentials_data()))
+                return self._token_cache.get(self.cache_key)
+
+    def _stored_app_token(self):
+        # a token another process put in the store, if it's still valid - it then goes to the in-memory cache too
+        token = self._token_store.load(self.store_key)
+        if token is None or self.expires_in(token) is not None and self.expires_in(token) <= 0:
+            return None
+        self._token_cache.set(self.cache_key, token)
+        return token
+
+    def acquire_token(self):
+        """
+        App-only: returns the cached token, requesting one with the client credentials flow if there is none.
+        :return: the token dict
+        """
+        if not self._app_only:
+            raise ValueError("acquire_token() needs an app_only Auth - use exchange_code() for the user flow")
+        return self._acquire_app_token()
+
+    def for_tenant(self, tenant_id):
+        """
+        App-only: an Auth object for another tenant with the same credentials, scope, connection pool and token
+        cache. The same object is returned for repeated calls with the same tenant_id.
+        """
+        if not self._app_only:
+            raise ValueError("for_tenant() needs an app_only Auth")
+        if tenant_id == self._tenant_id:
+            return self
+        with self._session_lock:
+            auth = self._tenants.get(tenant_id)
+            if auth is None:
+                auth = self._tenants[tenant_id] = self.__class__(
+                    self._client_id, tenant_id, self._secret, scope=self._scope, session=self._session,
+                    app_only=self._app_only, token_cache=self._token_cache, hooks=self._hooks,
+                    token_store=self._token_store)
+            return auth
 
     def _set_token(self, token):
+        if isinstance(token, dict) and 'expires_in' in token:
+            token['expires_at'] = time.time() + float(token['expires_in'])
+        if self._token_store is not None:
+            self._token_store.save(self.store_key, token)
+        if self._app_only:
+            self._token_cache.set(self.cache_key, token)
+            return
         if self._save_cache_handler is not None:
-            self._save_cache_handler(str(token))
+            self._save_cache_handler(json.dumps(token))
         self._token = token
 
+    def set_token(self, token):
+        """
+        Use token (a dict from the token endpoint, e.g. one saved earlier) from now on, as if it had just been
+        obtained: it goes to the token store, the token cache (app-only) or the save_cache_handler. None forgets
+        the current token.
+        """
+        if token is not None:
+            self._set_token(dict(token))
+            return
+        if self._token_store is not None:
+            self._token_store.delete(self.store_key)
+        if self._app_only:
+            self._token_cache.remove(self.cache_key)
+        else:
+            self._token = None
+
     def get_token(self):
+        if self._app_only:
+            token = self._token_cache.get(self.cache_key)
+            return token if token is not None else self._acquire_app_token()
+        if self._token_store is not None:
+            # cheap: the store only reads again when another process changed it
+            token = self._token_store.load(self.store_key)
+            if token is not None:
+                self._token = token
+                return token
         token = self._token
         if token is None:
             if self._load_cache_handler is not None:
@@ -222,5 +462,66 @@ class Auth(object):
                 if t_src is None:
                     return None
                 else:
-                    return json.loads(t_src)
+                    # keep the parsed token so the cache is only read once
+                    token = self._token = json.loads(t_src)
         return token
+
+    @staticmethod
+    def expires_in(token):
+        """Seconds until token expires, or None if the token doesn't say."""
+        if not token or 'expires_at' not in token:
+            return None
+        return float(token['expires_at']) - time.time()
+
+    def can_refresh(self, token):
+        """True if a new token can be obtained without user interaction."""
+        return self._app_only or bool(token and token.get('refresh_token'))
+
+    def _needs_refresh(self, token, skew):
+        remaining = self.expires_in(token)
+        return remaining is not None and remaining <= skew and self.can_refresh(token)
+
+    def get_valid_token(self, skew=300):
+        """
+        Returns the current token, refreshing it first if it expires within skew seconds.
+        :param skew: how many seconds before the expiry a token is considered expired
+        """
+        token = self.get_token()
+        if self._needs_refresh(token, skew):
+            self.refresh_token(stale_token=token)
+            token = self.get_token()
+        return token
+
+    def start_auto_refresh(self, skew=300, retry_interval=30):
+        """
+        Refresh the token in a background thread, skew seconds before it expires, so requests never wait on a
+        refresh. Every Client sharing this Auth object picks up the new token.
+        :param skew: how many seconds before the expiry the token is refreshed
+        :param retry_interval: how long to wait before trying again after a failed refresh
+        """
+        if self._auto_refresh is not None and self._auto_refresh.is_alive():
+            return
+        stop = self._auto_refresh_stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                token = self.get_token()
+                remaining = self.expires_in(token)
+                if remaining is None or not self.can_refresh(token):
+                    wait = retry_interval
+                else:
+                    wait = max(0.0, remaining - skew)
+                if stop.wait(wait):
+                    return
+                try:
+                    self.get_valid_token(skew)
+                except Exception:
+                    stop.wait(retry_interval)
+
+        self._auto_refresh = threading.Thread(target=run, name='ts_microsoftgraph-token-refresh', daemon=True)
+        self._auto_refresh.start()
+
+    def stop_auto_refresh(self):
+        if self._auto_refresh_stop is not None:
+            self._auto_refresh_stop.set()
+            self._auto_refresh = None
@@ -0,0 +1,307 @@
+import asyncio
+import base64
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from ts_microsoftgraph.client import Client
+from ts_microsoftgraph.exceptions import BaseError, ServiceUnavailable, TooManyRequests
+from ts_microsoftgraph.reponse_parser import parse_status
+
+MAX_BATCH_SIZE = 20
+
+
+class BatchRequest(object):
+    """A call queued in a Batch. Its result is available once the batch has been sent."""
+
+    def __init__(self, request_id, method, url, headers=None, body=None):
+        self.id = request_id
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+        self.dependencies = []
+        self._done = False
+        self._result = None
+        self._exception = None
+
+    def depends_on(self, *requests):
+        """Only run this request once the given requests (queued in the same batch) have completed.
+
+        Returns:
+            This request, so the call can be chained.
+        """
+        self.dependencies.extend(requests)
+        return self
+
+    @property
+    def done(self):
+        return self._done
+
+    def result(self):
+        """Returns the parsed response body, or raises the same exception the call would have raised on its own."""
+        if not self._done:
+            raise RuntimeError('The batch has not been sent yet')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        if not self._done:
+            raise RuntimeError('The batch has not been sent yet')
+        return self._exception
+
+    def as_json(self, sent_with=None):
+        """The request as an entry of a $batch. sent_with (the ids in the same $batch) limits dependsOn to those."""
+        data = {'id': self.id, 'method': self.method, 'url': self.url}
+        if self.headers:
+            data['headers'] = self.headers
+        if self.body is not None:
+            data['body'] = self.body
+        depends_on = [r.id for r in self.dependencies if sent_with is None or r.id in sent_with]
+        if depends_on:
+            data['dependsOn'] = depends_on
+        return data
+
+    def _set_response(self, response):
+        body = response.get('body')
+        headers = response.get('headers', {})
+        try:
+            if isinstance(body, str) and 'application/json' not in headers.get('Content-Type', ''):
+                # non-JSON bodies (e.g. a message's MIME content) come back base64 encoded
+                body = base64.b64decode(body)
+            self._set_result(parse_status(response['status'], body))
+        except BaseError as ex:
+            ex.headers = headers
+            self._set_exception(ex)
+        except Exception as ex:
+            self._set_exception(ex)
+
+    def _set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._done = True
+
+    def _reset(self):
+        self._result = None
+        self._exception = None
+        self._done = False
+
+
+class Batch(Client):
+    """Queues calls to the Client methods and sends them through the Graph JSON $batch endpoint.
+
+    Every Client API method called on a Batch returns a BatchRequest instead of a result. When the with-block exits,
+    the queued requests are split into chunks of at most 20 (the $batch limit) and the chunks are sent concurrently.
+    Requests linked with depends_on() always end up in the same chunk, in the order they were queued.
+
+        with client.batch() as b:
+            requests = [b.message_get(message_id) for message_id in message_ids]
+        messages = [r.result() for r in requests]
+
+    Each sub-response goes through the same parsing as a direct call, so result() raises the matching exception
+    for a failed item. Items answered with 429 or 503 are sent again in a later $batch, after their Retry-After, as
+    the client's Throttle does for a direct call. AsyncClient batches are used with 'async with' instead.
+    """
+
+    def __init__(self, client: Client, max_workers=4):
+        """
+        Args:
+            client: the Client (or AsyncClient) the batch is sent with.
+            max_workers: how many $batch requests are sent at the same time.
+        """
+        # the same Graph url as the client, which may be a subclass pointing elsewhere
+        self.RESOURCE = client.RESOURCE
+        super().__init__(client._auth, api_version=client._api_version, context=client._context,
+                         session=client._session, throttle=client._throttle, cache=client._cache)
+        self._client = client
+        self._max_workers = max_workers
+        self._requests = []
+        self._sent = 0
+
+    @property
+    def token(self):
+        return self._client.token
+
+    @property
+    def requests(self):
+        return list(self._requests)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.execute_async()
+
+    def _iter(self, url, params=None, page_size=None, max_items=None, prefetch=False):
+        raise TypeError('Paging through a collection is not supported in a $batch')
+
+    def _send_with_uploads(self, message, filenames, max_workers):
+        raise TypeError('Attachments that need an upload session are not supported in a $batch')
+
+    def _request(self, method, url, headers=None, params=None, json=None, **kwargs):
+        if kwargs:
+            raise ValueError('{} is not supported in a $batch request'.format(', '.join(kwargs)))
+        if url.startswith(self._base_url):
+            url = '/' + url[len(self._base_url):]
+        elif url.startswith(self.RESOURCE):
+            raise ValueError('All requests in a $batch must use API version ' + self._api_version)
+        if params:
+            url += ('&' if '?' in url else '?') + urlencode(params)
+        _headers = dict(headers) if headers else {}
+        if json is not None:
+            _headers['Content-Type'] = 'application/json'
+        request = BatchRequest(str(len(self._requests) + 1), method, url, headers=_headers, body=json)
+        self._requests.append(request)
+        return request
+
+    @staticmethod
+    def _chunks(requests):
+        # requests joined by dependsOn have to travel in the same $batch, so group them first
+        group_of = {}
+        groups = []
+        for request in requests:
+            group = None
+            for dependency in request.dependencies:
+                if dependency.id not in group_of:
+                    raise ValueError('Request {} depends on a request outside of this batch'.format(request.id))
+                other = group_of[dependency.id]
+                if group is None:
+                    group = other
+                elif other is not group:
+                    group.extend(other)
+                    for r in other:
+                        group_of[r.id] = group
+                    groups = [g for g in groups if g is not other]
+            if group is None:
+                group = []
+                groups.append(group)
+            group.append(request)
+            group_of[request.id] = group
+
+        chunks = []
+        chunk = []
+        for group in groups:
+            if len(group) > MAX_BATCH_SIZE:
+                raise ValueError('More than {} requests are linked through depends_on'.format(MAX_BATCH_SIZE))
+            if len(chunk) + len(group) > MAX_BATCH_SIZE:
+                chunks.append(chunk)
+                chunk = []
+            chunk.extend(sorted(group, key=lambda r: int(r.id)))
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    @staticmethod
+    def _batch_json(chunk):
+        ids = {request.id for request in chunk}
+        return {'requests': [request.as_json(ids) for request in chunk]}
+
+    @staticmethod
+    def _dispatch(chunk, result):
+        by_id = {request.id: request for request in chunk}
+        for response in result.get('responses', []):
+            request = by_id.pop(response.get('id'), None)
+            if request is not None:
+                request._set_response(response)
+        for request in by_id.values():
+            request._set_exception(RuntimeError('The $batch response has no entry for request ' + request.id))
+
+    def _record_writes(self, chunk):
+        # the writes that succeeded make cached responses out of date, as they do outside a batch
+        if self._cache is None:
+            return
+        for request in chunk:
+            if request.method != 'GET' and request.exception() is None:
+                self._cache.written(self._base_url + request.url.lstrip('/'))
+
+    def _throttled(self, chunk, attempt):
+        # 429 and 503 items were not processed: they go again, with the failed items depending on them, once the
+        # longest Retry-After has passed. Returns those requests and the delay
+        again, delay = [], 0
+        ids = set()
+        for request in chunk:
+            exception = request.exception()
+            if isinstance(exception, (TooManyRequests, ServiceUnavailable)):
+                item_delay = self._throttle.retry_delay(self._context, request.method, attempt, exception)
+                if item_delay is None:
+                    continue
+                delay = max(delay, item_delay)
+            elif exception is None or not any(r.id in ids for r in request.dependencies):
+                continue
+            again.append(request)
+            ids.add(request.id)
+        for request in again:
+            request._reset()
+        return again, delay
+
+    def _send_chunk(self, chunk):
+        attempt = 0
+        while chunk:
+            try:
+                result = self._client._post(self._url('batch'), json=self._batch_json(chunk))
+            except Exception as ex:
+                for request in chunk:
+                    request._set_exception(ex)
+                return
+            self._dispatch(chunk, result)
+            self._record_writes(chunk)
+            chunk, delay = self._throttled(chunk, attempt)
+            if chunk:
+                time.sleep(delay)
+                attempt += 1
+
+    async def _send_chunk_async(self, chunk):
+        attempt = 0
+        while chunk:
+            try:
+                result = await self._client._post(self._url('batch'), json=self._batch_json(chunk))
+            except Exception as ex:
+                for request in chunk:
+                    request._set_exception(ex)
+                return
+            self._dispatch(chunk, result)
+            self._record_writes(chunk)
+            chunk, delay = self._throttled(chunk, attempt)
+            if chunk:
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def execute(self):
+        """Send every queued request that hasn't been sent yet. Called automatically at the end of the with-block."""
+        chunks = self._take_chunks()
+        if len(chunks) == 1:
+            self._send_chunk(chunks[0])
+        elif chunks:
+            with ThreadPoolExecutor(max_workers=min(self._max_workers, len(chunks))) as executor:
+                list(executor.map(self._send_chunk, chunks))
+
+    async def execute_async(self):
+        """The asyncio counterpart of execute(), used when the batch was created from an AsyncClient."""
+        chunks = self._take_chunks()
+        semaphore = asyncio.Semaphore(self._max_workers)
+
+        async def send(chunk):
+            async with semaphore:
+                await self._send_chunk_async(chunk)
+
+        await asyncio.gather(*[send(chunk) for chunk in chunks])
+
+    def _take_chunks(self):
+        chunks = self._chunks(self._requests[self._sent:])
+        self._sent = len(self._requests)
+        return chunks
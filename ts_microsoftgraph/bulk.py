@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ts_microsoftgraph.attachments import UPLOAD_THRESHOLD, encode_file_base64, file_attachment
+from ts_microsoftgraph.client import Client
+from ts_microsoftgraph.throttle import TokenBucket
+
+SENT = 'sent'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+# Exchange Online lets one mailbox send 30 messages a minute
+DEFAULT_PER_MINUTE = 30
+
+OutgoingMessage = namedtuple('OutgoingMessage', ['id', 'subject', 'recipients', 'body', 'content_type', 'attachments',
+                                                 'context'])
+OutgoingMessage.__new__.__defaults__ = ('', 'HTML', (), None)
+OutgoingMessage.__doc__ = """A message for send_bulk(). id is your unique key for it (the checkpoint remembers it once sent),
+attachments a list of local filenames and context the mailbox to send from ('users/{id}'), the client's by default."""
+
+SendResult = namedtuple('SendResult', ['id', 'status', 'error'])
+SendResult.__doc__ = """The outcome for one message: status is SENT, FAILED (error holds the exception) or SKIPPED (already
+sent according to the checkpoint)."""
+
+
+class AttachmentCache(object):
+    """Encodes every distinct attachment once: files are identified by the hash of their content, and a file that
+    hasn't changed (same path, size and modification time) isn't even read again.
+
+    The encoded attachments are kept up to max_bytes of base64 content, least recently used go first, and the
+    files known to have that content are forgotten with them.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._lock = threading.Lock()
+        # (path, size, mtime) -> content hash, and the reverse, for the hashes in _encoded only
+        self._digests = {}
+        self._signatures = {}
+        self._encoded = OrderedDict()
+        self._stats = {'hits': 0, 'encoded': 0}
+
+    @staticmethod
+    def _digest(filename):
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def attachment(self, filename):
+        """The inline fileAttachment dict for filename."""
+        stat = os.stat(filename)
+        signature = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(signature)
+        if digest is None:
+            digest = self._digest(filename)
+        with self._lock:
+            content = self._encoded.get(digest)
+            if content is not None:
+                self._encoded.move_to_end(digest)
+                self._stats['hits'] += 1
+                self._remember(signature, digest)
+        if content is None:
+            content = encode_file_base64(filename)
+            with self._lock:
+                if digest not in self._encoded:
+                    self._encoded[digest] = content
+                    self._size += len(content)
+                    self._stats['encoded'] += 1
+                    while self._size > self._max_bytes and len(self._encoded) > 1:
+                        evicted, evicted_content = self._encoded.popitem(last=False)
+                        self._size -= len(evicted_content)
+                        for evicted_signature in self._signatures.pop(evicted, ()):
+                            del self._digests[evicted_signature]
+                self._remember(signature, digest)
+        return file_attachment(filename, content_bytes=content)
+
+    def _remember(self, signature, digest):
+        if signature not in self._digests:
+            self._digests[signature] = digest
+            self._signatures.setdefault(digest, []).append(signature)
+
+    def stats(self):
+        """Returns the hits and encoded counters."""
+        with self._lock:
+            return dict(self._stats)
+
+
+class SendCheckpoint(object):
+    """Remembers which messages went out, so a restarted send_bulk() doesn't send them again."""
+
+    def is_sent(self, message_id):
+        raise NotImplementedError
+
+    def mark_sent(self, message_id):
+        raise NotImplementedError
+
+
+class MemorySendCheckpoint(SendCheckpoint):
+    def __init__(self):
+        self._sent = set()
+        self._lock = threading.Lock()
+
+    def is_sent(self, message_id):
+        with self._lock:
+            return message_id in self._sent
+
+    def mark_sent(self, message_id):
+        with self._lock:
+            self._sent.add(message_id)
+
+
+class FileSendCheckpoint(SendCheckpoint):
+    """An append-only journal file with one JSON encoded id per line, flushed (and by default fsynced) after each
+    message, so it survives a crash of the process."""
+
+    def __init__(self, path, fsync=True):
+        self._lock = threading.Lock()
+        self._fsync = fsync
+        self._sent = set()
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        self._sent.add(json.loads(line))
+                    except ValueError:
+                        # a line cut short by a crash
+                        pass
+        except FileNotFoundError:
+            pass
+        self._file = open(path, 'a')
+
+    def is_sent(self, message_id):
+        with self._lock:
+            return message_id in self._sent
+
+    def mark_sent(self, message_id):
+        with self._lock:
+            self._file.write(json.dumps(message_id) + '\n')
+            self._file.flush()
+            if self._fsync:
+                os.fsync(self._file.fileno())
+            self._sent.add(message_id)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _as_message(item):
+    if isinstance(item, OutgoingMessage):
+        return item
+    return OutgoingMessage(**item)
+
+
+def send_bulk(client: Client, messages, max_workers=4, per_minute=DEFAULT_PER_MINUTE, checkpoint: SendCheckpoint = None,
+              attachment_cache: AttachmentCache = None, upload_threshold=UPLOAD_THRESHOLD, save_to_sent_items=True):
+    """Send many messages on a bounded thread pool, yielding a SendResult for each as it completes.
+
+    Attachments are encoded once per distinct file content and reused for every message that carries them (see
+    AttachmentCache); only files above upload_threshold go through an upload session for each message. Each
+    mailbox sends at most per_minute messages a minute, whatever max_workers is. With a checkpoint, the messages it
+    lists are skipped and every sent message is recorded right after Graph accepted it - a message sent just before
+    a crash may still be sent twice, but never the ones before it.
+
+        checkpoint = FileSendCheckpoint('mailer.journal')
+        for result in send_bulk(client, (OutgoingMessage(row.id, subject, [row.email], body, attachments=[flyer])
+                                         for row in rows), checkpoint=checkpoint):
+            if result.status == FAILED:
+                ...
+
+    Args:
+        client: the Client to send with.
+        messages: an iterable of OutgoingMessage, or of dicts with the same keys. It is consumed lazily.
+        max_workers: the number of messages being sent at the same time.
+        per_minute: the most messages sent per minute from one mailbox, None for no limit.
+        checkpoint: a SendCheckpoint, None to not keep track of the progress.
+        attachment_cache: an AttachmentCache to share between runs, a new one by default.
+        upload_threshold: file size in bytes above which an attachment goes through an upload session.
+        save_to_sent_items: keep a copy of the messages in the Sent Items folder. Ignored for the messages with an
+            attachment above upload_threshold: their draft is sent with /send, which always saves the copy.
+
+    Returns:
+        A generator of SendResult, in completion order.
+    """
+    cache = AttachmentCache() if attachment_cache is None else attachment_cache
+    buckets = {}
+    clients = {}
+    lock = threading.Lock()
+
+    def mailbox(context):
+        with lock:
+            if context not in clients:
+                clients[context] = client if context is None else client.for_context(context)
+                buckets[context] = TokenBucket(per_minute / 60.0, 1) if per_minute else None
+            return clients[context], buckets[context]
+
+    def send(message):
+        try:
+            if not message.subject or not message.recipients:
+                raise ValueError('send_bulk(): message {!r} has no subject or recipients'.format(message.id))
+            sender, bucket = mailbox(message.context)
+            inline, large = [], []
+            for filename in message.attachments or ():
+                if os.path.getsize(filename) > upload_threshold:
+                    large.append(filename)
+                else:
+                    inline.append(cache.attachment(filename))
+            payload = sender._mail_message(message.subject, message.recipients, message.body, message.content_type,
+                                           inline)
+            if bucket is not None:
+                delay = bucket.reserve()
+                if delay > 0:
+                    time.sleep(delay)
+            if large:
+                sender._send_with_uploads(payload, large, 1)
+            else:
+                sender._post(sender._url('send_mail'),
+                             json={'Message': payload, 'SaveToSentItems': 'true' if save_to_sent_items else 'false'})
+        except Exception as ex:
+            return SendResult(message.id, FAILED, ex)
+        if checkpoint is not None:
+            checkpoint.mark_sent(message.id)
+        return SendResult(message.id, SENT, None)
+
+    items = iter(messages)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        while True:
+            while len(in_flight) < max_workers * 2:
+                item = next(items, None)
+                if item is None:
+                    break
+                message = _as_message(item)
+                if checkpoint is not None and checkpoint.is_sent(message.id):
+                    yield SendResult(message.id, SKIPPED, None)
+                    continue
+                in_flight.add(executor.submit(send, message))
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
@@ -0,0 +1,293 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlsplit
+
+from ts_microsoftgraph import decoder
+
+# query options that make a GET one of the next pages of a collection (@odata.nextLink) or part of a delta round
+_UNCACHEABLE_OPTIONS = frozenset(('$skip', '$skiptoken', '$deltatoken'))
+
+
+def _path(url):
+    return urlsplit(url).path.rstrip('/')
+
+
+def _parents(path):
+    # '/v1.0/me/calendars/AAA' -> '/v1.0/me/calendars', '/v1.0/me', '/v1.0'
+    parents = []
+    while path.count('/') > 1:
+        path = path.rsplit('/', 1)[0]
+        parents.append(path)
+    return parents
+
+
+class ResponseCache(object):
+    """Base class of the opt-in GET response caches used by Client(cache=...).
+
+    Entries are keyed by (method, url, params, context, identity) - identity being who the token acts for (see
+    Auth.identity), so users sharing a cache never see each other's responses - and hold the decoded response
+    together with its ETag. A fresh entry (younger than ttl) is returned without a request. A stale entry with an
+    ETag is revalidated with If-None-Match, so an unchanged resource only costs a 304. Values are stored as JSON, so
+    every hit returns a new copy that the caller is free to modify.
+
+    A successful write (POST, PUT, PATCH or DELETE) through a client drops the entries of the url written to, of
+    everything under it and of its parents, e.g. calendar_create() drops the cached calendars_list(). Writes are
+    recorded as marks in the cache's storage, so they reach every process sharing it. Delta queries and the next
+    pages of a collection (@odata.nextLink) are never cached.
+
+    Subclasses implement _load(key), _save(key, entry), _remove(key), _mark(names, when) and _marked(names) for
+    their storage.
+    """
+
+    def __init__(self, ttl=300):
+        """
+        :param ttl: seconds an entry is served without asking Graph
+        """
+        self.ttl = ttl
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stores': 0, 'evictions': 0}
+
+    @staticmethod
+    def key(method, url, params, context, identity=None):
+        return json.dumps([method, url, sorted((params or {}).items()), context, identity], default=str)
+
+    @staticmethod
+    def cacheable(url, params=None):
+        """False for a delta query, or one of the next pages of a collection ($skip, $skiptoken or $deltatoken)."""
+        split = urlsplit(url)
+        if split.path.rstrip('/').endswith('/delta'):
+            return False
+        options = {name for name, _ in parse_qsl(split.query)}
+        options.update(params or ())
+        return not options & _UNCACHEABLE_OPTIONS
+
+    def lookup(self, key):
+        """Returns (value, etag, fresh) for key, or None on a miss. fresh is False once the ttl has passed."""
+        entry = self._load(key)
+        if entry is not None and entry.get('path') is not None and self._written_since(entry['path'],
+                                                                                       entry['stored_at']):
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self._count('misses')
+            return None
+        fresh = entry['stored_at'] + self.ttl > time.time()
+        if fresh:
+            self._count('hits')
+        elif not entry.get('etag'):
+            # nothing to revalidate with
+            self._count('misses')
+            return None
+        return decoder.loads(entry['value']), entry.get('etag'), fresh
+
+    def store(self, key, value, etag=None, url=None):
+        """Keep the response to a GET of url under key."""
+        if not isinstance(value, (dict, list)):
+            return
+        if etag is None and isinstance(value, dict):
+            etag = value.get('@odata.etag')
+        self._save(key, {'value': json.dumps(value), 'etag': etag, 'stored_at': time.time(),
+                         'path': _path(url) if url is not None else None})
+        self._count('stores')
+
+    def revalidated(self, key, value, etag, url=None):
+        """Record a 304 for key: the entry is fresh again for another ttl."""
+        self._count('revalidated')
+        self.store(key, value, etag, url)
+
+    def invalidate(self, key):
+        self._remove(key)
+
+    def written(self, url):
+        """Record a successful write to url: the entries of url, of the urls under it and of its parents are no
+        longer served."""
+        path = _path(url)
+        self._mark(['tree:' + path] + ['item:' + parent for parent in _parents(path)], time.time())
+
+    def _written_since(self, path, when):
+        # an entry is out of date once its url, or a url above it, was written to
+        written = self._marked(['item:' + path] + ['tree:' + p for p in [path] + _parents(path)])
+        return written is not None and written >= when
+
+    def stats(self):
+        """Returns the hits, misses, revalidated (304), stores and evictions counters."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def _load(self, key):
+        raise NotImplementedError
+
+    def _save(self, key, entry):
+        raise NotImplementedError
+
+    def _remove(self, key):
+        raise NotImplementedError
+
+    def _mark(self, names, when):
+        raise NotImplementedError
+
+    def _marked(self, names):
+        """The latest time one of the marks in names was set, or None."""
+        raise NotImplementedError
+
+
+class MemoryCache(ResponseCache):
+    """An in-process LRU cache holding at most maxsize responses."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        super().__init__(ttl=ttl)
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _save(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _mark(self, names, when):
+        with self._lock:
+            for name in names:
+                self._marks[name] = when
+            if len(self._marks) > self._maxsize:
+                # marks older than the ttl can go: the entries they'd hide are stale and revalidated anyway
+                self._marks = {name: at for name, at in self._marks.items() if at > when - self.ttl}
+
+    def _marked(self, names):
+        with self._lock:
+            return max((self._marks[name] for name in names if name in self._marks), default=None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._marks.clear()
+
+
+class SQLiteCache(ResponseCache):
+    """An on-disk cache in a SQLite database, holding at most maxsize responses (least recently used go first).
+
+    Several processes can point at the same file to share the cache.
+    """
+
+    def __init__(self, path, maxsize=100000, ttl=300):
+        super().__init__(ttl=ttl)
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'key TEXT PRIMARY KEY, value TEXT NOT NULL, etag TEXT, stored_at REAL NOT NULL, '
+                         'used_at REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)')
+        if 'path' not in {row[1] for row in self._db.execute('PRAGMA table_info(responses)')}:
+            # a cache file from an earlier version
+            self._db.execute('ALTER TABLE responses ADD COLUMN path TEXT')
+        self._db.execute('CREATE TABLE IF NOT EXISTS writes (name TEXT PRIMARY KEY, written_at REAL NOT NULL)')
+
+    def _load(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT value, etag, stored_at, path FROM responses WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE responses SET used_at = ? WHERE key = ?', (time.time(), key))
+        return {'value': row[0], 'etag': row[1], 'stored_at': row[2], 'path': row[3]}
+
+    def _save(self, key, entry):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses (key, value, etag, stored_at, used_at, path) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, entry['value'], entry['etag'], entry['stored_at'], time.time(), entry['path']))
+            overflow = self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self._maxsize
+            if overflow > 0:
+                self._db.execute('DELETE FROM responses WHERE key IN '
+                                 '(SELECT key FROM responses ORDER BY used_at LIMIT ?)', (overflow,))
+        if overflow > 0:
+            self._count('evictions', overflow)
+
+    def _remove(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+    def _mark(self, names, when):
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO writes (name, written_at) VALUES (?, ?)',
+                                 [(name, when) for name in names])
+            # marks older than the ttl can go: the entries they'd hide are stale and revalidated anyway
+            self._db.execute('DELETE FROM writes WHERE written_at < ?', (when - self.ttl,))
+
+    def _marked(self, names):
+        with self._lock:
+            return self._db.execute('SELECT MAX(written_at) FROM writes WHERE name IN ({})'.format(
+                ', '.join('?' * len(names))), names).fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+            self._db.execute('DELETE FROM writes')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SharedCache(ResponseCache):
+    """A cache on top of a store shared between worker processes.
+
+    store is any mapping-like object with get(key), store[key] = value and del store[key] on str values - a
+    multiprocessing.Manager().dict(), or a redis.Redis client (whose own maxmemory policy then bounds the size).
+    The write marks are kept in the store too, under prefix + 'written:'.
+    """
+
+    def __init__(self, store, prefix='ts_microsoftgraph:', ttl=300):
+        super().__init__(ttl=ttl)
+        self._store = store
+        self._prefix = prefix
+
+    def _load(self, key):
+        raw = self._store.get(self._prefix + key)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    def _save(self, key, entry):
+        self._store[self._prefix + key] = json.dumps(entry)
+
+    def _remove(self, key):
+        try:
+            del self._store[self._prefix + key]
+        except KeyError:
+            pass
+
+    def _mark(self, names, when):
+        for name in names:
+            self._store[self._prefix + 'written:' + name] = repr(when)
+
+    def _marked(self, names):
+        marks = [self._store.get(self._prefix + 'written:' + name) for name in names]
+        return max((float(mark) for mark in marks if mark is not None), default=None)
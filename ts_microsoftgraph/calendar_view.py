@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_SLICE = timedelta(days=7)
+DEFAULT_PAGE_SIZE = 250
+# the fields the slices are merged on, always requested
+MERGE_FIELDS = ('id', 'start', 'end')
+
+
+def _as_datetime(value):
+    # aware and in UTC, a value without an offset being UTC already (as calendarView takes it)
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def format_datetime(value):
+    """ISO 8601 as calendarView expects it, in UTC for aware datetimes."""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return value.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def time_slices(start, end, slice_length=DEFAULT_SLICE):
+    """Split [start, end) into consecutive (start, end) windows of at most slice_length, as ISO 8601 strings.
+
+    Args:
+        start: a datetime or an ISO 8601 string (e.g. 2020-01-01T00:00:00Z), UTC if it has no offset.
+        end: a datetime or an ISO 8601 string, UTC if it has no offset.
+        slice_length: a timedelta.
+    """
+    start, end = _as_datetime(start), _as_datetime(end)
+    if slice_length <= timedelta(0):
+        raise ValueError('slice_length must be positive')
+    slices = []
+    while start < end:
+        stop = min(start + slice_length, end)
+        slices.append((format_datetime(start), format_datetime(stop)))
+        start = stop
+    return slices
+
+
+def slice_params(params, start, end):
+    """Copy params for one slice: the window, and $select extended with the fields merge_slices() needs."""
+    params = dict(params) if params else {}
+    params['startDateTime'] = start
+    params['endDateTime'] = end
+    if params.get('$select'):
+        selected = params['$select'].split(',')
+        params['$select'] = ','.join(selected + [field for field in MERGE_FIELDS if field not in selected])
+    return params
+
+
+def _start(event):
+    return (event.get('start') or {}).get('dateTime') or ''
+
+
+def merge_slice(events, previous):
+    """The occurrences of one slice that the previous slice didn't return, sorted by start time, and the ids to pass
+    as previous for the next slice.
+
+    An occurrence is returned by every slice it overlaps, so it is dropped when the previous slice had it already.
+    The ones that are new in a slice all start at or after the previous slice's end, so sorting each slice is enough
+    for the whole stream to be in order - and only the ids of one slice are kept in memory.
+    """
+    new = [event for event in sorted(events, key=_start) if event.get('id') not in previous]
+    return new, frozenset(event.get('id') for event in events)
+
+
+def merge_slices(slices):
+    """Yield the occurrences of consecutive slices (an iterable of lists of events, in time order) once each, in
+    start time order. See merge_slice()."""
+    previous = frozenset()
+    for events in slices:
+        new, previous = merge_slice(events, previous)
+        yield from new
@@ -1,20 +1,115 @@
-import base64
-import mimetypes
-import requests
+import copy
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import ts_microsoftgraph.exceptions
+from ts_microsoftgraph.attachments import UPLOAD_THRESHOLD, file_attachment, upload_files
 from ts_microsoftgraph.auth import Auth
+from ts_microsoftgraph.cache import ResponseCache
+from ts_microsoftgraph.calendar_view import DEFAULT_PAGE_SIZE, DEFAULT_SLICE, merge_slices, slice_params, time_slices
 from ts_microsoftgraph.decorators import token_required
+from ts_microsoftgraph import endpoints
+from ts_microsoftgraph import models
+from ts_microsoftgraph.instrumentation import RequestRecord, emit
+from ts_microsoftgraph.paging import iter_items, page_params
+from ts_microsoftgraph import projections
+from ts_microsoftgraph.projections import ProjectionAudit
 from ts_microsoftgraph.reponse_parser import parse
+from ts_microsoftgraph.session import SessionPool
+from ts_microsoftgraph.streaming import CHUNK_SIZE, copy_to_sink, iter_response
+from ts_microsoftgraph.throttle import Throttle
 
 
 class Client(object):
     RESOURCE = 'https://graph.microsoft.com/'
-    def __init__(self, auth: Auth, api_version='v1.0', context='me'):
+    def __init__(self, auth: Auth, api_version='v1.0', context='me', session: SessionPool = None,
+                 throttle: Throttle = None, cache: ResponseCache = None, audit_projections=False, hooks=None):
+        """
+        Args:
+            auth: the Auth object providing the token.
+            api_version: Graph API version, 'v1.0' by default.
+            context: the user the calls are made for, 'me' by default or 'users/{id}'.
+            session: an optional SessionPool to send requests through. Pass one to tune the pool size and per-host
+                connection limit, or to share connections between several clients. If omitted, the client creates
+                its own pool and closes it in close().
+            throttle: an optional Throttle handling retries of throttled (429/503) and transient 5xx responses.
+                Share one between clients so they share the per-mailbox limits and metrics. If omitted, the client
+                gets its own Throttle with the default RetryPolicy.
+            cache: an optional ResponseCache (MemoryCache, SQLiteCache or SharedCache) for GET responses, useful
+                for data that rarely changes such as calendars_list or message_folder_list. Off by default.
+            audit_projections: record which response fields are actually read, see projection_audit. For
+                development runs only.
+            hooks: instrumentation hooks (see ts_microsoftgraph.instrumentation) told about every call: timings,
+                status, sizes, retries and throttle waits. Give the same hooks to Auth to see the token requests.
+        """
         self._api_version = api_version
         self._base_url = self.RESOURCE + self._api_version + '/'
         self._auth = auth
-        self.token = auth.get_token()
         self._context = context
+        self._context_url = endpoints.context_prefix(self.RESOURCE, self._api_version, context)
+        self._owns_session = session is None
+        self._session = SessionPool() if session is None else session
+        self._throttle = Throttle() if throttle is None else throttle
+        self._cache = cache
+        self._projection_audit = ProjectionAudit() if audit_projections else None
+        self._hooks = tuple(hooks) if hooks else ()
+
+    @property
+    def token(self):
+        """The current token of the Auth object, so clients sharing an Auth always see the latest refresh.
+
+        Setting it (as client.token = token worked before tokens moved to Auth) hands the token to the Auth object
+        with Auth.set_token(), so every client sharing that Auth uses it too.
+        """
+        return self._auth.get_token()
+
+    @token.setter
+    def token(self, token):
+        self._auth.set_token(token)
+
+    @property
+    def throttle(self) -> Throttle:
+        return self._throttle
+
+    @property
+    def cache(self) -> ResponseCache:
+        return self._cache
+
+    @property
+    def projection_audit(self) -> ProjectionAudit:
+        """The ProjectionAudit of a client created with audit_projections=True, None otherwise."""
+        return self._projection_audit
+
+    def close(self):
+        """Release the pooled connections, if this client created its own SessionPool."""
+        if self._owns_session:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def for_context(self, context, auth: Auth = None):
+        """A client for another user that shares this client's connection pool, throttle and (unless auth is given)
+        Auth object. Cheap enough to create one per mailbox.
+
+        Args:
+            context: the user the calls are made for, e.g. 'users/{id}'.
+            auth: an optional Auth to use instead, e.g. app_auth.for_tenant(tenant_id).
+
+        Returns:
+            A Client of the same class. Closing it doesn't close the shared pool.
+        """
+        client = copy.copy(self)
+        client._context = context
+        client._context_url = endpoints.context_prefix(client.RESOURCE, client._api_version, context)
+        client._owns_session = False
+        if auth is not None:
+            client._auth = auth
+        return client
 
     def try_for_valid_token(self) -> bool:
         """
@@ -30,7 +125,7 @@ class Client(object):
             return False
 
     @token_required
-    def me(self, params=None):
+    def me(self, params=None, profile=None):
         """Retrieve the properties and relationships of user object in given context.
 
         Note: Getting a user returns a default set of properties only (businessPhones, displayName, givenName, id,
@@ -43,12 +138,14 @@ class Client(object):
 
         Args:
             params: A dict.
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
 
         Returns:
             A dict.
 
         """
-        return self._get(self._base_url + self._context, params=params)
+        return self._audit('user', self._get(self._url('user'),
+                                             params=self._project('user', profile, params)))
 
     @token_required
     def subscription_create(self, change_type, notification_url, resource, expiration_datetime, client_state=None):
@@ -73,7 +170,7 @@ class Client(object):
             'expirationDateTime': expiration_datetime,
             'clientState': client_state
         }
-        return self._post(self._base_url + 'subscriptions', json=data)
+        return self._post(self._url('subscriptions'), json=data)
 
     @token_required
     def subscription_renew(self, subscription_id, expiration_datetime):
@@ -92,7 +189,7 @@ class Client(object):
         data = {
             'expirationDateTime': expiration_datetime
         }
-        return self._patch(self._base_url + 'subscriptions/{}'.format(subscription_id), json=data)
+        return self._patch(self._url('subscription', subscription_id=subscription_id), json=data)
 
     @token_required
     def subscription_delete(self, subscription_id):
@@ -105,29 +202,99 @@ class Client(object):
             None.
 
         """
-        return self._delete(self._base_url + 'subscriptions/{}'.format(subscription_id))
+        return self._delete(self._url('subscription', subscription_id=subscription_id))
+
+    @token_required
+    def subscription_list(self, params=None):
+        """Retrieve the subscriptions of the application (app-only) or of the signed-in user.
+
+        Args:
+            params:
+
+        Returns:
+            A dict.
+
+        """
+        return self._get(self._url('subscriptions'), params=params)
+
+    @token_required
+    def iter_subscriptions(self, params=None, page_size=None, max_items=None, prefetch=False):
+        """Iterate over the subscriptions, following the pages lazily.
+
+        Args:
+            params:
+            page_size: number of items per page ($top).
+            max_items: stop after this many items.
+            prefetch: fetch the next page in the background while the current one is consumed.
+
+        Returns:
+            A generator of items (dicts).
+
+        """
+        return self._iter(self._url('subscriptions'), params, page_size, max_items, prefetch)
 
     # Mail
     @token_required
-    def message_folder_list(self, params=None):
+    def message_folder_list(self, params=None, profile=None):
         """Retrieve the list of mailbox folders.
         Args:
             params:
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
         Returns:
             A dict.
         """
-        return self._get(self._base_url + self._context + '/mailFolders/', params=params)
+        return self._audit('mail_folders', self._get(self._url('mail_folders'),
+                                                     params=self._project('mail_folders', profile, params)))
 
     @token_required
-    def message_list(self, folder_id, params=None):
+    def iter_mail_folders(self, params=None, page_size=None, max_items=None, prefetch=False, profile=None,
+                          model=False):
+        """Iterate over the mailbox folders, following the pages lazily.
+        Args:
+            params:
+            page_size: number of items per page ($top).
+            max_items: stop after this many items.
+            prefetch: fetch the next page in the background while the current one is consumed.
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
+            model: yield MailFolder objects (see ts_microsoftgraph.models) instead of dicts.
+        Returns:
+            A generator of items (dicts).
+        """
+        return self._audit('mail_folders', self._iter(self._url('mail_folders'),
+                                                      self._project('mail_folders', profile, params), page_size,
+                                                      max_items, prefetch), model)
+
+    @token_required
+    def message_list(self, folder_id, params=None, profile=None):
         """Retrieve the list of messages in a mailbox folder.
         Args:
             folder_id: selected mail folder.
             params:
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
         Returns:
             A dict.
         """
-        return self._get(self._base_url + self._context + '/mailFolders/{id}/messages'.format(id=folder_id), params=params)
+        return self._audit('messages', self._get(self._url('folder_messages', folder_id=folder_id),
+                                                 params=self._project('messages', profile, params)))
+
+    @token_required
+    def iter_messages(self, folder_id, params=None, page_size=None, max_items=None, prefetch=False, profile=None,
+                      model=False):
+        """Iterate over the messages in a mailbox folder, following the pages lazily.
+        Args:
+            folder_id: selected mail folder.
+            params:
+            page_size: number of items per page ($top).
+            max_items: stop after this many items.
+            prefetch: fetch the next page in the background while the current one is consumed.
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
+            model: yield Message objects (see ts_microsoftgraph.models) instead of dicts.
+        Returns:
+            A generator of items (dicts).
+        """
+        return self._audit('messages', self._iter(
+            self._url('folder_messages', folder_id=folder_id),
+            self._project('messages', profile, params), page_size, max_items, prefetch), model)
 
     @token_required
     def message_list_next(self, last_response_payload):
@@ -137,26 +304,135 @@ class Client(object):
             return None
 
     @token_required
-    def message_get(self, message_id, params=None, mime_content=False):
+    def message_delta(self, folder_id, params=None):
+        """Start a delta query for the messages in a mailbox folder. Follow @odata.nextLink to page through the
+        changes; the last page carries an @odata.deltaLink to get the next round of changes.
+        See ts_microsoftgraph.delta.DeltaSync for a sync engine built on this.
+        Args:
+            folder_id: selected mail folder.
+            params:
+        Returns:
+            A dict.
+        """
+        return self._get(self._url('folder_messages_delta', folder_id=folder_id),
+                         params=params)
+
+    @token_required
+    def message_get(self, message_id, params=None, mime_content=False, profile=None, model=False):
         """Retrieve the properties and relationships of a message object.
         Args:
             message_id: A dict.
             params:
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'. Ignored with mime_content.
+            model: return a Message object (see ts_microsoftgraph.models) instead of a dict. Ignored with mime_content.
         Returns:
             A dict.
         """
-        return self._get(self._base_url + self._context + '/messages/' + message_id + ("" if not mime_content else "/$value"), params=params)
+        if mime_content:
+            return self._get(self._url('message_value', message_id=message_id), params=params)
+        return self._audit('messages', self._get(self._url('message', message_id=message_id),
+                                                 params=self._project('messages', profile, params, top=False)), model)
 
     @token_required
-    def message_send(self, subject=None, recipients=None, body='', content_type='HTML', attachments=None):
+    def message_iter_mime(self, message_id, chunk_size=CHUNK_SIZE):
+        """Stream the MIME content of a message without holding it in memory.
+        Args:
+            message_id:
+            chunk_size: the size of the chunks read from the connection.
+        Returns:
+            A generator of bytes chunks. The connection is released once it is exhausted or closed.
+        """
+        return self._stream(self._url('message_value', message_id=message_id), chunk_size)
+
+    @token_required
+    def message_download_mime(self, message_id, sink, chunk_size=CHUNK_SIZE, compress=False, hash_name='sha256'):
+        """Write the MIME content of a message to a file as it is received.
+        Args:
+            message_id:
+            sink: a binary file-like object, or a path to create.
+            chunk_size: the size of the chunks read from the connection.
+            compress: gzip the content as it is written.
+            hash_name: a hashlib algorithm computed over the MIME content, or None.
+        Returns:
+            A dict with the 'size' of the MIME content and its 'hash'.
+        """
+        return self._download(self._url('message_value', message_id=message_id), sink,
+                              chunk_size, compress, hash_name)
+
+    @token_required
+    def message_attachments(self, message_id, params=None, profile=None):
+        """List the attachments of a message.
+
+        Args:
+            message_id:
+            params:
+            profile: a projection profile name (see ts_microsoftgraph.projections) - 'headers-only' lists the
+                metadata without the base64 contentBytes.
+
+        Returns:
+            A dict.
+
+        """
+        return self._audit('attachments', self._get(self._url('message_attachments', message_id=message_id),
+                                                    params=self._project('attachments', profile, params)))
+
+    @token_required
+    def iter_message_attachments(self, message_id, params=None, page_size=None, max_items=None, prefetch=False,
+                                 profile=None):
+        """Iterate over the attachments of a message, following the pages lazily.
+
+        Args:
+            message_id:
+            params:
+            page_size: number of items per page ($top).
+            max_items: stop after this many items.
+            prefetch: fetch the next page in the background while the current one is consumed.
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
+
+        Returns:
+            A generator of items (dicts).
+
+        """
+        return self._audit('attachments', self._iter(self._url('message_attachments', message_id=message_id),
+                                                     self._project('attachments', profile, params), page_size,
+                                                     max_items, prefetch))
+
+    @token_required
+    def attachment_download(self, message_id, attachment_id, sink, chunk_size=CHUNK_SIZE, hash_name='sha256'):
+        """Write the raw content of a file attachment (or the MIME content of an item attachment) to a file as it
+        is received, without base64.
+
+        Args:
+            message_id:
+            attachment_id:
+            sink: a binary file-like object, or a path to create.
+            chunk_size: the size of the chunks read from the connection.
+            hash_name: a hashlib algorithm computed over the content, or None.
+
+        Returns:
+            A dict with the 'size' of the content and its 'hash'.
+
+        """
+        return self._download(self._url('message_attachment_value', message_id=message_id,
+                                        attachment_id=attachment_id), sink, chunk_size, False, hash_name)
+
+    @token_required
+    def message_send(self, subject=None, recipients=None, body='', content_type='HTML', attachments=None,
+                     upload_threshold=UPLOAD_THRESHOLD, max_workers=4):
         """Helper to send email from current user.
 
+        Attachments up to upload_threshold bytes are sent inline. If any attachment is larger, the message is
+        created as a draft, the large files are uploaded through upload sessions (max_workers at a time, in chunks
+        read from disk) and the draft is then sent.
+
         Args:
             subject: email subject (required)
             recipients: list of recipient email addresses (required)
             body: body of the message
             content_type: content type (default is 'HTML')
             attachments: list of file attachments (local filenames)
+            upload_threshold: file size in bytes above which an attachment goes through an upload session
+            max_workers: how many large attachments are uploaded at the same time
 
         Returns:
             Returns the response from the POST to the sendmail API.
@@ -166,29 +442,49 @@ class Client(object):
         if not all([subject, recipients]):
             raise ValueError('sendmail(): required arguments missing')
 
-        # Create recipient list in required format.
-        recipient_list = [{'EmailAddress': {'Address': address}} for address in recipients]
-
-        # Create list of attachments in required format.
+        # Create list of attachments in required format - large files are uploaded separately.
         attached_files = []
+        large_files = []
         if attachments:
             for filename in attachments:
-                b64_content = base64.b64encode(open(filename, 'rb').read())
-                mime_type = mimetypes.guess_type(filename)[0]
-                mime_type = mime_type if mime_type else ''
-                attached_files.append(
-                    {'@odata.type': '#microsoft.graph.fileAttachment', 'ContentBytes': b64_content.decode('utf-8'),
-                     'ContentType': mime_type, 'Name': filename})
-
-        # Create email message in required format.
-        email_msg = {'Message': {'Subject': subject,
-                                 'Body': {'ContentType': content_type, 'Content': body},
-                                 'ToRecipients': recipient_list,
-                                 'Attachments': attached_files},
-                     'SaveToSentItems': 'true'}
+                if os.path.getsize(filename) > upload_threshold:
+                    large_files.append(filename)
+                else:
+                    attached_files.append(file_attachment(filename))
+
+        message = self._mail_message(subject, recipients, body, content_type, attached_files)
+
+        if large_files:
+            return self._send_with_uploads(message, large_files, max_workers)
 
         # Do a POST to Graph's sendMail API and return the response.
-        return self._post(self._base_url + self._context + '/microsoft.graph.sendMail', json=email_msg)
+        return self._post(self._url('send_mail'),
+                          json={'Message': message, 'SaveToSentItems': 'true'})
+
+    @staticmethod
+    def _mail_message(subject, recipients, body, content_type, attachments):
+        # the message in the format sendMail and draft creation expect
+        return {'Subject': subject,
+                'Body': {'ContentType': content_type, 'Content': body},
+                'ToRecipients': [{'EmailAddress': {'Address': address}} for address in recipients],
+                'Attachments': attachments}
+
+    def _send_with_uploads(self, message, filenames, max_workers):
+        draft = self._post(self._url('messages'), json=message)
+        try:
+            upload_files(self, draft['id'], filenames, max_workers=max_workers)
+            return self._post(self._url('message_send', message_id=draft['id']))
+        except BaseException:
+            # don't leave a half-attached draft in the Drafts folder
+            self._discard_draft(draft['id'])
+            raise
+
+    def _discard_draft(self, message_id):
+        try:
+            self._delete(self._url('message', message_id=message_id))
+        except Exception:
+            # it was sent after all, or it stays behind - the original error matters more
+            pass
 
     # Onenote
     @token_required
@@ -199,7 +495,7 @@ class Client(object):
             A dict.
 
         """
-        return self._get(self._base_url + self._context + '/onenote/notebooks')
+        return self._get(self._url('onenote_notebooks'))
 
     @token_required
     def onenote_get(self, notebook_id):
@@ -212,7 +508,7 @@ class Client(object):
             A dict.
 
         """
-        return self._get(self._base_url + self._context + '/onenote/notebooks/' + notebook_id)
+        return self._get(self._url('onenote_notebook', notebook_id=notebook_id))
 
     @token_required
     def onenote_sections(self, notebook_id):
@@ -225,7 +521,7 @@ class Client(object):
             A dict.
 
         """
-        return self._get(self._base_url + self._context + '/onenote/notebooks/{}/sections'.format(notebook_id))
+        return self._get(self._url('onenote_notebook_sections', notebook_id=notebook_id))
 
     @token_required
     def onenote_create_page(self, section_id, files):
@@ -239,34 +535,183 @@ class Client(object):
             A dict.
 
         """
-        return self._post(self._base_url + self._context + '/onenote/sections/{}/pages'.format(section_id), files=files)
+        return self._post(self._url('onenote_section_pages', section_id=section_id), files=files)
 
     @token_required
-    def onenote_list_pages(self, params=None):
+    def onenote_download_page(self, page_id, sink, chunk_size=CHUNK_SIZE):
+        """Write the HTML content of a page to a file as it is received.
+
+        Args:
+            page_id:
+            sink: a binary file-like object, or a path to create.
+            chunk_size: the size of the chunks read from the connection.
+
+        Returns:
+            A dict with the 'size' of the content.
+
+        """
+        return self._download(self._url('onenote_page_content', page_id=page_id), sink, chunk_size, False, None)
+
+    @token_required
+    def onenote_download_resource(self, resource_id, sink, chunk_size=CHUNK_SIZE):
+        """Write a resource of a page (an image or an attached file) to a file as it is received.
+
+        Args:
+            resource_id: the id in the resource's url in the page content, .../onenote/resources/{id}/$value.
+            sink: a binary file-like object, or a path to create.
+            chunk_size: the size of the chunks read from the connection.
+
+        Returns:
+            A dict with the 'size' of the resource.
+
+        """
+        return self._download(self._url('onenote_resource', resource_id=resource_id), sink, chunk_size, False, None)
+
+    @token_required
+    def onenote_list_pages(self, params=None, profile=None):
         """Create a new page in the specified section.
 
         Args:
             params:
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
 
         Returns:
             A dict.
 
         """
-        return self._get(self._base_url + self._context + '/onenote/pages', params=params)
+        return self._audit('onenote_pages', self._get(self._url('onenote_pages'),
+                                                      params=self._project('onenote_pages', profile, params)))
+
+    @token_required
+    def iter_onenote_pages(self, params=None, page_size=None, max_items=None, prefetch=False, profile=None):
+        """Iterate over the OneNote pages, following the pages lazily.
+
+        Args:
+            params:
+            page_size: number of items per page ($top).
+            max_items: stop after this many items.
+            prefetch: fetch the next page in the background while the current one is consumed.
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
+
+        Returns:
+            A generator of items (dicts).
+
+        """
+        return self._audit('onenote_pages', self._iter(self._url('onenote_pages'),
+                                                       self._project('onenote_pages', profile, params), page_size,
+                                                       max_items, prefetch))
 
     # Calendar
     @token_required
-    def calendar_events(self):
+    def calendar_events(self, params=None, profile=None):
         """Get a list of event objects in the user's mailbox. The list contains single instance meetings and
         series masters.
 
         Currently, this operation returns event bodies in only HTML format.
 
+        Args:
+            params:
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
+
+        Returns:
+            A dict.
+
+        """
+        return self._audit('events', self._get(self._url('events'),
+                                               params=self._project('events', profile, params)))
+
+    @token_required
+    def calendar_view_delta(self, start_datetime, end_datetime, params=None):
+        """Start a delta query for the events in a time window of the user's primary calendar.
+
+        Args:
+            start_datetime: start of the window, ISO 8601 (e.g. 2017-09-04T00:00:00Z).
+            end_datetime: end of the window, ISO 8601.
+            params:
+
         Returns:
             A dict.
 
         """
-        return self._get(self._base_url + self._context + '/events')
+        params = dict(params) if params else {}
+        params.update({'startDateTime': start_datetime, 'endDateTime': end_datetime})
+        return self._get(self._url('calendar_view_delta'), params=params)
+
+    @token_required
+    def calendar_view(self, start, end, calendar=None, slice_length=DEFAULT_SLICE, max_workers=4, params=None,
+                      page_size=DEFAULT_PAGE_SIZE, profile=None, model=False):
+        """Iterate over the occurrences, exceptions and single instances of events in a time window, with recurring
+        series expanded.
+
+        The window is split into slices of slice_length that are fetched (with all their pages) max_workers at a
+        time, ahead of the consumer. Occurrences are yielded as soon as their slice is complete, once each even when
+        they span several slices, in start time order.
+
+            for event in client.calendar_view('2021-01-01T00:00:00Z', '2022-01-01T00:00:00Z', profile='headers-only'):
+                ...
+
+        Args:
+            start: start of the window, a datetime or ISO 8601 (e.g. 2021-01-01T00:00:00Z).
+            end: end of the window, a datetime or ISO 8601.
+            calendar: the id of a calendar, the user's primary calendar by default.
+            slice_length: a timedelta, the window fetched by one call. Shorter slices spread a busy calendar over
+                more parallel calls.
+            max_workers: the number of slices fetched at the same time.
+            params: query parameters for every slice, e.g. {'$select': 'subject,organizer'}.
+            page_size: number of items per page ($top).
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
+            model: yield Event objects (see ts_microsoftgraph.models) instead of dicts.
+
+        Returns:
+            A generator of events (dicts).
+
+        """
+        url, params, windows = self._calendar_view_request(start, end, calendar, slice_length, params, profile)
+        return self._audit('events', merge_slices(self._fetch_slices(url, params, windows, page_size, max_workers)),
+                           model)
+
+    def _calendar_view_request(self, start, end, calendar, slice_length, params, profile):
+        url = self._url('calendar_view') if calendar is None else \
+            self._url('calendar_calendar_view', calendar_id=calendar)
+        return url, self._project('events', profile, params, top=False), time_slices(start, end, slice_length)
+
+    def _fetch_slices(self, url, params, windows, page_size, max_workers):
+        # the events of each window in order, with up to max_workers windows being fetched ahead
+        def fetch(window):
+            return list(self._iter(url, slice_params(params, *window), page_size))
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        windows = deque(windows)
+        pending = deque()
+        try:
+            while windows or pending:
+                while windows and len(pending) <= max_workers:
+                    pending.append(executor.submit(fetch, windows.popleft()))
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    @token_required
+    def iter_events(self, params=None, page_size=None, max_items=None, prefetch=False, profile=None, model=False):
+        """Iterate over the event objects in the user's mailbox, following the pages lazily.
+
+        Args:
+            params:
+            page_size: number of items per page ($top).
+            max_items: stop after this many items.
+            prefetch: fetch the next page in the background while the current one is consumed.
+            profile: a projection profile name (see ts_microsoftgraph.projections), e.g. 'headers-only'.
+            model: yield Event objects (see ts_microsoftgraph.models) instead of dicts.
+
+        Returns:
+            A generator of items (dicts).
+
+        """
+        return self._audit('events', self._iter(self._url('events'),
+                                                self._project('events', profile, params), page_size, max_items,
+                                                prefetch), model)
 
     @token_required
     def calendar_create_event(self, subject, content, start_datetime, start_timezone, end_datetime, end_timezone,
@@ -317,41 +762,75 @@ class Client(object):
             },
             # "attendees": attendees_list
         }
-        url = (self._context + '/calendars/{}/events'.format(calendar)) if calendar is not None else (self._context + '/events')
-        return self._post(self._base_url + url, json=body)
+        url = self._url('calendar_events', calendar_id=calendar) if calendar is not None else self._url('events')
+        return self._post(url, json=body)
 
     @token_required
     def calendar_create(self, name):
         body = {
             'name': '{}'.format(name)
         }
-        return self._post(self._base_url + self._context + '/calendars', json=body)
+        return self._post(self._url('calendars'), json=body)
 
     @token_required
-    def calendars_list(self):
-        return self._get(self._base_url + self._context + '/calendars')
+    def calendars_list(self, params=None, profile=None):
+        return self._audit('calendars', self._get(self._url('calendars'),
+                                                  params=self._project('calendars', profile, params)))
 
     # Outlook
     @token_required
-    def contacts_list(self, data_id=None, params=None):
-        return self._get(self._base_url + self._context + "/contacts" + ("" if data_id is None else ("/" + data_id)), params=params)
+    def contacts_list(self, data_id=None, params=None, profile=None):
+        params = self._project('contacts', profile, params, top=data_id is None)
+        return self._audit('contacts', self._get(self._url('contacts') if data_id is None else self._url('contact', contact_id=data_id),
+                                                 params=params))
+
+    @token_required
+    def iter_contacts(self, params=None, page_size=None, max_items=None, prefetch=False, profile=None, model=False):
+        return self._audit('contacts', self._iter(self._url('contacts'),
+                                                  self._project('contacts', profile, params), page_size, max_items,
+                                                  prefetch), model)
+
+    @token_required
+    def contacts_delta(self, folder_id=None, params=None):
+        url = self._url('contacts_delta') if folder_id is None else \
+            self._url('contact_folder_contacts_delta', folder_id=folder_id)
+        return self._get(url, params=params)
 
     @token_required
     def contact_create(self, **kwargs):
-        return self._post(self._base_url + self._context + "/contacts"  , **kwargs)
+        return self._post(self._url('contacts'), **kwargs)
 
     @token_required
     def contact_create_in_folder(self, folder_id, **kwargs):
-        return self._post(self._base_url + self._context + "/contactFolders/" + folder_id + "/contacts", **kwargs)
+        return self._post(self._url('contact_folder_contacts', folder_id=folder_id), **kwargs)
 
 
     @token_required
-    def contact_folders(self, params=None):
-        return self._get(self._base_url + self._context + "/contactFolders", params=params)
+    def contact_folders(self, params=None, profile=None):
+        return self._audit('contact_folders', self._get(self._url('contact_folders'),
+                                                        params=self._project('contact_folders', profile, params)))
+
+    @token_required
+    def iter_contact_folders(self, params=None, page_size=None, max_items=None, prefetch=False, profile=None):
+        return self._audit('contact_folders', self._iter(self._url('contact_folders'),
+                                                         self._project('contact_folders', profile, params),
+                                                         page_size, max_items, prefetch))
 
     @token_required
     def contact_create_folder(self, **kwargs):
-        return self._post(self._base_url + self._context + "/contactFolders", **kwargs)
+        return self._post(self._url('contact_folders'), **kwargs)
+
+    def batch(self, max_workers=4):
+        """Queue calls and send them through the JSON $batch endpoint, 20 requests per round trip.
+
+        Args:
+            max_workers: how many $batch requests are sent concurrently.
+
+        Returns:
+            A Batch, to be used as a context manager. See ts_microsoftgraph.batch.Batch.
+        """
+        from ts_microsoftgraph.batch import Batch
+        return Batch(self, max_workers=max_workers)
 
     #removed BETA calls
     def _get(self, url, **kwargs):
@@ -369,16 +848,127 @@ class Client(object):
     def _delete(self, url, **kwargs):
         return self._request('DELETE', url, **kwargs)
 
-    def _request(self, method, url, headers=None, **kwargs):
-        _headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + self.token['access_token']}
+    def _url(self, name, **ids):
+        # the precompiled endpoint under this client's context (or the API version url for root endpoints)
+        endpoint = endpoints.get(name)
+        return endpoint.url(self._base_url if endpoint.root else self._context_url, **ids)
+
+    @staticmethod
+    def _project(endpoint, profile, params, top=True):
+        if profile is None:
+            return params
+        projected = projections.apply(endpoint, profile, params)
+        if not top and '$top' not in (params or {}):
+            # a single item: the profile's page size means nothing there
+            projected.pop('$top', None)
+        return projected
+
+    def _audit(self, endpoint, result, model=False):
+        if self._projection_audit is not None:
+            result = self._projection_audit.track(endpoint, result)
+        return models.wrap_result(endpoint, result) if model else result
+
+    def _iter(self, url, params=None, page_size=None, max_items=None, prefetch=False):
+        return iter_items(lambda link, p: self._get(link, params=p), url,
+                          params=page_params(params, page_size, max_items), max_items=max_items, prefetch=prefetch)
+
+    def _stream(self, url, chunk_size):
+        return iter_response(self._get(url, stream=True), chunk_size)
+
+    def _download(self, url, sink, chunk_size, compress, hash_name):
+        return copy_to_sink(self._stream(url, chunk_size), sink, compress=compress, hash_name=hash_name)
+
+    def _request(self, method, url, **kwargs):
+        if not self._hooks:
+            return self._perform(method, url, **kwargs)
+        record = RequestRecord(method, url, self._context)
+        try:
+            result = self._perform(method, url, record=record, **kwargs)
+        except Exception as ex:
+            record.finish(ex)
+            emit(self._hooks, 'on_request', record)
+            raise
+        record.finish()
+        emit(self._hooks, 'on_request', record)
+        return result
+
+    def _perform(self, method, url, headers=None, stream=False, record=None, **kwargs):
+        cache_key = cached = None
+        if self._cache is not None and method == 'GET' and not stream and \
+                self._cache.cacheable(url, kwargs.get('params')):
+            cache_key = self._cache.key(method, url, kwargs.get('params'), self._context, self._auth.identity)
+            cached = self._cache.lookup(cache_key)
+            if cached is not None and cached[2]:
+                if record is not None:
+                    record.cache = 'hit'
+                return cached[0]
+        token = self._auth.get_valid_token()
+        _headers = {'Accept': 'application/json', 'Authorization': 'Bearer ' + token['access_token']}
         if headers:
             _headers.update(headers)
+        if cached is not None:
+            _headers['If-None-Match'] = cached[1]
         if 'files' not in kwargs:
             # If you use the 'files' keyword, the library will set the Content-Type to multipart/form-data
             # and will generate a boundary.
             _headers['Content-Type'] = 'application/json'
-        # print(method)
-        # print(url)
-        # print(str(kwargs))
-        return parse(requests.request(method, url, headers=_headers, **kwargs))
-
+        attempt = 0
+        reauthenticated = False
+        while True:
+            wait = self._throttle.acquire(self._context)
+            if wait > 0:
+                time.sleep(wait)
+                if record is not None:
+                    record.throttle_wait += wait
+            try:
+                response = self._session.request(method, url, headers=_headers, stream=stream, **kwargs)
+                if record is not None:
+                    self._record_response(record, response, stream)
+                if stream and response.status_code < 300:
+                    # the caller reads (and closes) the body
+                    return response
+                if cache_key is None:
+                    result = parse(response)
+                    if self._cache is not None and method != 'GET':
+                        self._cache.written(url)
+                    return result
+                if response.status_code == 304 and cached is not None:
+                    self._cache.revalidated(cache_key, cached[0], cached[1], url)
+                    if record is not None:
+                        record.cache = 'revalidated'
+                    return cached[0]
+                result = parse(response)
+                self._cache.store(cache_key, result, response.headers.get('ETag'), url)
+                return result
+            except ts_microsoftgraph.exceptions.Unauthorized:
+                # the token may have been revoked or expired early: refresh it once and try again
+                if reauthenticated or not self._auth.can_refresh(token) or 'files' in kwargs:
+                    raise
+                reauthenticated = True
+                self._auth.refresh_token(stale_token=token)
+                token = self._auth.get_token()
+                _headers['Authorization'] = 'Bearer ' + token['access_token']
+            except ts_microsoftgraph.exceptions.BaseError as ex:
+                # uploaded files can't be rewound, so those requests are never retried
+                delay = None if 'files' in kwargs else self._throttle.retry_delay(self._context, method, attempt, ex)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                if record is not None:
+                    record.retries = attempt
+                    record.retry_wait += delay
+
+    @staticmethod
+    def _record_response(record, response, stream):
+        record.status = response.status_code
+        record.ttfb = response.elapsed.total_seconds()
+        body = response.request.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        record.bytes_out = len(body) if isinstance(body, bytes) else None
+        if stream:
+            length = response.headers.get('Content-Length')
+            record.bytes_in = int(length) if length is not None else None
+        else:
+            record.bytes_in = len(response.content)
@@ -0,0 +1,45 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional dependency
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover - ujson is an optional dependency
+    ujson = None
+
+
+def _default_decoder():
+    # prefer the fastest library that is installed
+    if orjson is not None:
+        return 'orjson', orjson.loads
+    if ujson is not None:
+        return 'ujson', ujson.loads
+    return 'json', json.loads
+
+
+_name, _loads = _default_decoder()
+
+
+def loads(data):
+    """Decode a JSON response body (bytes or str) with the current decoder."""
+    return _loads(data)
+
+
+def set_decoder(func, name=None):
+    """Replace the function used to decode response bodies, e.g. set_decoder(simdjson_loads, 'simdjson').
+
+    It gets the raw bytes of the body and must return the decoded object. Pass None to go back to the default
+    (orjson, then ujson, then the standard json module, whichever is installed first).
+    """
+    global _name, _loads
+    if func is None:
+        _name, _loads = _default_decoder()
+    else:
+        _name, _loads = name or getattr(func, '__module__', None) or 'custom', func
+
+
+def decoder_name():
+    return _name
@@ -0,0 +1,205 @@
+import json
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.client import Client
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+
+Change = namedtuple('Change', ['kind', 'id', 'item'])
+Change.__doc__ = """A change reported by a delta query: kind is CREATED, UPDATED or DELETED, item the resource as returned by
+Graph (for deleted items, only the id and an @removed annotation)."""
+
+
+class DeltaStateStore(object):
+    """Where DeltaSync keeps the delta link of each (context, resource, folder). Subclass it to store the state
+    somewhere else, e.g. next to the synced data in your own database."""
+
+    def get(self, key):
+        """Returns the state dict stored for key, or None."""
+        raise NotImplementedError
+
+    def set(self, key, state):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemoryDeltaStateStore(DeltaStateStore):
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._states.get(key)
+
+    def set(self, key, state):
+        with self._lock:
+            self._states[key] = state
+
+    def delete(self, key):
+        with self._lock:
+            self._states.pop(key, None)
+
+
+class FileDeltaStateStore(DeltaStateStore):
+    """Keeps every delta state in one JSON file, rewritten atomically (write to a temp file, then rename)."""
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._states = None
+
+    def _load(self):
+        if self._states is None:
+            try:
+                with open(self._path, 'r') as f:
+                    self._states = json.load(f)
+            except FileNotFoundError:
+                self._states = {}
+        return self._states
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.delta-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._states, f)
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key):
+        with self._lock:
+            return self._load().get(key)
+
+    def set(self, key, state):
+        with self._lock:
+            self._load()[key] = state
+            self._save()
+
+    def delete(self, key):
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+
+class DeltaSync(object):
+    """Incremental sync of messages, contacts and calendar events built on Graph delta queries.
+
+    The first sync of a folder returns every item as CREATED and stores the @odata.deltaLink in the state store.
+    Later syncs only return what changed since then, so their cost depends on the number of changes and not on the
+    size of the mailbox. The delta link is only saved once a round has been read to the end - if the caller stops
+    early, the next sync delivers the same changes again. An expired delta link (410 Gone) triggers a full resync.
+    The items it doesn't return were deleted while the link was expired: pass known_ids to the sync methods (or
+    track_ids=True) to get them reported as DELETED at the end of the resync.
+
+        sync = DeltaSync(client, FileDeltaStateStore('delta.json'))
+        for change in sync.messages('inbox'):
+            if change.kind == DELETED:
+                ...
+
+    Items are reported as CREATED if their createdDateTime is after the previous sync, UPDATED otherwise.
+    """
+
+    def __init__(self, client: Client, store: DeltaStateStore = None, track_ids=False):
+        """
+        Args:
+            client: the Client to query with - its context is part of the state key.
+            store: where the delta links are kept, in memory by default.
+            track_ids: keep the ids of the synced items in the state, to know which ones a resync no longer
+                returns when no known_ids is given. Every sync then rewrites the whole id list, so its cost grows
+                with the size of the folder - prefer known_ids if you keep the items anyway.
+        """
+        self._client = client
+        self._store = MemoryDeltaStateStore() if store is None else store
+        self._track_ids = track_ids
+
+    def _key(self, *parts):
+        return '|'.join((self._client._context,) + parts)
+
+    def messages(self, folder_id, params=None, known_ids=None):
+        """Yields a Change for every message created, updated or deleted in a mail folder since the last sync.
+
+        known_ids is an optional function returning the ids of the messages you hold, called when a resync has to
+        find the deleted ones.
+        """
+        return self._sync(self._key('messages', folder_id), lambda: self._client.message_delta(folder_id, params),
+                          known_ids)
+
+    def contacts(self, folder_id=None, params=None, known_ids=None):
+        """Yields a Change for every contact created, updated or deleted since the last sync."""
+        return self._sync(self._key('contacts', folder_id or ''), lambda: self._client.contacts_delta(folder_id, params),
+                          known_ids)
+
+    def events(self, start_datetime, end_datetime, params=None, known_ids=None):
+        """Yields a Change for every event in the window created, updated or deleted since the last sync."""
+        return self._sync(self._key('events', start_datetime, end_datetime),
+                          lambda: self._client.calendar_view_delta(start_datetime, end_datetime, params), known_ids)
+
+    def reset(self, kind, *parts):
+        """Forget the stored state, e.g. reset('messages', folder_id), so the next sync starts from scratch."""
+        self._store.delete(self._key(kind, *parts))
+
+    def _sync(self, key, first_page, known_ids=None):
+        state = self._store.get(key)
+        page = None
+        # the ids held before a resync that it hasn't returned (yet)
+        missing = None
+        if state is not None:
+            try:
+                page = self._client._get(state['delta_link'])
+            except exceptions.Gone:
+                # the delta token expired: start over with a full sync
+                missing = set(known_ids()) if known_ids is not None else set(state.get('ids', ()))
+                self._store.delete(key)
+                state = None
+        if page is None:
+            page = first_page()
+        since = state.get('synced_at') if state is not None else None
+        ids = set(state.get('ids', ())) if self._track_ids and state is not None else set()
+        synced_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        while page is not None:
+            for item in page.get('value', []):
+                change = self._change(item, since)
+                if missing is not None:
+                    missing.discard(change.id)
+                if self._track_ids:
+                    if change.kind == DELETED:
+                        ids.discard(change.id)
+                    else:
+                        ids.add(change.id)
+                yield change
+            if '@odata.nextLink' in page:
+                page = self._client._get(page['@odata.nextLink'])
+            else:
+                # the resync is complete: what it didn't return was deleted while the delta link was expired
+                for item_id in sorted(missing or ()):
+                    yield Change(DELETED, item_id, {'id': item_id, '@removed': {'reason': 'deleted'}})
+                if '@odata.deltaLink' in page:
+                    state = {'delta_link': page['@odata.deltaLink'], 'synced_at': synced_at}
+                    if self._track_ids:
+                        state['ids'] = sorted(ids)
+                    self._store.set(key, state)
+                page = None
+
+    @staticmethod
+    def _change(item, since):
+        if '@removed' in item:
+            kind = DELETED
+        elif since is None:
+            kind = CREATED
+        else:
+            created = item.get('createdDateTime')
+            # ISO 8601 UTC timestamps compare correctly as strings
+            kind = CREATED if created is not None and created[:19] > since[:19] else UPDATED
+        return Change(kind, item.get('id'), item)
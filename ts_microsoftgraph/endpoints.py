@@ -0,0 +1,107 @@
+import threading
+from string import Formatter
+from urllib.parse import quote
+
+
+class Endpoint(object):
+    """A URL template compiled once, e.g. '/messages/{message_id}/$value'.
+
+    The literal parts and the placeholders are split at registration, so url() only has to quote the ids and join
+    the pieces. Ids are URL-encoded, so ids containing '/', '+' or '=' are safe to pass as they are.
+    """
+    __slots__ = ('name', 'template', 'root', '_parts', '_constant')
+
+    def __init__(self, name, template, root=False):
+        """
+        Args:
+            name: the name the endpoint is registered under.
+            template: the path, relative to the context ('/mailFolders/{folder_id}/messages'), or to the API version
+                for root endpoints ('subscriptions/{subscription_id}').
+            root: True for endpoints that don't belong to a user, such as subscriptions and $batch.
+        """
+        self.name = name
+        self.template = template
+        self.root = root
+        self._parts = tuple((literal, field) for literal, field, _, _ in Formatter().parse(template))
+        self._constant = all(field is None for _, field in self._parts)
+
+    def url(self, prefix, **ids):
+        """The url of the endpoint under prefix (a cached context_prefix() or the API version url)."""
+        if self._constant:
+            return prefix + self.template
+        pieces = [prefix]
+        for literal, field in self._parts:
+            pieces.append(literal)
+            if field is not None:
+                pieces.append(quote(str(ids[field]), safe=''))
+        return ''.join(pieces)
+
+    def __repr__(self):
+        return 'Endpoint({!r}, {!r}, root={!r})'.format(self.name, self.template, self.root)
+
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+_prefixes = {}
+
+
+def register(name, template, root=False):
+    """Add (or replace) an endpoint, e.g. register('message_attachments', '/messages/{message_id}/attachments').
+    Returns the Endpoint."""
+    endpoint = Endpoint(name, template, root=root)
+    with _endpoints_lock:
+        _endpoints[name] = endpoint
+    return endpoint
+
+
+def get(name):
+    return _endpoints[name]
+
+
+def context_prefix(resource, api_version, context):
+    """The url every endpoint of a context starts with, e.g. https://graph.microsoft.com/v1.0/users/{id}. Built
+    once per (resource, api_version, context) and shared."""
+    key = (resource, api_version, context)
+    prefix = _prefixes.get(key)
+    if prefix is None:
+        prefix = _prefixes[key] = resource + api_version + '/' + context
+    return prefix
+
+
+register('user', '')
+register('subscriptions', 'subscriptions', root=True)
+register('subscription', 'subscriptions/{subscription_id}', root=True)
+register('batch', '$batch', root=True)
+register('mail_folders', '/mailFolders/')
+register('folder_messages', '/mailFolders/{folder_id}/messages')
+register('folder_messages_delta', '/mailFolders/{folder_id}/messages/delta')
+register('messages', '/messages')
+register('message', '/messages/{message_id}')
+register('message_value', '/messages/{message_id}/$value')
+register('message_send', '/messages/{message_id}/send')
+register('message_attachments', '/messages/{message_id}/attachments')
+register('message_attachment_value', '/messages/{message_id}/attachments/{attachment_id}/$value')
+register('message_upload_session', '/messages/{message_id}/attachments/createUploadSession')
+register('send_mail', '/microsoft.graph.sendMail')
+register('onenote_notebooks', '/onenote/notebooks')
+register('onenote_notebook', '/onenote/notebooks/{notebook_id}')
+register('onenote_notebook_sections', '/onenote/notebooks/{notebook_id}/sections')
+register('onenote_notebook_section_groups', '/onenote/notebooks/{notebook_id}/sectionGroups')
+register('onenote_section_group_sections', '/onenote/sectionGroups/{section_group_id}/sections')
+register('onenote_section_group_section_groups', '/onenote/sectionGroups/{section_group_id}/sectionGroups')
+register('onenote_section_pages', '/onenote/sections/{section_id}/pages')
+register('onenote_pages', '/onenote/pages')
+register('onenote_page_content', '/onenote/pages/{page_id}/content')
+register('onenote_resource', '/onenote/resources/{resource_id}/$value')
+register('events', '/events')
+register('calendar_view', '/calendarView')
+register('calendar_view_delta', '/calendarView/delta')
+register('calendars', '/calendars')
+register('calendar_events', '/calendars/{calendar_id}/events')
+register('calendar_calendar_view', '/calendars/{calendar_id}/calendarView')
+register('contacts', '/contacts')
+register('contact', '/contacts/{contact_id}')
+register('contacts_delta', '/contacts/delta')
+register('contact_folders', '/contactFolders')
+register('contact_folder_contacts', '/contactFolders/{folder_id}/contacts')
+register('contact_folder_contacts_delta', '/contactFolders/{folder_id}/contacts/delta')
@@ -1,5 +1,15 @@
 class BaseError(Exception):
-    pass
+    # headers of the response that raised the error, set by the response parser
+    headers = {}
+
+    @property
+    def retry_after(self):
+        """The delay in seconds the server asked for in its Retry-After header, or None."""
+        value = self.headers.get('Retry-After') if self.headers else None
+        try:
+            return max(0.0, float(value)) if value is not None else None
+        except ValueError:
+            return None
 
 
 class UnknownError(BaseError):
@@ -66,6 +76,10 @@ class UnprocessableEntity(BaseError):
     pass
 
 
+class FailedDependency(BaseError):
+    pass
+
+
 class TooManyRequests(BaseError):
     pass
 
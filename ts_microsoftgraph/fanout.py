@@ -0,0 +1,160 @@
+import asyncio
+from collections import Counter, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ts_microsoftgraph.client import Client
+
+FanOutResult = namedtuple('FanOutResult', ['context', 'result', 'error'])
+FanOutResult.__doc__ = """The outcome of an operation for one context: result is set if it succeeded, error holds the exception
+if it failed."""
+
+
+def _operation(operation):
+    if isinstance(operation, str):
+        return lambda client, *args, **kwargs: getattr(client, operation)(*args, **kwargs)
+    return operation
+
+
+def _target(client, item):
+    # a context is either 'users/{id}' or an (auth, 'users/{id}') pair for multi-tenant runs
+    if isinstance(item, tuple):
+        auth, context = item
+        return client.for_context(context, auth=auth), context, _tenant(auth)
+    return client.for_context(item), item, _tenant(client._auth)
+
+
+def _tenant(auth):
+    return getattr(auth, '_tenant_id', None)
+
+
+def _check_limits(max_workers, per_tenant_limit):
+    if max_workers < 1:
+        raise ValueError('max_workers must be at least 1')
+    if per_tenant_limit is not None and per_tenant_limit < 1:
+        raise ValueError('per_tenant_limit must be at least 1, or None for no limit')
+
+
+def fan_out(client: Client, contexts, operation, *args, max_workers=16, per_tenant_limit=None, **kwargs):
+    """Run one Client operation for many contexts on a bounded thread pool, yielding results as they finish.
+
+    Every context gets a client from client.for_context(), so they all share one connection pool, throttle and
+    token. A failure for one context is reported in its FanOutResult and doesn't stop the others. contexts is
+    consumed lazily, so it can be a generator over a very large list.
+
+        for r in fan_out(client, ['users/' + uid for uid in user_ids], 'message_folder_list'):
+            if r.error is None:
+                ...
+
+    Args:
+        client: the Client to derive the per-context clients from.
+        contexts: an iterable of contexts ('users/{id}'), or of (auth, context) pairs to run across tenants.
+        operation: the name of a Client method, or a function taking the client as its first argument.
+        *args: passed on to the operation.
+        max_workers: the number of operations running at the same time.
+        per_tenant_limit: the maximum number of operations running at the same time for one tenant, at least 1.
+        **kwargs: passed on to the operation.
+
+    Returns:
+        A generator of FanOutResult, in completion order.
+    """
+    _check_limits(max_workers, per_tenant_limit)
+    operation = _operation(operation)
+
+    def run(target, context):
+        try:
+            return FanOutResult(context, operation(target, *args, **kwargs), None)
+        except Exception as ex:
+            return FanOutResult(context, None, ex)
+
+    items = iter(contexts)
+    deferred = deque()
+    running = Counter()
+    in_flight = {}
+
+    def allowed(tenant):
+        return per_tenant_limit is None or running[tenant] < per_tenant_limit
+
+    def next_target():
+        # contexts held back by their tenant's limit go first, once their tenant has room again
+        for _ in range(len(deferred)):
+            target = deferred.popleft()
+            if allowed(target[2]):
+                return target
+            deferred.append(target)
+        # don't read ahead of the pool by more than a bounded number of held back contexts
+        while len(deferred) < max_workers * 4:
+            item = next(items, None)
+            if item is None:
+                return None
+            target = _target(client, item)
+            if allowed(target[2]):
+                return target
+            deferred.append(target)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(in_flight) < max_workers:
+                target = next_target()
+                if target is None:
+                    break
+                target_client, context, tenant = target
+                running[tenant] += 1
+                in_flight[executor.submit(run, target_client, context)] = tenant
+            if not in_flight:
+                if deferred:
+                    continue
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                running[in_flight.pop(future)] -= 1
+                yield future.result()
+
+
+async def fan_out_async(client: Client, contexts, operation, *args, max_workers=100, per_tenant_limit=None,
+                        **kwargs):
+    """The asyncio counterpart of fan_out() for an AsyncClient: an async generator of FanOutResult."""
+    _check_limits(max_workers, per_tenant_limit)
+    operation = _operation(operation)
+    limit = asyncio.Semaphore(max_workers)
+    tenant_limits = {}
+    # contexts read ahead of the running operations, like the held back ones of fan_out()
+    read_ahead = asyncio.Semaphore(max_workers if per_tenant_limit is None else max_workers * 5)
+
+    async def call(target, context):
+        async with limit:
+            try:
+                return FanOutResult(context, await operation(target, *args, **kwargs), None)
+            except Exception as ex:
+                return FanOutResult(context, None, ex)
+
+    async def run(target, context, tenant):
+        try:
+            if per_tenant_limit is None:
+                return await call(target, context)
+            if tenant not in tenant_limits:
+                tenant_limits[tenant] = asyncio.Semaphore(per_tenant_limit)
+            # the tenant's slot first: waiting for it must not take one of the max_workers slots from other tenants
+            async with tenant_limits[tenant]:
+                return await call(target, context)
+        finally:
+            read_ahead.release()
+
+    pending = set()
+    try:
+        for item in contexts:
+            await read_ahead.acquire()
+            pending.add(asyncio.ensure_future(run(*_target(client, item))))
+            done = {task for task in pending if task.done()}
+            pending -= done
+            for task in done:
+                yield task.result()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # the consumer stopped early or failed: don't leave operations running in the background
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
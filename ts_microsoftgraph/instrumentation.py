@@ -0,0 +1,329 @@
+import bisect
+import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:  # pragma: no cover - opentelemetry is an optional dependency
+    Status = StatusCode = None
+
+logger = logging.getLogger('ts_microsoftgraph')
+
+_NAMED_SEGMENT = re.compile(r'^\$?[A-Za-z]+$|^[a-z]+(\.[A-Za-z]+)+$')
+_VERSIONS = ('v1.0', 'beta')
+
+
+def endpoint_of(url):
+    """The templated path of a Graph url, for grouping: https://graph.microsoft.com/v1.0/users/a@b.c/messages/AAMk=
+    gives /users/{id}/messages/{id}. Segments that are not plain words (ids, addresses) become {id}."""
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment]
+    if segments and segments[0] in _VERSIONS:
+        segments = segments[1:]
+    return '/' + '/'.join(segment if _NAMED_SEGMENT.match(segment) else '{id}' for segment in segments)
+
+
+def body_size(kwargs):
+    """The size of a request body given as json= or data=, None if it can't be told without sending it."""
+    if kwargs.get('json') is not None:
+        return len(json.dumps(kwargs['json']).encode('utf-8'))
+    data = kwargs.get('data')
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    return None
+
+
+class RequestRecord(object):
+    """What happened during one Client call, retries included. Timings are in seconds, None when not available:
+    dns and connect are only measured by AsyncClient, and only when a new connection had to be opened."""
+    __slots__ = ('method', 'url', 'context', 'started_at', 'elapsed', 'dns', 'connect', 'ttfb', 'status',
+                 'bytes_in', 'bytes_out', 'retries', 'throttle_wait', 'retry_wait', 'cache', 'error', '_start')
+
+    def __init__(self, method, url, context):
+        self.method = method
+        self.url = url
+        self.context = context
+        self.started_at = time.time()
+        self.elapsed = None
+        self.dns = None
+        self.connect = None
+        self.ttfb = None
+        self.status = None
+        self.bytes_in = None
+        self.bytes_out = None
+        self.retries = 0
+        self.throttle_wait = 0.0
+        self.retry_wait = 0.0
+        # 'hit' for a fresh cache entry, 'revalidated' for a 304
+        self.cache = None
+        self.error = None
+        self._start = time.perf_counter()
+
+    @property
+    def endpoint(self):
+        return endpoint_of(self.url)
+
+    def finish(self, error=None):
+        self.elapsed = time.perf_counter() - self._start
+        self.error = error
+
+    def __repr__(self):
+        return '<RequestRecord {} {} {} {:.3f}s>'.format(self.method, self.endpoint, self.status, self.elapsed or 0)
+
+
+class TokenRecord(object):
+    """One token request made by Auth: grant is authorization_code, refresh_token or client_credentials."""
+    __slots__ = ('grant', 'tenant', 'started_at', 'elapsed', 'status', 'error', '_start')
+
+    def __init__(self, grant, tenant):
+        self.grant = grant
+        self.tenant = tenant
+        self.started_at = time.time()
+        self.elapsed = None
+        self.status = None
+        self.error = None
+        self._start = time.perf_counter()
+
+    def finish(self, error=None):
+        self.elapsed = time.perf_counter() - self._start
+        self.error = error
+
+
+class Hook(object):
+    """Base class of the instrumentation hooks given to Client(hooks=[...]) and Auth(hooks=[...]).
+
+    on_request is called once per Client call, after it completed or failed, and on_token once per token request.
+    Hooks are called on the thread (or event loop) that made the call, so they should be quick. An exception in a
+    hook is logged and doesn't affect the call.
+    """
+
+    def on_request(self, record: RequestRecord):
+        pass
+
+    def on_token(self, record: TokenRecord):
+        pass
+
+
+def emit(hooks, name, record):
+    for hook in hooks:
+        try:
+            getattr(hook, name)(record)
+        except Exception:
+            logger.exception('Instrumentation hook %r failed', hook)
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram(object):
+    """A fixed-bucket latency histogram: constant memory however many values are observed."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """An estimate of the q quantile (0.5, 0.95...), interpolated within its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class _Stats(object):
+    __slots__ = ('latency', 'ttfb', 'statuses', 'errors', 'bytes_in', 'bytes_out', 'retries', 'throttle_wait')
+
+    def __init__(self, buckets):
+        self.latency = Histogram(buckets)
+        self.ttfb = Histogram(buckets)
+        self.statuses = {}
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+        self.throttle_wait = 0.0
+
+
+class HistogramRegistry(Hook):
+    """Keeps latency histograms and counters per (method, endpoint) and per token grant, in process.
+
+        registry = HistogramRegistry()
+        client = Client(Auth(..., hooks=[registry]), hooks=[registry])
+        ...
+        for name, stats in registry.summary().items():
+            print(name, stats['count'], stats['p95'], stats['total_time'])
+
+    summary() is sorted by total time, so the endpoints eating the latency budget come first.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _get(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = _Stats(self._buckets)
+        return stats
+
+    def on_request(self, record):
+        with self._lock:
+            stats = self._get(record.method + ' ' + record.endpoint)
+            stats.latency.observe(record.elapsed)
+            if record.ttfb is not None:
+                stats.ttfb.observe(record.ttfb)
+            status = record.status if record.status is not None else record.cache
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if record.error is not None:
+                stats.errors += 1
+            stats.bytes_in += record.bytes_in or 0
+            stats.bytes_out += record.bytes_out or 0
+            stats.retries += record.retries
+            stats.throttle_wait += record.throttle_wait
+
+    def on_token(self, record):
+        with self._lock:
+            stats = self._get('token ' + record.grant)
+            stats.latency.observe(record.elapsed)
+            stats.statuses[record.status] = stats.statuses.get(record.status, 0) + 1
+            if record.error is not None:
+                stats.errors += 1
+
+    def histogram(self, name):
+        """The latency Histogram of 'GET /me/messages' or 'token refresh_token', None if nothing was recorded."""
+        with self._lock:
+            stats = self._stats.get(name)
+            return stats.latency if stats is not None else None
+
+    def summary(self):
+        """Returns {name: dict of count, errors, statuses, mean, p50, p95, p99, max, ttfb_p50, total_time, bytes_in,
+        bytes_out, retries, throttle_wait}, slowest in total first."""
+        with self._lock:
+            rows = []
+            for name, stats in self._stats.items():
+                latency = stats.latency
+                rows.append((name, {
+                    'count': latency.count,
+                    'errors': stats.errors,
+                    'statuses': dict(stats.statuses),
+                    'mean': latency.sum / latency.count if latency.count else None,
+                    'p50': latency.quantile(0.5),
+                    'p95': latency.quantile(0.95),
+                    'p99': latency.quantile(0.99),
+                    'max': latency.max,
+                    'ttfb_p50': stats.ttfb.quantile(0.5),
+                    'total_time': latency.sum,
+                    'bytes_in': stats.bytes_in,
+                    'bytes_out': stats.bytes_out,
+                    'retries': stats.retries,
+                    'throttle_wait': stats.throttle_wait,
+                }))
+        rows.sort(key=lambda row: row[1]['total_time'], reverse=True)
+        return dict(rows)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class LoggingHook(Hook):
+    """Logs one line per call and token request, at level, or at WARNING when slower than slow seconds or failed."""
+
+    def __init__(self, logger=None, level=logging.DEBUG, slow=None):
+        self._logger = logger if logger is not None else logging.getLogger('ts_microsoftgraph.requests')
+        self._level = level
+        self._slow = slow
+
+    def _level_for(self, record):
+        if record.error is not None or (self._slow is not None and record.elapsed >= self._slow):
+            return logging.WARNING
+        return self._level
+
+    def on_request(self, record):
+        level = self._level_for(record)
+        if not self._logger.isEnabledFor(level):
+            return
+        self._logger.log(level, '%s %s %s %.3fs ttfb=%s in=%s out=%s retries=%d wait=%.3fs%s',
+                         record.method, record.endpoint, record.status or record.cache, record.elapsed,
+                         '-' if record.ttfb is None else '%.3fs' % record.ttfb, record.bytes_in, record.bytes_out,
+                         record.retries, record.throttle_wait + record.retry_wait,
+                         '' if record.error is None else ' error=%r' % record.error)
+
+    def on_token(self, record):
+        level = self._level_for(record)
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, 'token %s tenant=%s %s %.3fs%s', record.grant, record.tenant, record.status,
+                             record.elapsed, '' if record.error is None else ' error=%r' % record.error)
+
+
+class SpanHook(Hook):
+    """Emits one span per call and token request through an OpenTelemetry style tracer.
+
+    tracer needs start_span(name, attributes=..., start_time=...) returning a span with end(end_time=...), which
+    is what opentelemetry.trace.get_tracer(...) gives. Attribute names follow the OpenTelemetry HTTP conventions,
+    with graph.* attributes for the rest.
+    """
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def _emit(self, name, record, attributes):
+        start = int(record.started_at * 1e9)
+        span = self._tracer.start_span(name, attributes=attributes, start_time=start)
+        if record.error is not None:
+            span.set_attribute('error.type', type(record.error).__name__)
+            if hasattr(span, 'record_exception'):
+                span.record_exception(record.error)
+            if Status is not None:
+                span.set_status(Status(StatusCode.ERROR, str(record.error)))
+        span.end(end_time=start + int(record.elapsed * 1e9))
+
+    def on_request(self, record):
+        attributes = {
+            'http.request.method': record.method,
+            'url.full': record.url,
+            'http.route': record.endpoint,
+            'http.request.resend_count': record.retries,
+            'graph.context': record.context,
+            'graph.throttle_wait': record.throttle_wait,
+            'graph.retry_wait': record.retry_wait,
+        }
+        for key, value in (('http.response.status_code', record.status),
+                           ('http.request.body.size', record.bytes_out),
+                           ('http.response.body.size', record.bytes_in),
+                           ('graph.ttfb', record.ttfb),
+                           ('graph.dns', record.dns),
+                           ('graph.connect', record.connect),
+                           ('graph.cache', record.cache)):
+            if value is not None:
+                attributes[key] = value
+        self._emit(record.method + ' ' + record.endpoint, record, attributes)
+
+    def on_token(self, record):
+        attributes = {'graph.grant': record.grant, 'graph.tenant': record.tenant}
+        if record.status is not None:
+            attributes['http.response.status_code'] = record.status
+        self._emit('token ' + record.grant, record, attributes)
@@ -0,0 +1,400 @@
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from ts_microsoftgraph.client import Client
+from ts_microsoftgraph.delta import DELETED, DeltaStateStore, DeltaSync
+
+# the message and contact fields kept in the mirror - the query API returns these
+MESSAGE_FIELDS = ('id', 'subject', 'bodyPreview', 'from', 'toRecipients', 'ccRecipients', 'receivedDateTime',
+                  'createdDateTime', 'conversationId', 'parentFolderId', 'isRead', 'hasAttachments', 'importance',
+                  'flag', 'webLink')
+CONTACT_FIELDS = ('id', 'displayName', 'givenName', 'surname', 'emailAddresses', 'companyName', 'jobTitle',
+                  'businessPhones', 'mobilePhone', 'createdDateTime')
+FOLDER_FIELDS = ('id', 'displayName', 'parentFolderId', 'totalItemCount', 'unreadItemCount')
+# changes written per transaction
+BATCH_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    context TEXT NOT NULL, id TEXT NOT NULL, display_name TEXT, record TEXT NOT NULL, PRIMARY KEY (context, id));
+CREATE TABLE IF NOT EXISTS messages (
+    rowid INTEGER PRIMARY KEY, context TEXT NOT NULL, id TEXT NOT NULL, folder_id TEXT, conversation_id TEXT,
+    sender TEXT, received TEXT, subject TEXT, body_preview TEXT, is_read INTEGER, record TEXT NOT NULL,
+    UNIQUE (context, id));
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (context, sender, received);
+CREATE INDEX IF NOT EXISTS messages_received ON messages (context, received);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages (context, conversation_id, received);
+CREATE INDEX IF NOT EXISTS messages_folder ON messages (context, folder_id, received);
+CREATE TABLE IF NOT EXISTS contacts (
+    context TEXT NOT NULL, id TEXT NOT NULL, display_name TEXT, email TEXT, record TEXT NOT NULL,
+    PRIMARY KEY (context, id));
+CREATE INDEX IF NOT EXISTS contacts_email ON contacts (context, email);
+CREATE TABLE IF NOT EXISTS delta_states (key TEXT PRIMARY KEY, state TEXT NOT NULL);
+"""
+
+# subject and bodyPreview full-text index, kept up to date by triggers
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, body_preview, content='messages', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, subject, body_preview) VALUES (new.rowid, new.subject, new.body_preview);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, body_preview)
+    VALUES ('delete', old.rowid, old.subject, old.body_preview);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF subject, body_preview ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, body_preview)
+    VALUES ('delete', old.rowid, old.subject, old.body_preview);
+    INSERT INTO messages_fts (rowid, subject, body_preview) VALUES (new.rowid, new.subject, new.body_preview);
+END;
+"""
+
+_UPSERT_MESSAGE = """
+INSERT INTO messages (context, id, folder_id, conversation_id, sender, received, subject, body_preview, is_read, record)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (context, id) DO UPDATE SET folder_id = excluded.folder_id, conversation_id = excluded.conversation_id,
+    sender = excluded.sender, received = excluded.received, subject = excluded.subject,
+    body_preview = excluded.body_preview, is_read = excluded.is_read, record = excluded.record
+"""
+
+
+def _format_datetime(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return value
+
+
+def _address(recipient):
+    return ((recipient or {}).get('emailAddress') or {}).get('address', '').lower() or None
+
+
+def _match_expression(search):
+    # every word must appear: quote them so FTS5 operators and punctuation in the search are taken literally
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in search.split())
+
+
+class _MirrorDeltaStates(DeltaStateStore):
+    # the delta links live in the mirror's database; set() only stages the new link, the mirror writes it in the
+    # transaction that stores the last changes of the round, so the link never runs ahead of the data
+    def __init__(self, mirror):
+        self._mirror = mirror
+        self._staged = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._mirror._lock:
+            row = self._mirror._db.execute('SELECT state FROM delta_states WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, key, state):
+        with self._lock:
+            self._staged[key] = state
+
+    def delete(self, key):
+        with self._lock:
+            self._staged.pop(key, None)
+        with self._mirror._lock:
+            self._mirror._db.execute('DELETE FROM delta_states WHERE key = ?', (key,))
+
+    def take(self, key):
+        with self._lock:
+            return self._staged.pop(key, None)
+
+
+class MailboxMirror(object):
+    """A local SQLite copy of a mailbox's mail folders, messages (a fixed set of fields, see MESSAGE_FIELDS) and
+    contacts, queried without touching the network.
+
+    refresh() brings it up to date with delta queries, so after the first one it only transfers what changed. The
+    messages are indexed by sender, received date, conversation and folder, and subject and bodyPreview are
+    full-text indexed.
+
+        mirror = MailboxMirror(client, 'mailbox.db')
+        mirror.refresh()
+        mirror.start(interval=300)
+        for message in mirror.messages(search='invoice overdue', sender='billing@contoso.com', limit=20):
+            ...
+
+    One database can hold several mailboxes, each MailboxMirror seeing the rows of its client's context. Only the
+    top-level mail folders and the default contacts folder are mirrored.
+    """
+
+    def __init__(self, client: Client, path, folders=None, contacts=True, max_workers=4):
+        """
+        Args:
+            client: the Client to sync with.
+            path: the SQLite database file, created if needed.
+            folders: the ids or display names of the mail folders to mirror, all of them by default.
+            contacts: mirror the contacts too.
+            max_workers: the number of folders synced at the same time.
+        """
+        self._client = client
+        self._context = client._context
+        self._folders = None if folders is None else {folder.lower() for folder in folders}
+        self._contacts = contacts
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        try:
+            self._db.executescript(_FTS_SCHEMA)
+            self._fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: searches fall back to LIKE
+            self._fts = False
+        self._states = _MirrorDeltaStates(self)
+        # the mirror holds the ids itself (known_ids): a resync after an expired delta link purges the rows it
+        # doesn't return
+        self._sync = DeltaSync(client, self._states)
+        self._thread = None
+        self._stop = None
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # refresh
+
+    def refresh(self):
+        """Fetch the folder list and the changes since the last refresh. Returns the number of folders, and of
+        messages and contacts written and deleted."""
+        folders = self._refresh_folders()
+        counts = {'folders': len(folders), 'messages': 0, 'messages_deleted': 0, 'contacts': 0,
+                  'contacts_deleted': 0}
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = [executor.submit(self._refresh_messages, folder['id']) for folder in folders]
+            if self._contacts:
+                futures.append(executor.submit(self._refresh_contacts))
+            for future in futures:
+                for name, count in future.result().items():
+                    counts[name] += count
+        return counts
+
+    def _refresh_folders(self):
+        params = {'$select': ','.join(FOLDER_FIELDS)}
+        folders = [folder for folder in self._client.iter_mail_folders(params, page_size=100)
+                   if self._folders is None or folder['id'].lower() in self._folders or
+                   (folder.get('displayName') or '').lower() in self._folders]
+        ids = {folder['id'] for folder in folders}
+        with self._lock:
+            known = {row[0] for row in self._db.execute('SELECT id FROM folders WHERE context = ?', (self._context,))}
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany('INSERT OR REPLACE INTO folders (context, id, display_name, record) '
+                                     'VALUES (?, ?, ?, ?)',
+                                     [(self._context, folder['id'], folder.get('displayName'), json.dumps(folder))
+                                      for folder in folders])
+                for folder_id in known - ids:
+                    self._db.execute('DELETE FROM folders WHERE context = ? AND id = ?', (self._context, folder_id))
+                    self._db.execute('DELETE FROM messages WHERE context = ? AND folder_id = ?',
+                                     (self._context, folder_id))
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+        for folder_id in known - ids:
+            self._sync.reset('messages', folder_id)
+        return folders
+
+    def _refresh_messages(self, folder_id):
+        key = self._sync._key('messages', folder_id)
+        counts = {'messages': 0, 'messages_deleted': 0}
+        changes = []
+        for change in self._sync.messages(folder_id, {'$select': ','.join(MESSAGE_FIELDS)},
+                                          known_ids=lambda: self._ids('SELECT id FROM messages WHERE context = ? AND '
+                                                                      'folder_id = ?', (self._context, folder_id))):
+            changes.append(change)
+            if len(changes) >= BATCH_SIZE:
+                self._write_messages(folder_id, changes, None, counts)
+                changes = []
+        self._write_messages(folder_id, changes, self._states.take(key), counts)
+        return counts
+
+    def _write_messages(self, folder_id, changes, state, counts):
+        rows, deleted = [], []
+        for change in changes:
+            if change.kind == DELETED:
+                deleted.append((self._context, change.id, folder_id))
+                continue
+            item = change.item
+            rows.append((self._context, item['id'], item.get('parentFolderId') or folder_id, item.get('conversationId'),
+                         _address(item.get('from')), item.get('receivedDateTime'), item.get('subject'),
+                         item.get('bodyPreview'), int(bool(item.get('isRead'))), json.dumps(item)))
+        self._write(lambda db: (db.executemany(_UPSERT_MESSAGE, rows),
+                                # a message moved to another folder is reported removed from this one: only drop it
+                                # if it's still filed here
+                                db.executemany('DELETE FROM messages WHERE context = ? AND id = ? AND folder_id = ?',
+                                               deleted)),
+                    self._sync._key('messages', folder_id), state)
+        counts['messages'] += len(rows)
+        counts['messages_deleted'] += len(deleted)
+
+    def _refresh_contacts(self):
+        key = self._sync._key('contacts', '')
+        counts = {'contacts': 0, 'contacts_deleted': 0}
+        changes = []
+        for change in self._sync.contacts(params={'$select': ','.join(CONTACT_FIELDS)},
+                                          known_ids=lambda: self._ids('SELECT id FROM contacts WHERE context = ?',
+                                                                      (self._context,))):
+            changes.append(change)
+            if len(changes) >= BATCH_SIZE:
+                self._write_contacts(changes, None, counts)
+                changes = []
+        self._write_contacts(changes, self._states.take(key), counts)
+        return counts
+
+    def _write_contacts(self, changes, state, counts):
+        rows, deleted = [], []
+        for change in changes:
+            if change.kind == DELETED:
+                deleted.append((self._context, change.id))
+                continue
+            item = change.item
+            addresses = item.get('emailAddresses') or []
+            email = (addresses[0].get('address') or '').lower() or None if addresses else None
+            rows.append((self._context, item['id'], item.get('displayName'), email, json.dumps(item)))
+        self._write(lambda db: (db.executemany('INSERT OR REPLACE INTO contacts (context, id, display_name, email, '
+                                               'record) VALUES (?, ?, ?, ?, ?)', rows),
+                                db.executemany('DELETE FROM contacts WHERE context = ? AND id = ?', deleted)),
+                    self._sync._key('contacts', ''), state)
+        counts['contacts'] += len(rows)
+        counts['contacts_deleted'] += len(deleted)
+
+    def _ids(self, sql, args):
+        with self._lock:
+            return [row[0] for row in self._db.execute(sql, args)]
+
+    def _write(self, statements, key, state):
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                statements(self._db)
+                if state is not None:
+                    self._db.execute('INSERT OR REPLACE INTO delta_states (key, state) VALUES (?, ?)',
+                                     (key, json.dumps(state)))
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def start(self, interval=300):
+        """Run refresh() every interval seconds in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        stop = self._stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                try:
+                    self.refresh()
+                except Exception:
+                    # e.g. throttled or the token could not be refreshed: try again on the next round
+                    pass
+                stop.wait(interval)
+
+        self._thread = threading.Thread(target=run, name='ts_microsoftgraph-mirror', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._thread = None
+
+    # queries
+
+    def _query(self, sql, args):
+        with self._lock:
+            return [json.loads(row[0]) for row in self._db.execute(sql, args)]
+
+    def folders(self):
+        """The mirrored mail folders."""
+        return self._query('SELECT record FROM folders WHERE context = ? ORDER BY display_name', (self._context,))
+
+    def message(self, message_id):
+        """The mirrored message, or None."""
+        found = self._query('SELECT record FROM messages WHERE context = ? AND id = ?', (self._context, message_id))
+        return found[0] if found else None
+
+    def messages(self, search=None, sender=None, folder=None, conversation_id=None, since=None, until=None,
+                 is_read=None, limit=100, offset=0, newest_first=True):
+        """Query the mirrored messages, newest first by default.
+
+        Args:
+            search: words that must all appear in the subject or bodyPreview.
+            sender: the sender's email address.
+            folder: the id or display name of a mail folder.
+            conversation_id: the conversationId of a thread.
+            since: received at or after this datetime (or ISO 8601 string, UTC).
+            until: received before this datetime (or ISO 8601 string, UTC).
+            is_read: True or False to only get read or unread messages.
+            limit: the most messages returned, None for all.
+            offset: the number of matching messages skipped, for paging.
+            newest_first: order by receivedDateTime descending, ascending if False.
+
+        Returns:
+            A list of messages (dicts with the MESSAGE_FIELDS).
+        """
+        clauses, args = ['context = ?'], [self._context]
+        search = search.strip() if search else None
+        if search:
+            if self._fts:
+                expression = _match_expression(search)
+                if expression:
+                    clauses.append('rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)')
+                    args.append(expression)
+            else:
+                for word in search.split():
+                    clauses.append('(subject LIKE ? OR body_preview LIKE ?)')
+                    args.extend(['%' + word + '%'] * 2)
+        if sender:
+            clauses.append('sender = ?')
+            args.append(sender.lower())
+        if folder:
+            clauses.append('folder_id IN (SELECT id FROM folders WHERE context = ? AND (id = ? OR lower(display_name) '
+                           '= ?))')
+            args.extend([self._context, folder, folder.lower()])
+        if conversation_id:
+            clauses.append('conversation_id = ?')
+            args.append(conversation_id)
+        if since is not None:
+            clauses.append('received >= ?')
+            args.append(_format_datetime(since))
+        if until is not None:
+            clauses.append('received < ?')
+            args.append(_format_datetime(until))
+        if is_read is not None:
+            clauses.append('is_read = ?')
+            args.append(int(bool(is_read)))
+        sql = 'SELECT record FROM messages WHERE {} ORDER BY received {} LIMIT ? OFFSET ?'.format(
+            ' AND '.join(clauses), 'DESC' if newest_first else 'ASC')
+        return self._query(sql, args + [-1 if limit is None else limit, offset])
+
+    def conversation(self, conversation_id):
+        """The mirrored messages of a thread, oldest first."""
+        return self.messages(conversation_id=conversation_id, limit=None, newest_first=False)
+
+    def contacts(self, search=None, email=None, limit=100):
+        """Query the mirrored contacts by part of their name or email address, or by exact email address."""
+        clauses, args = ['context = ?'], [self._context]
+        if search:
+            clauses.append('(display_name LIKE ? OR email LIKE ?)')
+            args.extend(['%' + search + '%', '%' + search.lower() + '%'])
+        if email:
+            clauses.append('email = ?')
+            args.append(email.lower())
+        sql = 'SELECT record FROM contacts WHERE {} ORDER BY display_name LIMIT ?'.format(' AND '.join(clauses))
+        return self._query(sql, args + [-1 if limit is None else limit])
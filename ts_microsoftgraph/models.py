@@ -0,0 +1,210 @@
+import re
+from datetime import datetime, timezone
+
+
+_OFFSET = re.compile(r'(Z|[+-]\d{2}:?\d{2})$')
+
+
+def parse_datetime(value):
+    """Parse a Graph timestamp such as 2017-09-04T11:00:00Z, 2017-09-04T11:00:00.0000000 or
+    2017-09-04T11:00:00.1234567+02:00 into a datetime. Timestamps without an offset are UTC."""
+    if not value:
+        return None
+    # before Python 3.11 fromisoformat() only takes '+hh:mm' offsets (no 'Z') and 3 or 6 fractional digits
+    match = _OFFSET.search(value)
+    offset = ''
+    if match is not None:
+        value, offset = value[:match.start()], match.group(1)
+        if offset == 'Z':
+            offset = '+00:00'
+        elif ':' not in offset:
+            offset = offset[:3] + ':' + offset[3:]
+    if '.' in value:
+        # Graph sends up to 7 fractional digits, trimming trailing zeros
+        head, fraction = value.split('.', 1)
+        value = head + '.' + (fraction + '000000')[:6]
+    parsed = datetime.fromisoformat(value + offset)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+class Field(object):
+    """A lazily decoded field: the raw JSON value is only converted on first access, then kept."""
+
+    def __init__(self, key, convert=None):
+        self.key = key
+        self.convert = convert
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        raw = instance._data.get(self.key)
+        if self.convert is None or raw is None:
+            return raw
+        cache = instance._cache
+        if cache is None:
+            cache = instance._cache = {}
+        elif self.name in cache:
+            return cache[self.name]
+        value = cache[self.name] = self.convert(raw)
+        return value
+
+
+class Model(object):
+    """A lightweight, read-only view on a Graph resource dict.
+
+    Fields are decoded on access only (timestamps into datetimes, addresses into EmailAddress objects...), and
+    instances have no __dict__, so wrapping a large page costs one small object per item. Every field that is not
+    declared on the model is still available through get() or the raw dict in data.
+
+    The message, event, contact and mail folder methods of Client return models when called with model=True:
+
+        for message in client.iter_messages('inbox', params={'$select': 'subject,receivedDateTime'}, model=True):
+            print(message.received_date_time, message.subject)
+    """
+    __slots__ = ('_data', '_cache')
+
+    id = Field('id')
+
+    def __init__(self, data):
+        self._data = data
+        self._cache = None
+
+    @classmethod
+    def wrap(cls, items):
+        """Lazily wrap an iterable of dicts (a page's 'value' or an iter_* generator) in this model."""
+        return (cls(item) for item in items)
+
+    @property
+    def data(self):
+        return self._data
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other._data == self._data
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self._data.get('id'))
+
+
+class EmailAddress(Model):
+    __slots__ = ()
+
+    name = Field('name')
+    address = Field('address')
+
+    @classmethod
+    def from_recipient(cls, recipient):
+        return cls(recipient.get('emailAddress') or {})
+
+
+def _recipient(value):
+    return EmailAddress.from_recipient(value)
+
+
+def _recipients(values):
+    return [EmailAddress.from_recipient(value) for value in values]
+
+
+def _date_time_time_zone(value):
+    # dateTimeTimeZone: {'dateTime': '2017-09-04T11:00:00.0000000', 'timeZone': 'UTC'}
+    parsed = parse_datetime(value.get('dateTime'))
+    if parsed is not None and value.get('timeZone') not in (None, 'UTC'):
+        # not a UTC value, keep the wall clock time and leave the time zone to the caller
+        parsed = parsed.replace(tzinfo=None)
+    return parsed
+
+
+class Message(Model):
+    __slots__ = ()
+
+    subject = Field('subject')
+    body_preview = Field('bodyPreview')
+    body = Field('body')
+    sender = Field('sender', _recipient)
+    from_ = Field('from', _recipient)
+    to_recipients = Field('toRecipients', _recipients)
+    cc_recipients = Field('ccRecipients', _recipients)
+    bcc_recipients = Field('bccRecipients', _recipients)
+    received_date_time = Field('receivedDateTime', parse_datetime)
+    sent_date_time = Field('sentDateTime', parse_datetime)
+    created_date_time = Field('createdDateTime', parse_datetime)
+    last_modified_date_time = Field('lastModifiedDateTime', parse_datetime)
+    conversation_id = Field('conversationId')
+    internet_message_id = Field('internetMessageId')
+    parent_folder_id = Field('parentFolderId')
+    is_read = Field('isRead')
+    is_draft = Field('isDraft')
+    has_attachments = Field('hasAttachments')
+    importance = Field('importance')
+    categories = Field('categories')
+    web_link = Field('webLink')
+
+
+class Event(Model):
+    __slots__ = ()
+
+    subject = Field('subject')
+    body_preview = Field('bodyPreview')
+    body = Field('body')
+    start = Field('start', _date_time_time_zone)
+    end = Field('end', _date_time_time_zone)
+    is_all_day = Field('isAllDay')
+    is_cancelled = Field('isCancelled')
+    location = Field('location')
+    organizer = Field('organizer', _recipient)
+    attendees = Field('attendees', _recipients)
+    type = Field('type')
+    series_master_id = Field('seriesMasterId')
+    show_as = Field('showAs')
+    created_date_time = Field('createdDateTime', parse_datetime)
+    last_modified_date_time = Field('lastModifiedDateTime', parse_datetime)
+    web_link = Field('webLink')
+
+
+class Contact(Model):
+    __slots__ = ()
+
+    display_name = Field('displayName')
+    given_name = Field('givenName')
+    surname = Field('surname')
+    email_addresses = Field('emailAddresses', lambda values: [EmailAddress(value) for value in values])
+    company_name = Field('companyName')
+    job_title = Field('jobTitle')
+    mobile_phone = Field('mobilePhone')
+    business_phones = Field('businessPhones')
+    parent_folder_id = Field('parentFolderId')
+    created_date_time = Field('createdDateTime', parse_datetime)
+    last_modified_date_time = Field('lastModifiedDateTime', parse_datetime)
+
+
+class MailFolder(Model):
+    __slots__ = ()
+
+    display_name = Field('displayName')
+    parent_folder_id = Field('parentFolderId')
+    child_folder_count = Field('childFolderCount')
+    unread_item_count = Field('unreadItemCount')
+    total_item_count = Field('totalItemCount')
+
+
+# the model of each endpoint name used by Client (see projections)
+MODELS = {'messages': Message, 'events': Event, 'contacts': Contact, 'mail_folders': MailFolder}
+
+
+def wrap_result(endpoint, result):
+    """Wrap a response of endpoint - a page, a single item or a generator of items - in the endpoint's model."""
+    model = MODELS[endpoint]
+    if isinstance(result, dict):
+        if isinstance(result.get('value'), list):
+            result['value'] = [model(item) for item in result['value']]
+            return result
+        return model(result)
+    if hasattr(result, '__next__'):
+        return model.wrap(result)
+    return result
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import quote
+
+from ts_microsoftgraph.client import Client
+
+EXPORTED = 'exported'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+
+MANIFEST_NAME = 'manifest.json'
+# the most pages Graph returns in one page of a page listing
+PAGE_LISTING_SIZE = 100
+
+ExportResult = namedtuple('ExportResult', ['kind', 'id', 'path', 'status', 'error'])
+ExportResult.__doc__ = """The outcome for one item: kind is 'page', or 'notebook', 'sectionGroup' or 'section' when listing its
+content failed. path is the exported page's file, relative to the export directory. status is EXPORTED, UNCHANGED
+(skipped, the manifest has the same lastModifiedDateTime) or FAILED (error holds the exception)."""
+
+_RESOURCE = re.compile(r'https?://[^"\'\s<>]+?/onenote/resources/(?P<id>[^/"\'\s<>]+)/\$value')
+_RESOURCE_TAG = re.compile(r'<(?:img|object)\b[^>]*>', re.IGNORECASE)
+_RESOURCE_TYPE = re.compile(r'\b(?:data-src-type|type)="([^"]+)"')
+_UNSAFE = re.compile(r'[^\w .()\[\]!-]+')
+
+
+def _safe_name(name, fallback):
+    name = _UNSAFE.sub('_', name or '').strip(' .')[:80]
+    return name or fallback
+
+
+def _page_name(page):
+    # the title for humans, and a digest of the id so pages with the same title don't collide
+    digest = hashlib.sha1(page['id'].encode('utf-8')).hexdigest()[:8]
+    return '{} [{}]'.format(_safe_name(page.get('title'), 'Untitled'), digest)
+
+
+class ExportManifest(object):
+    """What was exported: page id -> {'modified': lastModifiedDateTime, 'path': file relative to the export directory}.
+
+    Kept in one JSON file, rewritten atomically (write to a temp file, then rename) every save_every updates and on
+    save(), so an interrupted export only redoes the pages of its last save_every updates.
+    """
+
+    def __init__(self, path, save_every=100):
+        self._path = path
+        self._save_every = save_every
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        try:
+            with open(path, 'r') as f:
+                self._pages = json.load(f)
+        except FileNotFoundError:
+            self._pages = {}
+
+    def get(self, page_id):
+        with self._lock:
+            return self._pages.get(page_id)
+
+    def set(self, page_id, modified, path):
+        with self._lock:
+            self._pages[page_id] = {'modified': modified, 'path': path}
+            self._unsaved += 1
+            if self._unsaved >= self._save_every:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.manifest-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._pages, f)
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._unsaved = 0
+
+
+def _export_page(client, directory, page, folder, previous, resources):
+    # stream the HTML to a temp file, fetch the resources it points to, then move the HTML (rewritten to point to
+    # the local copies) in place - a page's file only ever appears complete
+    name = _page_name(page)
+    path = os.path.join(folder, name + '.html')
+    target = os.path.join(directory, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.page-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w+b') as f:
+            client.onenote_download_page(page['id'], f)
+            if resources:
+                f.seek(0)
+                html = f.read().decode('utf-8')
+                found = {}
+                for tag in _RESOURCE_TAG.finditer(html):
+                    content_type = _RESOURCE_TYPE.search(tag.group(0))
+                    extension = (mimetypes.guess_extension(content_type.group(1)) or '') if content_type else ''
+                    for match in _RESOURCE.finditer(tag.group(0)):
+                        found.setdefault(match.group('id'), extension)
+                if found:
+                    files = name + '_files'
+                    os.makedirs(os.path.join(os.path.dirname(target), files), exist_ok=True)
+                    local = {}
+                    for resource_id, extension in found.items():
+                        filename = _safe_name(resource_id, 'resource') + extension
+                        client.onenote_download_resource(resource_id,
+                                                         os.path.join(os.path.dirname(target), files, filename))
+                        local[resource_id] = quote(files + '/' + filename)
+                    html = _RESOURCE.sub(lambda match: local.get(match.group('id'), match.group(0)), html)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(html.encode('utf-8'))
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    if previous is not None and previous['path'] != path:
+        # renamed or moved since the last export
+        old = os.path.join(directory, previous['path'])
+        if os.path.exists(old):
+            os.unlink(old)
+        shutil.rmtree(old[:-len('.html')] + '_files', ignore_errors=True)
+    return path
+
+
+def export_notebooks(client: Client, directory, notebooks=None, max_workers=8, manifest: ExportManifest = None,
+                     resources=True):
+    """Export OneNote notebooks to directory as HTML files, yielding an ExportResult for each page.
+
+    Notebooks, section groups and sections are crawled and the pages exported on a pool of max_workers threads, the
+    listings and downloads of different sections overlapping. Each page is written to
+    <notebook>/<section group>/<section>/<title> [<digest>].html, streamed from the connection, with its images and
+    attached files in the '_files' directory next to it and the HTML pointing to those copies. Pages whose
+    lastModifiedDateTime matches the manifest, and whose file is still there, are not downloaded again - a repeated
+    export only fetches the listings and the pages that changed.
+
+        for result in export_notebooks(client, 'export/'):
+            if result.status == FAILED:
+                ...
+
+    Args:
+        client: the Client to export with.
+        directory: the directory to export to, created if needed.
+        notebooks: the ids or display names of the notebooks to export, all of them by default.
+        max_workers: the number of listings and pages being fetched at the same time.
+        manifest: an ExportManifest, by default the manifest.json file in directory.
+        resources: download the images and attached files of the pages.
+
+    Returns:
+        A generator of ExportResult, in completion order.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = ExportManifest(os.path.join(directory, MANIFEST_NAME)) if manifest is None else manifest
+    wanted = None if notebooks is None else set(notebooks)
+
+    def names(url, params):
+        return list(client._iter(url, params))
+
+    def crawl_notebooks():
+        tasks = []
+        for notebook in names(client._url('onenote_notebooks'), {'$select': 'id,displayName'}):
+            if wanted is None or notebook['id'] in wanted or notebook.get('displayName') in wanted:
+                tasks.append((crawl_container, 'notebook', notebook, _safe_name(notebook.get('displayName'),
+                                                                              notebook['id'])))
+        return tasks, []
+
+    def crawl_container(kind, container, folder):
+        if kind == 'notebook':
+            sections_url = client._url('onenote_notebook_sections', notebook_id=container['id'])
+            groups_url = client._url('onenote_notebook_section_groups', notebook_id=container['id'])
+        else:
+            sections_url = client._url('onenote_section_group_sections', section_group_id=container['id'])
+            groups_url = client._url('onenote_section_group_section_groups', section_group_id=container['id'])
+        params = {'$select': 'id,displayName'}
+        tasks = [(crawl_section, section, os.path.join(folder, _safe_name(section.get('displayName'), section['id'])))
+                 for section in names(sections_url, params)]
+        tasks.extend((crawl_container, 'sectionGroup', group,
+                      os.path.join(folder, _safe_name(group.get('displayName'), group['id'])))
+                     for group in names(groups_url, params))
+        return tasks, []
+
+    def crawl_section(section, folder):
+        tasks, results = [], []
+        pages = client._iter(client._url('onenote_section_pages', section_id=section['id']),
+                             {'$select': 'id,title,lastModifiedDateTime'}, PAGE_LISTING_SIZE)
+        for page in pages:
+            previous = manifest.get(page['id'])
+            path = os.path.join(folder, _page_name(page) + '.html')
+            if previous is not None and previous['modified'] == page.get('lastModifiedDateTime') and \
+                    previous['path'] == path and os.path.exists(os.path.join(directory, path)):
+                results.append(ExportResult('page', page['id'], path, UNCHANGED, None))
+            else:
+                tasks.append((export_page, page, folder, previous))
+        return tasks, results
+
+    def export_page(page, folder, previous):
+        path = _export_page(client, directory, page, folder, previous, resources)
+        manifest.set(page['id'], page.get('lastModifiedDateTime'), path)
+        return [], [ExportResult('page', page['id'], path, EXPORTED, None)]
+
+    def run(task):
+        function, args = task[0], task[1:]
+        try:
+            return function(*args)
+        except Exception as ex:
+            if function is crawl_notebooks:
+                raise
+            if function is crawl_container:
+                return [], [ExportResult(args[0], args[1]['id'], args[2], FAILED, ex)]
+            if function is crawl_section:
+                return [], [ExportResult('section', args[0]['id'], args[1], FAILED, ex)]
+            return [], [ExportResult('page', args[0]['id'], None, FAILED, ex)]
+
+    tasks = deque([(crawl_notebooks,)])
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = set()
+            while tasks or in_flight:
+                while tasks and len(in_flight) < max_workers * 2:
+                    in_flight.add(executor.submit(run, tasks.popleft()))
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    new_tasks, results = future.result()
+                    # pages first, so the pipeline keeps downloading instead of listing ever more sections
+                    tasks.extendleft(reversed([task for task in new_tasks if task[0] is export_page]))
+                    tasks.extend(task for task in new_tasks if task[0] is not export_page)
+                    for result in results:
+                        yield result
+    finally:
+        manifest.save()
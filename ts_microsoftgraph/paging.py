@@ -0,0 +1,106 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+NEXT_LINK = '@odata.nextLink'
+
+
+def page_params(params=None, page_size=None, max_items=None):
+    """Copy params and set $top from page_size, never asking for more than max_items in one page."""
+    params = dict(params) if params else {}
+    top = page_size if page_size else params.get('$top')
+    if max_items is not None and (top is None or int(top) > max_items):
+        top = max_items
+    if top is not None:
+        params['$top'] = top
+    return params
+
+
+def iter_pages(fetch, url, params=None, prefetch=False):
+    """Yield each page of a paged Graph collection, following @odata.nextLink.
+
+    Args:
+        fetch: a function taking (url, params) and returning the parsed page - params is None for next links, as
+            they already carry the query.
+        url: the url of the first page.
+        params: query parameters for the first page.
+        prefetch: fetch the next page in a background thread while the caller works on the current one.
+
+    Only the current page (and the prefetched one) is held in memory.
+    """
+    if not prefetch:
+        page = fetch(url, params)
+        while page is not None:
+            yield page
+            link = page.get(NEXT_LINK)
+            page = fetch(link, None) if link else None
+        return
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        page = fetch(url, params)
+        while page is not None:
+            link = page.get(NEXT_LINK)
+            future = executor.submit(fetch, link, None) if link else None
+            yield page
+            page = future.result() if future is not None else None
+    finally:
+        executor.shutdown(wait=False)
+
+
+def iter_items(fetch, url, params=None, max_items=None, prefetch=False):
+    """Yield the items of a paged Graph collection one by one. See iter_pages() for the arguments.
+
+    Args:
+        max_items: stop after this many items, without fetching further pages.
+    """
+    if max_items is not None and max_items <= 0:
+        return
+    count = 0
+    pages = iter_pages(fetch, url, params=params, prefetch=prefetch)
+    try:
+        for page in pages:
+            for item in page.get('value', []):
+                yield item
+                count += 1
+                if max_items is not None and count >= max_items:
+                    return
+    finally:
+        pages.close()
+
+
+async def iter_pages_async(fetch, url, params=None, prefetch=False):
+    """The asyncio counterpart of iter_pages(); fetch is a coroutine function and prefetching runs as a task."""
+    page = await fetch(url, params)
+    while page is not None:
+        link = page.get(NEXT_LINK)
+        if not link:
+            yield page
+            return
+        if prefetch:
+            task = asyncio.ensure_future(fetch(link, None))
+            try:
+                yield page
+                page = await task
+            finally:
+                if not task.done():
+                    task.cancel()
+        else:
+            yield page
+            page = await fetch(link, None)
+
+
+async def iter_items_async(fetch, url, params=None, max_items=None, prefetch=False):
+    """The asyncio counterpart of iter_items()."""
+    if max_items is not None and max_items <= 0:
+        return
+    count = 0
+    pages = iter_pages_async(fetch, url, params=params, prefetch=prefetch)
+    try:
+        async for page in pages:
+            for item in page.get('value', []):
+                yield item
+                count += 1
+                if max_items is not None and count >= max_items:
+                    return
+    finally:
+        await pages.aclose()
@@ -0,0 +1,191 @@
+import threading
+import warnings
+from collections import defaultdict
+
+
+class ProjectionWarning(UserWarning):
+    pass
+
+
+class Projection(object):
+    """The $select, $top and $expand to request for an endpoint."""
+
+    def __init__(self, select=None, top=None, expand=None):
+        """
+        Args:
+            select: the fields to return, a list or a comma separated string - None returns Graph's default set.
+            top: the page size.
+            expand: the relationships to expand, a list or a comma separated string.
+        """
+        self.select = tuple(_split(select)) if select else None
+        self.top = top
+        self.expand = tuple(_split(expand)) if expand else None
+
+    def params(self):
+        params = {}
+        if self.select:
+            params['$select'] = ','.join(self.select)
+        if self.top:
+            params['$top'] = self.top
+        if self.expand:
+            params['$expand'] = ','.join(self.expand)
+        return params
+
+    def __repr__(self):
+        return 'Projection(select={!r}, top={!r}, expand={!r})'.format(self.select, self.top, self.expand)
+
+
+def _split(value):
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(',') if part.strip()]
+    return list(value)
+
+
+HEADERS_ONLY = 'headers-only'
+SYNC_MINIMAL = 'sync-minimal'
+FULL = 'full'
+
+_MESSAGE_HEADERS = ['id', 'subject', 'from', 'sender', 'toRecipients', 'ccRecipients', 'receivedDateTime',
+                    'sentDateTime', 'conversationId', 'internetMessageId', 'parentFolderId', 'hasAttachments',
+                    'isRead', 'importance']
+
+PROFILES = {
+    'user': {
+        HEADERS_ONLY: Projection(['id', 'displayName', 'mail', 'userPrincipalName']),
+        SYNC_MINIMAL: Projection(['id']),
+        FULL: Projection(),
+    },
+    'messages': {
+        HEADERS_ONLY: Projection(_MESSAGE_HEADERS, top=100),
+        SYNC_MINIMAL: Projection(['id', 'parentFolderId', 'lastModifiedDateTime', 'changeKey', 'isRead'], top=500),
+        FULL: Projection(top=50),
+    },
+    'attachments': {
+        # everything but contentBytes: the content is downloaded separately, see attachment_download(). The
+        # @odata.type annotation telling file, item and reference attachments apart can't be selected, Graph adds it
+        # to the items of this polymorphic collection
+        HEADERS_ONLY: Projection(['id', 'name', 'contentType', 'size', 'isInline', 'lastModifiedDateTime']),
+        SYNC_MINIMAL: Projection(['id', 'name', 'size']),
+        FULL: Projection(),
+    },
+    'mail_folders': {
+        HEADERS_ONLY: Projection(['id', 'displayName', 'parentFolderId'], top=100),
+        SYNC_MINIMAL: Projection(['id', 'parentFolderId', 'totalItemCount', 'unreadItemCount'], top=100),
+        FULL: Projection(top=100),
+    },
+    'contacts': {
+        HEADERS_ONLY: Projection(['id', 'displayName', 'emailAddresses', 'companyName'], top=100),
+        SYNC_MINIMAL: Projection(['id', 'parentFolderId', 'lastModifiedDateTime', 'changeKey'], top=500),
+        FULL: Projection(top=100),
+    },
+    'contact_folders': {
+        HEADERS_ONLY: Projection(['id', 'displayName', 'parentFolderId'], top=100),
+        SYNC_MINIMAL: Projection(['id', 'parentFolderId'], top=100),
+        FULL: Projection(top=100),
+    },
+    'events': {
+        HEADERS_ONLY: Projection(['id', 'subject', 'start', 'end', 'location', 'organizer', 'isAllDay', 'showAs',
+                                  'type', 'seriesMasterId'], top=100),
+        SYNC_MINIMAL: Projection(['id', 'lastModifiedDateTime', 'changeKey', 'start', 'end'], top=500),
+        FULL: Projection(top=50),
+    },
+    'calendars': {
+        HEADERS_ONLY: Projection(['id', 'name', 'color', 'isDefaultCalendar'], top=100),
+        SYNC_MINIMAL: Projection(['id', 'changeKey'], top=100),
+        FULL: Projection(top=100),
+    },
+    'onenote_pages': {
+        HEADERS_ONLY: Projection(['id', 'title', 'createdDateTime', 'lastModifiedDateTime', 'parentSection'],
+                                 top=100),
+        SYNC_MINIMAL: Projection(['id', 'lastModifiedDateTime'], top=100),
+        FULL: Projection(expand=['parentSection', 'parentNotebook'], top=100),
+    },
+}
+_profiles_lock = threading.Lock()
+
+
+def register_profile(endpoint, name, projection: Projection):
+    """Add or replace a named profile for an endpoint, e.g. register_profile('messages', 'triage', Projection(...))."""
+    with _profiles_lock:
+        PROFILES.setdefault(endpoint, {})[name] = projection
+
+
+def resolve(endpoint, profile):
+    """Returns the Projection for a profile name (or a Projection, returned as is)."""
+    if isinstance(profile, Projection):
+        return profile
+    try:
+        return PROFILES[endpoint][profile]
+    except KeyError:
+        raise ValueError('Unknown projection profile {!r} for {}'.format(profile, endpoint))
+
+
+def apply(endpoint, profile, params=None):
+    """Build the query parameters for a call: the profile's $select/$top/$expand, overridden by explicit params."""
+    if profile is None:
+        return params
+    projected = resolve(endpoint, profile).params()
+    if params:
+        projected.update(params)
+    return projected
+
+
+class _TrackedDict(dict):
+    __slots__ = ('_read',)
+
+    def __getitem__(self, key):
+        self._read.add(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        self._read.add(key)
+        return dict.get(self, key, default)
+
+
+class ProjectionAudit(object):
+    """Records which fields of the responses are actually read, to find the ones a $select could drop.
+
+    Enable it with Client(audit_projections=True): the items returned by the list and get methods are then dict
+    subclasses that record the keys read through [] and get(). report() lists, per endpoint, the fields Graph sent
+    that were never read. It is meant for development runs - the tracking costs a copy of every item.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._received = defaultdict(set)
+        self._read = defaultdict(set)
+
+    def _wrap(self, endpoint, item):
+        if not isinstance(item, dict):
+            return item
+        tracked = _TrackedDict(item)
+        tracked._read = self._read[endpoint]
+        with self._lock:
+            self._received[endpoint].update(key for key in item if not key.startswith('@odata'))
+        return tracked
+
+    def track(self, endpoint, result):
+        """Wrap a response (a page, a single item, or a generator of items) so reads are recorded."""
+        if isinstance(result, dict):
+            if isinstance(result.get('value'), list):
+                result['value'] = [self._wrap(endpoint, item) for item in result['value']]
+                return result
+            return self._wrap(endpoint, result)
+        if hasattr(result, '__next__'):
+            return (self._wrap(endpoint, item) for item in result)
+        return result
+
+    def unread_fields(self):
+        """Returns {endpoint: set of fields received but never read}."""
+        with self._lock:
+            return {endpoint: received - self._read[endpoint]
+                    for endpoint, received in self._received.items() if received - self._read[endpoint]}
+
+    def report(self, warn=True):
+        """Returns unread_fields(), and issues a ProjectionWarning per endpoint if warn is True."""
+        unread = self.unread_fields()
+        if warn:
+            for endpoint, fields in sorted(unread.items()):
+                warnings.warn('{} responses carry fields that are never read: {} - consider a $select or a projection '
+                              'profile'.format(endpoint, ', '.join(sorted(fields))), ProjectionWarning, stacklevel=2)
+        return unread
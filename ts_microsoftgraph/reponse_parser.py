@@ -1,12 +1,23 @@
-from ts_microsoftgraph import exceptions
+from ts_microsoftgraph import decoder, exceptions
 
 
 def parse(response):
-    status_code = response.status_code
-    if 'application/json' in response.headers['Content-Type']:
-        r = response.json()
+    if 'application/json' in response.headers.get('Content-Type', '') and response.content:
+        r = decoder.loads(response.content)
     else:
         r = response.content
+    try:
+        return parse_status(response.status_code, r)
+    except exceptions.BaseError as ex:
+        ex.headers = response.headers
+        raise
+
+
+def parse_status(status_code, r):
+    """Map a status code and an already decoded body to a return value or a typed exception.
+
+    Shared by parse() and parse_async(), which decode the body differently.
+    """
     if status_code in (200, 201, 202):
         return r
     elif status_code == 204:
@@ -39,6 +50,8 @@ def parse(response):
         raise exceptions.RequestedRangeNotSatisfiable(r)
     elif status_code == 422:
         raise exceptions.UnprocessableEntity(r)
+    elif status_code == 424:
+        raise exceptions.FailedDependency(r)
     elif status_code == 429:
         raise exceptions.TooManyRequests(r)
     elif status_code == 500:
@@ -54,9 +67,30 @@ def parse(response):
     elif status_code == 509:
         raise exceptions.BandwidthLimitExceeded(r)
     else:
-        if r['error']['innerError']['code'] == 'lockMismatch':
+        if _inner_error_code(r) == 'lockMismatch':
             # File is currently locked due to being open in the web browser
             # while attempting to reupload a new version to the drive.
             # Thus temporarily unavailable.
             raise exceptions.ServiceUnavailable(r)
         raise exceptions.UnknownError(r)
+
+
+async def parse_async(response):
+    """The asyncio counterpart of parse() for an aiohttp response."""
+    body = await response.read()
+    if 'application/json' in response.headers.get('Content-Type', '') and body:
+        r = decoder.loads(body)
+    else:
+        r = body
+    try:
+        return parse_status(response.status, r)
+    except exceptions.BaseError as ex:
+        ex.headers = response.headers
+        raise
+
+
+def _inner_error_code(r):
+    try:
+        return r['error']['innerError']['code']
+    except (KeyError, TypeError):
+        return None
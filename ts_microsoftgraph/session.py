@@ -0,0 +1,72 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool(object):
+    """A pooled, keep-alive HTTP session shared by Client and Auth calls.
+
+    Wraps a single requests.Session whose adapters keep a pool of connections per host, so repeated Graph calls
+    reuse the same TCP/TLS connection instead of doing a new handshake each time. Sending requests through the pool
+    is safe from multiple threads; the underlying urllib3 pools are thread-safe and the session itself is never
+    mutated after construction.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True, timeout=None):
+        """
+        :param pool_connections: the number of distinct hosts to keep connection pools for
+        :param pool_maxsize: the maximum number of connections kept alive per host
+        :param pool_block: if True, callers wait for a free connection instead of opening extra ones, which turns
+            pool_maxsize into a hard per-host connection limit
+        :param keep_alive: set to False to close the connection after every request
+        :param timeout: default timeout (seconds, or a (connect, read) tuple) for requests that don't pass one
+        """
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._pool_block = pool_block
+        self._keep_alive = keep_alive
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._session = self._create_session()
+        self._closed = False
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self._pool_connections,
+                              pool_maxsize=self._pool_maxsize,
+                              pool_block=self._pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self._keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def request(self, method, url, **kwargs):
+        if self._closed:
+            raise RuntimeError('SessionPool is closed')
+        if self._timeout is not None:
+            kwargs.setdefault('timeout', self._timeout)
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        """Close every pooled connection. Further requests through this pool raise a RuntimeError."""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
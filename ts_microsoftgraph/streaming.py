@@ -0,0 +1,66 @@
+import gzip
+import hashlib
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_response(response, chunk_size=CHUNK_SIZE):
+    """Yield the body of a streamed requests.Response in chunks, releasing the connection when done."""
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+
+class SinkWriter(object):
+    """Writes chunks to a file-like sink (or a path), optionally gzip-compressed, hashing the raw bytes on the way.
+
+    Only one chunk is held in memory at a time.
+    """
+
+    def __init__(self, sink, compress=False, hash_name='sha256'):
+        """
+        Args:
+            sink: a binary file-like object with write(), or a path to create.
+            compress: gzip the data as it is written.
+            hash_name: a hashlib algorithm computed over the uncompressed bytes, or None.
+        """
+        self._owns_file = isinstance(sink, str)
+        self._file = open(sink, 'wb') if self._owns_file else sink
+        self._out = gzip.GzipFile(fileobj=self._file, mode='wb') if compress else self._file
+        self._hash = hashlib.new(hash_name) if hash_name else None
+        self._hash_name = hash_name
+        self.size = 0
+
+    def write(self, chunk):
+        self._out.write(chunk)
+        if self._hash is not None:
+            self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        if self._out is not self._file:
+            self._out.close()
+        if self._owns_file:
+            self._file.close()
+
+    def result(self):
+        """Returns a dict with the number of (uncompressed) bytes written and their hash."""
+        return {
+            'size': self.size,
+            'hash_name': self._hash_name,
+            'hash': self._hash.hexdigest() if self._hash is not None else None
+        }
+
+
+def copy_to_sink(chunks, sink, compress=False, hash_name='sha256'):
+    """Write an iterable of chunks to sink, see SinkWriter. Returns SinkWriter.result()."""
+    writer = SinkWriter(sink, compress=compress, hash_name=hash_name)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+    finally:
+        writer.close()
+    return writer.result()
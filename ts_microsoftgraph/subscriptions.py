@@ -0,0 +1,402 @@
+import heapq
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from ts_microsoftgraph import exceptions
+from ts_microsoftgraph.client import Client
+from ts_microsoftgraph.models import parse_datetime
+
+# the longest lifetime Graph accepts for mail, event and contact subscriptions is 4230 minutes
+MAX_LIFETIME = 4230 * 60
+
+
+class SubscriptionStore(object):
+    """Where SubscriptionManager keeps its registry: one dict per subscription, keyed by the caller's key. Subclass
+    it to keep the registry somewhere else."""
+
+    def all(self):
+        """Returns every stored record."""
+        raise NotImplementedError
+
+    def set_many(self, records):
+        """Store (insert or replace) the given records."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemorySubscriptionStore(SubscriptionStore):
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def all(self):
+        with self._lock:
+            return [dict(record) for record in self._records.values()]
+
+    def set_many(self, records):
+        with self._lock:
+            for record in records:
+                self._records[record['key']] = dict(record)
+
+    def delete(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+
+class FileSubscriptionStore(SubscriptionStore):
+    """Keeps the registry in one JSON file, rewritten atomically (write to a temp file, then rename) once per
+    set_many() - fine for a few thousand subscriptions, use SQLiteSubscriptionStore beyond that."""
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._records = None
+
+    def _load(self):
+        if self._records is None:
+            try:
+                with open(self._path, 'r') as f:
+                    self._records = json.load(f)
+            except FileNotFoundError:
+                self._records = {}
+        return self._records
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.subscriptions-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._records, f)
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def all(self):
+        with self._lock:
+            return [dict(record) for record in self._load().values()]
+
+    def set_many(self, records):
+        with self._lock:
+            stored = self._load()
+            for record in records:
+                stored[record['key']] = dict(record)
+            self._save()
+
+    def delete(self, key):
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+
+class SQLiteSubscriptionStore(SubscriptionStore):
+    """Keeps the registry in a SQLite database, one row per subscription, so a renewal round only writes the
+    rows it changed."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS subscriptions (key TEXT PRIMARY KEY, record TEXT NOT NULL)')
+
+    def all(self):
+        with self._lock:
+            return [json.loads(row[0]) for row in self._db.execute('SELECT record FROM subscriptions')]
+
+    def set_many(self, records):
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany('INSERT OR REPLACE INTO subscriptions (key, record) VALUES (?, ?)',
+                                     [(record['key'], json.dumps(record)) for record in records])
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM subscriptions WHERE key = ?', (key,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _format_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class SubscriptionManager(object):
+    """Keeps a registry of change notification subscriptions alive: creates them, renews them ahead of their
+    expiry and re-creates the ones Graph lost.
+
+    Subscriptions are registered under a key of your choice and kept in a SubscriptionStore, so the registry
+    survives restarts. Their renewal times sit in a priority queue; run_pending() (or the background thread of
+    start()) sends the due renewals and creations through $batch, 20 per round trip and max_workers round trips at
+    a time. Every renewal time is drawn at random within a spread window before the expiry, so subscriptions
+    created together don't come due together again.
+
+        manager = SubscriptionManager(client, SQLiteSubscriptionStore('subscriptions.db'))
+        for user_id in user_ids:
+            manager.add(user_id, 'created', 'https://example.com/notify', 'users/{}/messages'.format(user_id))
+        manager.start()
+
+    A renewal answered with 404 means Graph dropped the subscription: it is created again in the same round.
+    Other failures are retried with an increasing delay, until the subscription expires and is re-created.
+    """
+
+    def __init__(self, client: Client, store: SubscriptionStore = None, lifetime=MAX_LIFETIME,
+                 renew_before=6 * 3600, spread=12 * 3600, retry_interval=60, max_per_round=2000, max_workers=4):
+        """
+        Args:
+            client: the Client the subscriptions are managed with (subscriptions are not tied to its context).
+            store: where the registry is kept, in memory by default.
+            lifetime: the lifetime in seconds requested for every subscription.
+            renew_before: renew at least this many seconds before the expiry.
+            spread: renewals are spread at random over this many seconds before renew_before.
+            retry_interval: the first delay in seconds before a failed creation or renewal is tried again.
+            max_per_round: the most creations and renewals run_pending() sends at once.
+            max_workers: how many $batch requests are sent at the same time.
+        """
+        if renew_before + spread >= lifetime:
+            raise ValueError('renew_before + spread must be shorter than the lifetime')
+        self._client = client
+        self._store = MemorySubscriptionStore() if store is None else store
+        self._lifetime = lifetime
+        self._renew_before = renew_before
+        self._spread = spread
+        self._retry_interval = retry_interval
+        self._max_per_round = max_per_round
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._records = {}
+        self._queue = []
+        self._thread = None
+        self._stop = None
+        for record in self._store.all():
+            self._records[record['key']] = record
+            heapq.heappush(self._queue, (record['renew_at'], record['key']))
+
+    def add(self, key, change_type, notification_url, resource, client_state=None):
+        """Register a subscription under key. It is created by the next run_pending(). Registering an existing
+        key with different parameters replaces the subscription."""
+        with self._lock:
+            record = self._records.get(key)
+            wanted = {'change_type': change_type, 'notification_url': notification_url, 'resource': resource,
+                      'client_state': client_state}
+            if record is not None and all(record[name] == value for name, value in wanted.items()):
+                return
+            old_id = record.get('subscription_id') if record is not None else None
+            record = dict(wanted, key=key, subscription_id=None, expires_at=None, renew_at=0, failures=0,
+                          replaces=old_id)
+            self._records[key] = record
+            heapq.heappush(self._queue, (0, key))
+        self._store.set_many([record])
+
+    def remove(self, key):
+        """Unregister a subscription and delete it from Graph."""
+        with self._lock:
+            record = self._records.pop(key, None)
+        if record is None:
+            return
+        self._store.delete(key)
+        for subscription_id in (record.get('subscription_id'), record.get('replaces')):
+            if subscription_id:
+                self._delete_quietly(subscription_id)
+
+    def get(self, key):
+        """Returns a copy of the record of key (subscription_id, expires_at, renew_at...), or None."""
+        with self._lock:
+            record = self._records.get(key)
+            return dict(record) if record is not None else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+    def next_due(self):
+        """The time (as time.time()) the next creation or renewal is due, or None for an empty registry."""
+        with self._lock:
+            self._drop_stale()
+            return self._queue[0][0] if self._queue else None
+
+    def _drop_stale(self):
+        # entries whose record was removed or rescheduled since they were queued
+        while self._queue:
+            renew_at, key = self._queue[0]
+            record = self._records.get(key)
+            if record is not None and record['renew_at'] == renew_at:
+                return
+            heapq.heappop(self._queue)
+
+    def _take_due(self, now):
+        due = []
+        with self._lock:
+            while self._queue and len(due) < self._max_per_round:
+                self._drop_stale()
+                if not self._queue or self._queue[0][0] > now:
+                    break
+                due.append(dict(self._records[heapq.heappop(self._queue)[1]]))
+        return due
+
+    def run_pending(self, now=None):
+        """Create and renew every subscription that is due (at most max_per_round of them).
+
+        Returns:
+            A dict with the number of subscriptions created, renewed, recreated (lost ones) and failed.
+        """
+        now = time.time() if now is None else now
+        counts = {'created': 0, 'renewed': 0, 'recreated': 0, 'failed': 0}
+        pending, lost = [], []
+        for record in self._take_due(now):
+            if record['subscription_id'] and record['expires_at'] is not None and record['expires_at'] <= now:
+                # expired before it could be renewed: renewing is no longer possible
+                lost.append(record)
+            else:
+                pending.append(record)
+        updated = []
+        while pending or lost:
+            for record in lost:
+                record['subscription_id'] = None
+                record['lost'] = True
+            sent = pending + lost
+            pending, lost = [], []
+            try:
+                results = self._send(sent, now)
+            except Exception as ex:
+                # the whole $batch failed (the POST itself, or the token refresh before it): the records were taken
+                # off the queue, so they are rescheduled with backoff like a failed item
+                for record in sent:
+                    record.pop('lost', None)
+                    self._failed(record, ex, now)
+                counts['failed'] += len(sent)
+                updated.extend(sent)
+                break
+            for record, request in results:
+                ex = request.exception()
+                if ex is None:
+                    self._succeeded(record, request.result(), now)
+                    if record.pop('lost', False):
+                        counts['recreated'] += 1
+                    else:
+                        counts['renewed' if request.method == 'PATCH' else 'created'] += 1
+                    updated.append(record)
+                elif isinstance(ex, exceptions.NotFound) and request.method == 'PATCH':
+                    lost.append(record)
+                else:
+                    record.pop('lost', None)
+                    self._failed(record, ex, now)
+                    counts['failed'] += 1
+                    updated.append(record)
+        self._update(updated)
+        return counts
+
+    def _send(self, records, now):
+        expiration = _format_datetime(now + self._lifetime)
+        results = []
+        with self._client.batch(max_workers=self._max_workers) as batch:
+            for record in records:
+                if record['subscription_id']:
+                    request = batch.subscription_renew(record['subscription_id'], expiration)
+                else:
+                    request = batch.subscription_create(record['change_type'], record['notification_url'],
+                                                        record['resource'], expiration, record['client_state'])
+                results.append((record, request))
+        return results
+
+    def _succeeded(self, record, result, now):
+        if result and result.get('id'):
+            record['subscription_id'] = result['id']
+        expires = parse_datetime(result.get('expirationDateTime')) if result else None
+        record['expires_at'] = expires.timestamp() if expires is not None else now + self._lifetime
+        record['renew_at'] = record['expires_at'] - self._renew_before - random.uniform(0, self._spread)
+        record['failures'] = 0
+        replaced = record.pop('replaces', None)
+        if replaced and replaced != record['subscription_id']:
+            self._delete_quietly(replaced)
+
+    def _failed(self, record, ex, now):
+        record['failures'] += 1
+        delay = self._retry_interval * 2 ** min(record['failures'] - 1, 10)
+        retry_after = getattr(ex, 'retry_after', None)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        record['renew_at'] = now + delay
+        if record['expires_at'] is not None and record['subscription_id']:
+            # keep a chance to renew before the expiry, after that the subscription is re-created
+            record['renew_at'] = min(record['renew_at'], max(now, record['expires_at'] - 60))
+        record['last_error'] = repr(ex)
+
+    def _update(self, records):
+        kept, removed = [], []
+        with self._lock:
+            for record in records:
+                if record['key'] not in self._records:
+                    # removed while the round was running
+                    removed.append(record)
+                    continue
+                self._records[record['key']] = record
+                heapq.heappush(self._queue, (record['renew_at'], record['key']))
+                kept.append(record)
+        if kept:
+            self._store.set_many(kept)
+        for record in removed:
+            if record['subscription_id']:
+                self._delete_quietly(record['subscription_id'])
+
+    def _delete_quietly(self, subscription_id):
+        try:
+            self._client.subscription_delete(subscription_id)
+        except exceptions.BaseError:
+            # already gone, or it will expire on its own
+            pass
+
+    def reconcile(self):
+        """Compare the registry with the subscriptions Graph knows about and schedule the missing ones for
+        re-creation right away. Returns the keys that were missing."""
+        known = set(item['id'] for item in self._client.iter_subscriptions())
+        missing = []
+        with self._lock:
+            for key, record in self._records.items():
+                if record['subscription_id'] and record['subscription_id'] not in known:
+                    record = dict(record, subscription_id=None, expires_at=None, renew_at=0, failures=0)
+                    self._records[key] = record
+                    heapq.heappush(self._queue, (0, key))
+                    missing.append(record)
+        self._store.set_many(missing)
+        return [record['key'] for record in missing]
+
+    def start(self, interval=60):
+        """Run run_pending() in a background thread, waking up when the next subscription is due or every
+        interval seconds at the latest."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        stop = self._stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                try:
+                    self.run_pending()
+                except Exception:
+                    # e.g. the token could not be refreshed: try again on the next round
+                    pass
+                due = self.next_due()
+                wait = interval if due is None else min(interval, max(1.0, due - time.time()))
+                stop.wait(wait)
+
+        self._thread = threading.Thread(target=run, name='ts_microsoftgraph-subscriptions', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._thread = None
@@ -0,0 +1,155 @@
+import random
+import threading
+import time
+
+from ts_microsoftgraph import exceptions
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+class RetryPolicy(object):
+    """Decides if and when a failed request is retried.
+
+    429 (TooManyRequests) and 503 (ServiceUnavailable, which includes lockMismatch) mean the request was not
+    processed, so they are retried for every method. Other transient 5xx errors are only retried for idempotent
+    methods, so a POST such as sendMail is never sent twice. The server's Retry-After header is honoured when present,
+    otherwise the delay is an exponential backoff with jitter. A Retry-After longer than max_backoff isn't waited
+    for: the error is raised at once, so the caller can decide when to come back (see BaseError.retry_after).
+    """
+
+    def __init__(self, max_retries=5, backoff_factor=0.5, max_backoff=60.0, jitter=True):
+        """
+        :param max_retries: how many times a request is retried before the error is raised (0 disables retries)
+        :param backoff_factor: the base delay in seconds - attempt n waits about backoff_factor * 2 ** n
+        :param max_backoff: the longest delay in seconds between two attempts, and the longest Retry-After waited for
+        :param jitter: randomise the backoff delays so concurrent workers don't retry in lockstep
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def is_retryable(self, method, exception):
+        if isinstance(exception, (exceptions.TooManyRequests, exceptions.ServiceUnavailable)):
+            return True
+        if isinstance(exception, (exceptions.InternalServerError, exceptions.GatewayTimeout)):
+            return method.upper() in IDEMPOTENT_METHODS
+        return False
+
+    def backoff(self, attempt):
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        if self.jitter:
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        return delay
+
+    def delay(self, method, attempt, exception):
+        """Returns the number of seconds to wait before retry number attempt + 1, or None to give up."""
+        if attempt >= self.max_retries or not self.is_retryable(method, exception):
+            return None
+        retry_after = exception.retry_after
+        if retry_after is not None:
+            # retrying before the server's delay is over would only be throttled again
+            return retry_after if retry_after <= self.max_backoff else None
+        return self.backoff(attempt)
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket that can also be paused, e.g. for the duration of a Retry-After.
+
+    reserve() never blocks: it takes a token and returns how long the caller has to wait before using it, so the
+    same bucket serves both threads (time.sleep) and coroutines (asyncio.sleep).
+    """
+
+    def __init__(self, rate=None, capacity=None):
+        """
+        :param rate: tokens added per second, or None for no rate limit (the bucket then only tracks pauses)
+        :param capacity: the burst size, defaults to one second worth of tokens
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate or 0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.rate:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = -self._tokens / self.rate
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class Throttle(object):
+    """Retry and rate limiting state shared by every Client it is given to.
+
+    Keeps one TokenBucket per context (the 'me' or 'users/{id}' mailbox) and optionally one for the whole app, so
+    concurrent workers hitting the same mailbox share its budget. When Graph answers 429 or 503 with a Retry-After,
+    the context's bucket is paused for that long and every worker backs off, not just the one that got the error.
+
+    The counters in metrics() are cumulative: requests, retries, throttled (429/503 responses) and sleep_seconds.
+    """
+
+    def __init__(self, policy: RetryPolicy = None, rate=None, burst=None, app_rate=None, app_burst=None):
+        """
+        :param policy: the RetryPolicy, defaults to RetryPolicy()
+        :param rate: requests per second allowed per context, or None for no proactive limit
+        :param burst: the burst size per context
+        :param app_rate: requests per second allowed across all contexts, or None for no limit
+        :param app_burst: the burst size across all contexts
+        """
+        self.policy = RetryPolicy() if policy is None else policy
+        self._rate = rate
+        self._burst = burst
+        self._app_bucket = TokenBucket(app_rate, app_burst) if app_rate else None
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._metrics = {'requests': 0, 'retries': 0, 'throttled': 0, 'sleep_seconds': 0.0}
+
+    def bucket(self, context) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(context)
+            if bucket is None:
+                bucket = self._buckets[context] = TokenBucket(self._rate, self._burst)
+            return bucket
+
+    def acquire(self, context):
+        """Take a slot for one request in context. Returns the number of seconds to wait before sending it."""
+        wait = self.bucket(context).reserve()
+        if self._app_bucket is not None:
+            wait = max(wait, self._app_bucket.reserve())
+        self._count('requests', 1)
+        if wait > 0:
+            self._count('sleep_seconds', wait)
+        return wait
+
+    def retry_delay(self, context, method, attempt, exception):
+        """Returns the number of seconds to wait before retrying a failed request, or None if it must not be retried."""
+        throttled = isinstance(exception, (exceptions.TooManyRequests, exceptions.ServiceUnavailable))
+        if throttled:
+            self._count('throttled', 1)
+        delay = self.policy.delay(method, attempt, exception)
+        if delay is None:
+            return None
+        if throttled and exception.retry_after is not None:
+            self.bucket(context).pause(delay)
+        self._count('retries', 1)
+        self._count('sleep_seconds', delay)
+        return delay
+
+    def _count(self, name, value):
+        with self._lock:
+            self._metrics[name] += value
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._metrics)
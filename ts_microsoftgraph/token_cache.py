@@ -0,0 +1,77 @@
+import threading
+import time
+
+
+class TokenCache(object):
+    """A thread-safe, in-memory cache of access tokens keyed by (tenant_id, client_id, scope).
+
+    Used by app-only Auth objects so one process can hold tokens for many tenants, and any number of Auth objects
+    and clients for the same tenant share a single token. Entries are evicted once they expire (or after ttl seconds,
+    whichever comes first), and the cache never grows beyond max_entries.
+    """
+
+    def __init__(self, ttl=None, max_entries=10000):
+        """
+        :param ttl: optional maximum number of seconds to keep a token, even if it expires later
+        :param max_entries: the maximum number of tokens kept - the ones closest to expiry are evicted first
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _expiry(self, token):
+        expires_at = token.get('expires_at')
+        if self._ttl is not None:
+            ttl_expiry = time.time() + self._ttl
+            expires_at = ttl_expiry if expires_at is None else min(expires_at, ttl_expiry)
+        return expires_at
+
+    def get(self, key):
+        """Returns the cached token for key, or None if there is none or it has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            token, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            return token
+
+    def set(self, key, token):
+        with self._lock:
+            self._entries[key] = (token, self._expiry(token))
+            if len(self._entries) > self._max_entries:
+                self._evict()
+
+    def remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def lock(self, key):
+        """A lock per key, used to make sure only one token request per key is in flight."""
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def evict_expired(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, (_, expires_at) in self._entries.items() if expires_at is not None and expires_at <= now]:
+            del self._entries[key]
+        overflow = len(self._entries) - self._max_entries
+        if overflow > 0:
+            by_expiry = sorted(self._entries.items(), key=lambda item: item[1][1] or float('inf'))
+            for key, _ in by_expiry[:overflow]:
+                del self._entries[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,221 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# how long a process waits for another one to release a Windows lock file, and between two attempts
+LOCK_TIMEOUT = 60.0
+_LOCK_POLL_INTERVAL = 0.05
+
+
+class TokenStore(object):
+    """Where Auth keeps its tokens so that several processes (e.g. the workers of a web server) share them.
+
+    Besides storage, a store provides a lock that excludes other processes as well as other threads: Auth holds it
+    while it refreshes a token, and whoever gets it next finds the new token instead of refreshing again. The lock
+    is reentrant, and save() may be called while holding it.
+    """
+
+    def load(self, key):
+        """Returns the token dict stored for key, or None."""
+        raise NotImplementedError
+
+    def save(self, key, token):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def lock(self, key):
+        """A context manager holding the lock for key, across threads and processes."""
+        raise NotImplementedError
+
+
+class _FileLock(object):
+    # an exclusive lock on a lock file, reentrant within the owning thread
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self._path = path
+        self._timeout = timeout
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                else:
+                    deadline = time.monotonic() + self._timeout
+                    while True:
+                        try:
+                            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                            break
+                        except OSError:
+                            if time.monotonic() >= deadline:
+                                raise TimeoutError('Could not lock {} within {} seconds'.format(self._path,
+                                                                                                self._timeout))
+                            time.sleep(_LOCK_POLL_INTERVAL)
+            except BaseException:
+                os.close(fd)
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(fd)
+        self._lock.release()
+
+
+class FileTokenStore(TokenStore):
+    """Keeps the tokens in one JSON file, readable only by its owner.
+
+    Writes go to a temp file that is then renamed over the store, under a lock on path + '.lock', so readers never
+    see a partial file and concurrent writers don't lose each other's tokens. The parsed file is cached in memory
+    and only read again when its modification time, size or inode changes - load() is a stat() call otherwise.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file_lock = _FileLock(path + '.lock')
+        self._lock = threading.Lock()
+        self._signature = None
+        self._tokens = {}
+
+    def _read(self):
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return {}
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if signature != self._signature:
+                try:
+                    with open(self._path, 'r') as f:
+                        self._tokens = json.load(f)
+                except FileNotFoundError:
+                    return {}
+                self._signature = signature
+            return self._tokens
+
+    def _write(self, tokens):
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tokens-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(tokens, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load(self, key):
+        return self._read().get(key)
+
+    def save(self, key, token):
+        with self._file_lock:
+            tokens = dict(self._read())
+            tokens[key] = token
+            self._write(tokens)
+
+    def delete(self, key):
+        with self._file_lock:
+            tokens = dict(self._read())
+            if tokens.pop(key, None) is not None:
+                self._write(tokens)
+
+    def lock(self, key):
+        # one lock for the whole file
+        return self._file_lock
+
+
+class SQLiteTokenStore(TokenStore):
+    """Keeps the tokens in a SQLite database, one row per key.
+
+    The lock is a write transaction (BEGIN IMMEDIATE), which other processes wait for. Reads go through a second
+    connection, so they don't wait for a refresh holding the lock, and tokens read are cached in memory until a
+    change is committed to the database (PRAGMA data_version).
+    """
+
+    def __init__(self, path, timeout=30):
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, token TEXT NOT NULL)')
+        self._read_lock = threading.Lock()
+        self._reader = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._version = None
+        self._tokens = {}
+
+    def load(self, key):
+        with self._read_lock:
+            version = self._reader.execute('PRAGMA data_version').fetchone()[0]
+            if version != self._version:
+                self._tokens.clear()
+                self._version = version
+            if key not in self._tokens:
+                row = self._reader.execute('SELECT token FROM tokens WHERE key = ?', (key,)).fetchone()
+                self._tokens[key] = json.loads(row[0]) if row is not None else None
+            return self._tokens[key]
+
+    def save(self, key, token):
+        with self.lock(key):
+            self._db.execute('INSERT OR REPLACE INTO tokens (key, token) VALUES (?, ?)', (key, json.dumps(token)))
+            with self._read_lock:
+                self._tokens[key] = token
+
+    def delete(self, key):
+        with self.lock(key):
+            self._db.execute('DELETE FROM tokens WHERE key = ?', (key,))
+            with self._read_lock:
+                self._tokens[key] = None
+
+    @contextmanager
+    def lock(self, key):
+        with self._lock:
+            if self._depth == 0:
+                self._db.execute('BEGIN IMMEDIATE')
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._db.execute('ROLLBACK')
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._db.execute('COMMIT')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+        with self._read_lock:
+            self._reader.close()
@@ -0,0 +1,312 @@
+import hmac
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import parse_qs
+
+from ts_microsoftgraph import decoder
+from ts_microsoftgraph.client import Client
+
+logger = logging.getLogger('ts_microsoftgraph.webhooks')
+
+Notification = namedtuple('Notification', ['subscription_id', 'change_types', 'resource', 'resource_id',
+                                           'client_state', 'tenant_id', 'lifecycle_event', 'raw'])
+Notification.__doc__ = """A change notification. change_types is a tuple ('created', 'updated', 'deleted'), with more than one
+entry when several notifications for the same resource were coalesced. lifecycle_event is set (and resource empty)
+for lifecycle notifications such as 'reauthorizationRequired' or 'missed'. raw is the last notification as sent by
+Graph."""
+
+
+def _notification(raw):
+    return Notification(
+        subscription_id=raw.get('subscriptionId'),
+        change_types=tuple(change.strip() for change in (raw.get('changeType') or '').split(',') if change.strip()),
+        resource=raw.get('resource') or '',
+        resource_id=(raw.get('resourceData') or {}).get('id'),
+        client_state=raw.get('clientState'),
+        tenant_id=raw.get('tenantId'),
+        lifecycle_event=raw.get('lifecycleEvent'),
+        raw=raw)
+
+
+class NotificationDispatcher(object):
+    """Queues notifications and hands them to handler on a pool of worker threads.
+
+    Notifications for the same resource that are still waiting are coalesced into one, so a burst of updates to a
+    message costs a single fetch. Each one waits coalesce_delay seconds before a worker picks it up, to give the
+    rest of a burst the time to arrive. With a client, the worker fetches the resource first and calls
+    handler(notification, item) - item is None for deleted resources, lifecycle notifications and failed fetches
+    (see on_error). Without a client, item is always None.
+
+    The queue holds at most max_pending resources: submit() refuses the notifications beyond that, so the receiver
+    can ask Graph to deliver them again later instead of running out of memory.
+    """
+
+    def __init__(self, handler, client: Client = None, workers=8, max_pending=100000, coalesce_delay=0.5,
+                 on_error=None, params=None):
+        """
+        Args:
+            handler: called as handler(notification, item) on a worker thread.
+            client: the Client used to fetch the changed resources, None to not fetch them.
+            workers: the number of worker threads.
+            max_pending: the most distinct resources waiting in the queue.
+            coalesce_delay: seconds a notification waits for others about the same resource.
+            on_error: called as on_error(notification, exception) when a fetch or the handler fails. Failures are
+                logged if omitted.
+            params: query parameters for the fetches, e.g. {'$select': 'subject,from'}.
+        """
+        self._handler = handler
+        self._client = client
+        self._workers = workers
+        self._max_pending = max_pending
+        self._coalesce_delay = coalesce_delay
+        self._on_error = on_error
+        self._params = params
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._busy = 0
+        self._stats = {'received': 0, 'coalesced': 0, 'rejected': 0, 'dispatched': 0, 'failed': 0}
+
+    @staticmethod
+    def _key(notification):
+        if notification.lifecycle_event:
+            return 'lifecycle', notification.subscription_id, notification.lifecycle_event
+        return 'resource', notification.resource.lower()
+
+    def submit(self, notifications):
+        """Queue notifications without blocking. Returns False if the queue was full and some were refused."""
+        accepted = True
+        now = time.monotonic()
+        with self._condition:
+            for notification in notifications:
+                self._stats['received'] += 1
+                key = self._key(notification)
+                waiting = self._pending.get(key)
+                if waiting is not None:
+                    self._pending[key] = (self._merge(waiting[0], notification), waiting[1])
+                    self._stats['coalesced'] += 1
+                elif len(self._pending) >= self._max_pending:
+                    self._stats['rejected'] += 1
+                    accepted = False
+                else:
+                    self._pending[key] = (notification, now)
+            self._condition.notify(self._workers)
+        return accepted
+
+    @staticmethod
+    def _merge(first, second):
+        change_types = first.change_types + tuple(change for change in second.change_types
+                                                  if change not in first.change_types)
+        return second._replace(change_types=change_types)
+
+    def _take(self):
+        # the oldest notification, once it has waited coalesce_delay - None when stopped
+        with self._condition:
+            while True:
+                if not self._running:
+                    return None
+                if self._pending:
+                    key, (notification, queued_at) = next(iter(self._pending.items()))
+                    wait = queued_at + self._coalesce_delay - time.monotonic()
+                    if wait <= 0:
+                        del self._pending[key]
+                        self._busy += 1
+                        return notification
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def _dispatch(self, notification):
+        item = None
+        try:
+            if self._client is not None and not notification.lifecycle_event and notification.resource and \
+                    'deleted' not in notification.change_types:
+                item = self._client._get(self._client._base_url + notification.resource, params=self._params)
+            self._handler(notification, item)
+            self._count('dispatched')
+        except Exception as ex:
+            self._count('failed')
+            if self._on_error is not None:
+                self._on_error(notification, ex)
+            else:
+                logger.exception('Failed to handle the notification for %s', notification.resource)
+
+    def _run(self):
+        while True:
+            notification = self._take()
+            if notification is None:
+                return
+            try:
+                self._dispatch(notification)
+            finally:
+                with self._condition:
+                    self._busy -= 1
+                    self._condition.notify_all()
+
+    def _count(self, name):
+        with self._condition:
+            self._stats[name] += 1
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return self
+            self._running = True
+        self._threads = [threading.Thread(target=self._run, name='ts_microsoftgraph-notifications-{}'.format(i),
+                                          daemon=True) for i in range(self._workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def join(self, timeout=None):
+        """Wait until every queued notification has been handled. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining if remaining is not None else 0.1)
+        return True
+
+    def stop(self, drain=True, timeout=None):
+        """Stop the workers, after handling the queued notifications if drain is True."""
+        if drain:
+            self.join(timeout)
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def stats(self):
+        """Returns the received, coalesced, rejected, dispatched and failed counters."""
+        with self._condition:
+            return dict(self._stats)
+
+
+class WebhookReceiver(object):
+    """The notification url endpoint, as a WSGI application (the receiver itself) and an ASGI one (receiver.asgi).
+
+    It answers Graph's validation request by echoing the validationToken, drops notifications whose clientState
+    doesn't match, and queues the others on the dispatcher before answering 202 - nothing slow happens while Graph
+    waits for the response. If the dispatcher's queue is full it answers 503 with a Retry-After, and Graph delivers
+    the notifications again later.
+
+        dispatcher = NotificationDispatcher(handle_change, client=client).start()
+        app = WebhookReceiver(dispatcher, client_state='the secret given to subscription_create')
+    """
+
+    def __init__(self, dispatcher: NotificationDispatcher, client_state=None, retry_after=30,
+                 max_body_size=4 * 1024 * 1024):
+        """
+        Args:
+            dispatcher: the NotificationDispatcher the notifications are queued on.
+            client_state: the expected clientState - a string, a collection of strings, or a function called as
+                client_state(subscription_id, client_state) returning True for valid ones. None accepts any.
+            retry_after: the Retry-After in seconds sent with a 503 when the queue is full.
+            max_body_size: bodies above this size are refused with 413.
+        """
+        self._dispatcher = dispatcher
+        self._client_state = client_state
+        self._retry_after = retry_after
+        self._max_body_size = max_body_size
+        self._lock = threading.Lock()
+        self._invalid = 0
+
+    @property
+    def invalid(self):
+        """The number of notifications dropped because of a wrong clientState."""
+        with self._lock:
+            return self._invalid
+
+    def _valid(self, notification):
+        expected = self._client_state
+        if expected is None:
+            return True
+        if callable(expected):
+            return bool(expected(notification.subscription_id, notification.client_state))
+        actual = notification.client_state
+        if not isinstance(actual, str):
+            return False
+        # compared as bytes: compare_digest() refuses str with non-ASCII characters
+        actual = actual.encode('utf-8')
+        if isinstance(expected, str):
+            return hmac.compare_digest(expected.encode('utf-8'), actual)
+        return any(hmac.compare_digest(candidate.encode('utf-8'), actual) for candidate in expected)
+
+    def handle(self, method, query_string, body):
+        """Answer a request: returns (status, headers, body bytes). Used by the WSGI and ASGI entry points."""
+        query = parse_qs(query_string)
+        if 'validationToken' in query:
+            # subscription (or lifecycle) validation: echo the token within 10 seconds
+            return '200 OK', [('Content-Type', 'text/plain')], query['validationToken'][0].encode('utf-8')
+        if method != 'POST':
+            return '405 Method Not Allowed', [('Allow', 'POST')], b''
+        if body is None:
+            return '413 Payload Too Large', [], b''
+        try:
+            payload = decoder.loads(body)
+            notifications = [_notification(raw) for raw in payload.get('value', [])]
+        except Exception:
+            return '400 Bad Request', [], b''
+        valid = [notification for notification in notifications if self._valid(notification)]
+        if len(valid) < len(notifications):
+            with self._lock:
+                self._invalid += len(notifications) - len(valid)
+        if not self._dispatcher.submit(valid):
+            return '503 Service Unavailable', [('Retry-After', str(self._retry_after))], b''
+        return '202 Accepted', [], b''
+
+    def __call__(self, environ, start_response):
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        body = environ['wsgi.input'].read(length) if length <= self._max_body_size else None
+        status, headers, content = self.handle(environ['REQUEST_METHOD'], environ.get('QUERY_STRING', ''), body)
+        start_response(status, headers + [('Content-Length', str(len(content)))])
+        return [content]
+
+    async def asgi(self, scope, receive, send):
+        if scope['type'] != 'http':
+            if scope['type'] == 'lifespan':
+                while True:
+                    message = await receive()
+                    if message['type'] == 'lifespan.startup':
+                        await send({'type': 'lifespan.startup.complete'})
+                    elif message['type'] == 'lifespan.shutdown':
+                        await send({'type': 'lifespan.shutdown.complete'})
+                        return
+            return
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size <= self._max_body_size:
+                chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        body = b''.join(chunks) if size <= self._max_body_size else None
+        status, headers, content = self.handle(scope['method'], scope.get('query_string', b'').decode('latin-1'),
+                                               body)
+        await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers + [('Content-Length', str(len(content)))]]})
+        await send({'type': 'http.response.body', 'body': content})